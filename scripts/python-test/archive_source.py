@@ -0,0 +1,209 @@
+import check_component_docs
+import config
+import hashlib
+import mapped_docs
+import metrics
+import os
+import posixpath
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+
+logger = metrics.get_logger(__name__)
+
+# Docs right in the docs folder, wherever the archive has it. Release tarballs put
+# everything under a "<repo>-<version>/" folder, PurePosixPath.match takes care of
+# that since a relative pattern matches from the right
+DEFAULT_PATTERN = f"{config.GIT_DOCS_PATH}/*"
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+ZIP_SUFFIXES = (".zip",)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def git_blob_id(data):
+    # Same id git gives the content, so a doc keeps its id from git to archive
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def is_doc_member(path, pattern):
+    _, extension = posixpath.splitext(path)
+    if extension not in check_component_docs.ALLOWED_EXTENSIONS:
+        return False
+    return PurePosixPath(path).match(pattern)
+
+
+def iter_tar_members(archive_path, pattern):
+    # Stream mode reads the archive front to back once, compressed or not, which
+    # is all a .tar.gz allows without decompressing it over and over
+    try:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and is_doc_member(member.name, pattern):
+                    data = archive.extractfile(member).read()
+                    yield member.name, member.offset_data, data
+    except (OSError, tarfile.TarError) as e:
+        raise ArchiveError(f"Could not read {archive_path}: {e}") from e
+
+
+def iter_zip_members(archive_path, pattern):
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_doc_member(info.filename, pattern):
+                    yield info.filename, None, archive.read(info)
+    except (OSError, zipfile.BadZipFile) as e:
+        raise ArchiveError(f"Could not read {archive_path}: {e}") from e
+
+
+def get_archive_kind(archive_path):
+    # "zip", "tar" or "compressed tar", only the first two can be read at any member
+    name = os.path.basename(archive_path).lower()
+    if name.endswith(ZIP_SUFFIXES):
+        return "zip"
+    if name.endswith(".tar"):
+        return "tar"
+    if name.endswith(TAR_SUFFIXES):
+        return "compressed tar"
+    raise ArchiveError(
+        f"{archive_path} is not one of {', '.join(TAR_SUFFIXES + ZIP_SUFFIXES)}."
+    )
+
+
+def iter_members(archive_path, pattern=DEFAULT_PATTERN):
+    """
+    Yields (member path, data offset, content bytes) for every regular file in a
+    .tar, .tar.gz or .zip archive that matches pattern and has one of the doc
+    extensions. The offset is where a tar member's data starts, in the
+    uncompressed tar, and None for a zip. Nothing gets extracted to disk.
+    """
+    if get_archive_kind(archive_path) == "zip":
+        return iter_zip_members(archive_path, pattern)
+    return iter_tar_members(archive_path, pattern)
+
+
+class ArchiveSource:
+    """
+    Upstream docs read straight out of a release tarball or zip artifact, used
+    everywhere a git_source.GitSource is. The archive is read once, front to back,
+    and the docs matching pattern are kept in memory. Docs are keyed by filename
+    and git blob id.
+
+    Instances sent to pool workers leave the docs behind, a worker reads the ones
+    it's handed straight from a zip or tar, or decompresses a compressed tar
+    once, like every process starts its own cat-file for a GitSource.
+
+    There's no history to diff against, the commit is a digest of all the docs
+    so an identical snapshot is recognised as one.
+    """
+
+    def __init__(self, archive_path, pattern=DEFAULT_PATTERN):
+        self.archive_path = archive_path
+        self.docs_path = pattern
+        self.contents = {}
+        self.blobs = {}
+        # filename -> (member path, data offset, size), see iter_members
+        self.members = {}
+        self.archive = None
+        for path, offset, data in iter_members(archive_path, pattern):
+            filename = posixpath.basename(path)
+            if filename in self.members:
+                raise ArchiveError(
+                    f"{path} and {self.members[filename][0]} in {archive_path} are "
+                    f"both {filename}, narrow the pattern down."
+                )
+            self.members[filename] = (path, offset, len(data))
+            self.contents[filename] = data
+            self.blobs[filename] = git_blob_id(data)
+            metrics.count("io.archive_members_read")
+            metrics.count("io.bytes_read", len(data))
+        if not self.blobs:
+            raise ArchiveError(f"No docs in {archive_path} match '{pattern}'.")
+
+        digest = hashlib.sha1()
+        for filename, blob_id in sorted(self.blobs.items()):
+            digest.update(f"{filename}\0{blob_id}\0".encode("utf-8"))
+        self.commit = digest.hexdigest()
+        logger.debug("%d docs in %s", len(self.blobs), archive_path)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["contents"] = None
+        state["archive"] = None
+        return state
+
+    def read_member(self, filename):
+        # The doc's bytes, or None if the archive doesn't have it
+        if self.contents is not None:
+            return self.contents.get(filename)
+        member = self.members.get(filename)
+        if member is None:
+            return None
+        path, offset, size = member
+        kind = get_archive_kind(self.archive_path)
+        if kind == "compressed tar":
+            # No way to get at one member, this process keeps all of them
+            self.contents = {
+                posixpath.basename(path): data
+                for path, _, data in iter_members(self.archive_path, self.docs_path)
+            }
+            return self.contents.get(filename)
+
+        try:
+            if kind == "zip":
+                if self.archive is None:
+                    self.archive = zipfile.ZipFile(self.archive_path)
+                data = self.archive.read(path)
+            else:
+                if self.archive is None:
+                    self.archive = open(self.archive_path, "rb")
+                self.archive.seek(offset)
+                data = self.archive.read(size)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise ArchiveError(
+                f"Could not read {path} from {self.archive_path}: {e}"
+            ) from e
+        metrics.count("io.archive_members_read")
+        metrics.count("io.bytes_read", len(data))
+        return data
+
+    def key(self, filename):
+        # What the build manifest records the doc under
+        return f"archive:{filename}"
+
+    def scan(self):
+        # Same shape as manifest.scan_sources, with the blob id as the signature
+        return {
+            filename: {self.key(filename): blob_id}
+            for filename, blob_id in self.blobs.items()
+        }
+
+    def changes_since(self, old_commit):
+        # An archive only knows its own snapshot, None means every doc gets looked at
+        return None
+
+    def read_text(self, filename):
+        # The doc as text, or None if the archive doesn't have it
+        data = self.read_member(filename)
+        if data is None:
+            return None
+        # Same newlines as reading a checked out file in text mode
+        return mapped_docs.decode(data)
+
+    def size(self, filename):
+        member = self.members.get(filename)
+        return None if member is None else member[2]
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,261 @@
+import config
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import check_component_docs
+import extract_defaults
+import generate_corpus
+import move_templates_to_plugin
+import pipeline
+import write_to_template
+
+FILE_OPS = (
+    "open_read",
+    "open_write",
+    "listdir",
+    "scandir",
+    "remove",
+    "rename",
+    "copy",
+    "mkdir",
+)
+
+# Audit events that map straight onto a counter, "open" is split by its flags
+AUDIT_EVENTS = {
+    "os.listdir": "listdir",
+    "os.scandir": "scandir",
+    "os.remove": "remove",
+    "os.rename": "rename",
+    "shutil.copyfile": "copy",
+    "os.mkdir": "mkdir",
+}
+
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND
+
+STAGES = {
+    "check_and_generate_docs": check_component_docs.check_and_generate_docs,
+    "extract_defaults": extract_defaults.extract_defaults,
+    "write_to_template": write_to_template.write_to_template,
+    "move_templates_to_plugin": move_templates_to_plugin.move_templates_to_plugin,
+}
+
+# Fork so measured functions don't need pickling and pool workers inherit the counters
+CONTEXT = multiprocessing.get_context("fork")
+
+
+def install_file_op_counter(counters):
+    def hook(event, args):
+        if event == "open":
+            key = "open_write" if args[2] & WRITE_FLAGS else "open_read"
+        else:
+            key = AUDIT_EVENTS.get(event)
+            if key is None:
+                return
+        with counters.get_lock():
+            counters[FILE_OPS.index(key)] += 1
+
+    sys.addaudithook(hook)
+
+
+def run_child(function, workspace, counters, connection):
+    os.chdir(workspace)
+    install_file_op_counter(counters)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - started
+
+    peak_rss_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    connection.send({"seconds": seconds, "peak_rss_kb": peak_rss_kb})
+    connection.close()
+
+
+def measure(function, workspace):
+    # Runs the function in a fresh process so peak RSS belongs to it alone
+    counters = CONTEXT.Array("q", len(FILE_OPS))
+    receiver, sender = CONTEXT.Pipe(duplex=False)
+    process = CONTEXT.Process(
+        target=run_child, args=(function, workspace, counters, sender)
+    )
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"Benchmark child failed with exit code {process.exitcode}.")
+    process.join()
+
+    result["file_ops"] = dict(zip(FILE_OPS, counters[:]))
+    return result
+
+
+def create_workspace(root, corpus_directory, name):
+    # Mirrors the repo layout so the relative plugin resource path resolves
+    workspace = os.path.join(root, name, "scripts", "python-test")
+    os.makedirs(workspace)
+    os.makedirs(
+        os.path.normpath(os.path.join(workspace, config.DIR_PLUGIN_RESOURCE_FOLDER))
+    )
+    shutil.copytree(
+        corpus_directory, os.path.join(workspace, config.DIR_DOCS_FROM_REPO)
+    )
+    return workspace
+
+
+def summarize(runs, docs, corpus_bytes):
+    seconds = [run["seconds"] for run in runs]
+    median = statistics.median(seconds)
+    return {
+        "seconds": median,
+        "seconds_min": min(seconds),
+        "seconds_max": max(seconds),
+        "docs_per_second": docs / median if median else None,
+        "mb_per_second": corpus_bytes / median / 1e6 if median else None,
+        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+        "file_ops": runs[-1]["file_ops"],
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(docs=1000, seed=0, repeat=3, workers=None, executor="process"):
+    root = tempfile.mkdtemp(prefix="shadcn-snippets-bench-")
+    try:
+        corpus_directory = os.path.join(root, "corpus")
+        generate_corpus.generate_corpus(corpus_directory, docs, seed)
+        corpus_bytes = sum(
+            entry.stat().st_size for entry in os.scandir(corpus_directory)
+        )
+
+        runs = {name: [] for name in STAGES}
+        runs["stages_total"] = []
+        runs["pipeline"] = []
+        runs["pipeline_noop"] = []
+
+        for iteration in range(repeat):
+            workspace = create_workspace(root, corpus_directory, f"stages-{iteration}")
+            total = {"seconds": 0.0, "peak_rss_kb": 0, "file_ops": {}}
+            for name, function in STAGES.items():
+                result = measure(function, workspace)
+                runs[name].append(result)
+                total["seconds"] += result["seconds"]
+                total["peak_rss_kb"] = max(total["peak_rss_kb"], result["peak_rss_kb"])
+                for key, count in result["file_ops"].items():
+                    total["file_ops"][key] = total["file_ops"].get(key, 0) + count
+            runs["stages_total"].append(total)
+
+            workspace = create_workspace(
+                root, corpus_directory, f"pipeline-{iteration}"
+            )
+            runs["pipeline"].append(
+                measure(
+                    lambda: pipeline.run_pipeline(
+                        workers=workers, executor=executor, incremental=True
+                    ),
+                    workspace,
+                )
+            )
+            runs["pipeline_noop"].append(
+                measure(
+                    lambda: pipeline.run_pipeline(
+                        workers=workers, executor=executor, incremental=True
+                    ),
+                    workspace,
+                )
+            )
+
+        return {
+            "meta": {
+                "docs": docs,
+                "corpus_bytes": corpus_bytes,
+                "seed": seed,
+                "repeat": repeat,
+                "workers": workers or os.cpu_count(),
+                "executor": executor,
+                "cpu_count": os.cpu_count(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "commit": get_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+            "results": {
+                name: summarize(name_runs, docs, corpus_bytes)
+                for name, name_runs in runs.items()
+            },
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Benchmark",
+        description="Time every stage and the whole pipeline on a synthetic doc corpus.",
+    )
+    parser.add_argument("-n", "--docs", type=int, default=1000, help="Number of docs.")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed.")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Runs per measurement."
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None, help="Pipeline workers."
+    )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        choices=sorted(pipeline.EXECUTORS),
+        default="process",
+        help="Pipeline executor.",
+    )
+    parser.add_argument(
+        "-o", "--output", help="Write the JSON report here instead of stdout."
+    )
+    args = parser.parse_args()
+
+    if args.docs < 1 or args.repeat < 1:
+        parser.error("--docs and --repeat need to be at least 1.")
+
+    report = run_benchmark(
+        docs=args.docs,
+        seed=args.seed,
+        repeat=args.repeat,
+        workers=args.workers,
+        executor=args.executor,
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import asyncio
+import mapped_docs
+import metrics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = metrics.get_logger(__name__)
+
+# Reads kept in flight at once. Enough to hide the latency of a network mount
+# without opening half the corpus at the same time
+DEFAULT_MAX_IN_FLIGHT = 16
+
+
+class FileRead:
+    """
+    The outcome of reading one file, data is the content (bytes) or None if
+    reading failed, in which case error holds the exception.
+    """
+
+    def __init__(self, path, data=None, error=None):
+        self.path = path
+        self.data = data
+        self.error = error
+
+    def text(self):
+        # Same as reading the file in text mode, raises the read error if there was one
+        if self.error is not None:
+            raise self.error
+        return mapped_docs.decode(self.data)
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"FileRead({self.path!r}, error={self.error!r})"
+        return f"FileRead({self.path!r}, {len(self.data)} bytes)"
+
+
+def read_file(path):
+    # Never raises, so one unreadable file doesn't take the others down with it
+    try:
+        with open(path, "rb") as file:
+            metrics.count_read(file)
+            return FileRead(path, file.read())
+    except Exception as e:
+        return FileRead(path, error=e)
+
+
+async def aread_files(
+    paths, max_in_flight=DEFAULT_MAX_IN_FLIGHT, executor=None, read=read_file
+):
+    """
+    Reads files on a thread pool, yielding a FileRead per path in the order of paths.
+    At most max_in_flight reads are started ahead of the consumer, a new one only
+    starts when a result is taken, so a slow consumer holds back the reads.
+
+    :param read: Called with each path on the pool, whatever it returns is yielded
+        instead of a FileRead. It shouldn't raise, e.g. mapped_docs callers map
+        and index a doc right there and only hand back offsets.
+    """
+    loop = asyncio.get_running_loop()
+    paths = iter(paths)
+    pending = deque()
+
+    def start_next():
+        for path in paths:
+            pending.append(loop.run_in_executor(executor, read, path))
+            return
+
+    for _ in range(max(1, max_in_flight)):
+        start_next()
+    try:
+        while pending:
+            result = await pending.popleft()
+            start_next()
+            yield result
+    finally:
+        # Reads already running finish on their own, queued ones never start
+        for future in pending:
+            future.cancel()
+
+
+def read_files(paths, max_in_flight=DEFAULT_MAX_IN_FLIGHT, read=read_file):
+    """
+    Same as aread_files for synchronous callers, the event loop only runs while the
+    caller waits for the next file, the reads themselves keep going in between.
+    Close the generator (or exhaust it) to stop the reads and the pool.
+    """
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, max_in_flight), thread_name_prefix="bulk-read"
+    )
+    reads = aread_files(paths, max_in_flight, executor, read)
+    try:
+        while True:
+            try:
+                result = loop.run_until_complete(reads.__anext__())
+            except StopAsyncIteration:
+                break
+            yield result
+    finally:
+        loop.run_until_complete(reads.aclose())
+        executor.shutdown(wait=True, cancel_futures=True)
+        loop.close()
@@ -1,7 +1,17 @@
-import re
 import os
+import bulk_read
 import config
+import doc_index
+import mapped_docs
+import metrics
+import overlay_index
+import profiling
+import reconcile
 
+logger = metrics.get_logger(__name__)
+
+
+ALLOWED_EXTENSIONS = overlay_index.DOC_EXTENSIONS
 
 TEMPLATE_DOC_USAGE_SECTION = """
 ```tsx
@@ -14,130 +24,265 @@ TEMPLATE_DOC_USAGE_SECTION = """
 """
 
 
-# duplicate code with extract
 def extract_code_blocks(text):
-    # Regular expression to match content between code blocks, ignoring any metadata
-    pattern = r"```(?:[^\n]*\n)(.*?)```"
-    # re.DOTALL allows . to match newlines
-    matches = re.findall(pattern, text, re.DOTALL)
-    return [match.strip() for match in matches]
+    return [block.text for block in doc_index.index_doc(text).code_blocks]
+
+
+def check_doc_file(file_path):
+    # Returns (True, (filename, file_path, usage_section)) for a good file,
+    # (False, (filename, file_path, reason)) for a bad one,
+    # or None if the file should be skipped entirely
+    filename = os.path.basename(file_path)
+    logger.debug("Checking %s", filename)
+    # Skip directories
+    if os.path.isdir(file_path):
+        logger.debug("Skipping, %s is a directory.", filename)
+        return None
+
+    metrics.count("check.files_seen")
+    with metrics.timer("file.check", file_path):
+        result = check_doc_path(filename, file_path)
+
+    count_verdict(result)
+    return result
+
+
+def check_doc_text(filename, source_path, content):
+    # Same as check_doc_file for a doc that's already in memory, e.g. read from git
+    # source_path only ends up in the returned entry
+    logger.debug("Checking %s", filename)
+    metrics.count("check.files_seen")
+    with metrics.timer("file.check", source_path):
+        result = check_extension(filename, source_path) or check_doc_content(
+            filename, source_path, content
+        )
 
+    count_verdict(result)
+    return result
 
-def check_files_in_directory(directory_path):
 
-    unsupported_files = []
-    cant_find_usage_section_files = []
+def count_verdict(result):
+    if result is not None:
+        is_good, entry = result
+        if is_good:
+            metrics.count("check.files_accepted")
+        else:
+            metrics.reject(entry[2])
 
-    good_files = []
-    bad_files = []
-    allowed_extensions = {".md", ".mdx", ".txt"}
 
-    # Iterate through all files in the directory
-    for filename in os.listdir(directory_path):
-        usage_code_block_for_writing = ""
-        print(f"Checking {filename}")
+def check_extension(filename, file_path):
+    # Get the file extension
+    _, file_extension = os.path.splitext(filename)
+
+    # Check if the file extension is allowed
+    if file_extension not in ALLOWED_EXTENSIONS:
+        logger.debug(
+            "Skipping, %s because %s is not allowed.", filename, file_extension
+        )
+        return False, (filename, file_path, "Unexpected file extension.")
+
+    return None
+
+
+def check_doc_path(filename, file_path):
+    result = check_extension(filename, file_path)
+    if result is not None:
+        return result
+
+    # Process file content
+    return check_doc_read(filename, bulk_read.read_file(file_path))
+
+
+def check_doc_content(filename, file_path, content, file_id=None):
+    # content can also be mapped bytes of the doc with its mapped_docs file_id,
+    # then a good doc's usage section is returned as a mapped_docs.TextSpan
+    usage = doc_index.index_doc(content).find_section("Usage")
+    if usage is None:
+        # print(f"Couldn't find Usage section in {filename}")
+        return False, (filename, file_path, "Could not find Usage section.")
+
+    # Count before pulling any text out of the doc
+    usage_blocks = usage.code_blocks
+    if len(usage_blocks) > 2:
+        # print(f"Error: too much, need manual check {filename}")
+        return False, (filename, file_path, "Has more than 2 code blocks.")
+    elif len(usage_blocks) < 2:
+        return False, (filename, file_path, "Has less than 2 code blocks.")
+
+    code_blocks = [mapped_docs.as_text(block.text) for block in usage_blocks]
+
+    # check if import is okay
+    # should only have one import string, should end with "
+    if code_blocks[0].count("import") > 1:
+        return False, (
+            filename,
+            file_path,
+            "Import code block has more than one import.",
+        )
+
+    if not code_blocks[0].endswith('"') and not code_blocks[0].endswith('";'):
+        return False, (
+            filename,
+            file_path,
+            'Import code block does not end with expected " or "; char.',
+        )
+
+    # component should start with < and end with >
+    # otherwise it needs manual check
+    usage_code_block = code_blocks[1]
+    if not usage_code_block.startswith("<") or not usage_code_block.endswith(">"):
+        return False, (
+            filename,
+            file_path,
+            "Usage code block is not a simple component.",
+        )
+
+    if file_id is not None:
+        return True, (
+            filename,
+            file_path,
+            mapped_docs.TextSpan(file_id, usage.start, usage.end),
+        )
+    return True, (filename, file_path, usage.text)
+
+
+def check_files_in_directory(directory_path, filenames=None):
+    # Iterate through all files in the directory, or just the given ones that exist
+    if filenames is None:
+        filenames = os.listdir(directory_path)
+    else:
+        filenames = [
+            filename
+            for filename in sorted(filenames)
+            if os.path.exists(os.path.join(directory_path, filename))
+        ]
+    file_paths = []
+    for filename in filenames:
         file_path = os.path.join(directory_path, filename)
-        # Skip directories
         if os.path.isdir(file_path):
-            print(f"Skipping, {filename} is a directory.")
+            logger.debug("Skipping, %s is a directory.", filename)
             continue
+        file_paths.append(file_path)
+    return collect_results(check_doc_files(file_paths))
+
+
+def check_doc_files(file_paths):
+    # Same as check_doc_file for every path, the docs are mapped and checked ahead
+    # in bulk. Good docs come back with a mapped_docs.TextSpan of their usage
+    # section instead of its text, so a whole corpus of them stays small
+    to_check = [
+        file_path
+        for file_path in file_paths
+        if check_extension(os.path.basename(file_path), file_path) is None
+    ]
+    checks = bulk_read.read_files(to_check, read=check_mapped_doc)
+    try:
+        for file_path in file_paths:
+            filename = os.path.basename(file_path)
+            logger.debug("Checking %s", filename)
+            metrics.count("check.files_seen")
+            result = check_extension(filename, file_path)
+            if result is None:
+                result = next(checks)
+            count_verdict(result)
+            yield result
+    finally:
+        checks.close()
+
+
+def check_mapped_doc(file_path):
+    # Runs on a bulk_read thread, nothing of the doc outlives the mapping but offsets
+    filename = os.path.basename(file_path)
+    with metrics.timer("file.check", file_path):
+        try:
+            file_id = mapped_docs.FILES.add(file_path)
+            with mapped_docs.map_file(file_path) as view:
+                content = mapped_docs.prepare(view)
+                if isinstance(content, str):
+                    return check_doc_content(filename, file_path, content)
+                return check_doc_content(filename, file_path, content, file_id)
+        except Exception as e:
+            logger.error("Error checking content in %s: %s", filename, e)
+            metrics.count("check.files_failed")
+            metrics.fail_with(file_path, e)
+            return None
+
+
+def check_doc_read(filename, read):
+    # Same as check_doc_path for a bulk_read.FileRead
+    try:
+        content = read.text()
+    except Exception as e:
+        logger.error("Error checking content in %s: %s", filename, e)
+        metrics.count("check.files_failed")
+        metrics.fail_with(read.path, e)
+        return None
+
+    return check_doc_content(filename, read.path, content)
+
+
+def check_doc_source(filename, source):
+    # Same as check_doc_file for a doc read from a git_source.GitSource or an
+    # archive_source.ArchiveSource, None if the source doesn't have it
+    if filename not in source.blobs:
+        return None
+    key = source.key(filename)
+    logger.debug("Checking %s", filename)
+    metrics.count("check.files_seen")
+    with metrics.timer("file.check", key) as timing:
+        result = check_extension(filename, key) or check_doc_source_content(
+            filename, key, source
+        )
+        timing.size = source.size(filename)
 
-        # Get the file extension
-        _, file_extension = os.path.splitext(filename)
+    count_verdict(result)
+    return result
 
-        # Check if the file extension is allowed
-        if file_extension not in allowed_extensions:
-            unsupported_files.append(file_path)
-            print(f"Skipping, {filename} because {file_extension} is not allowed.")
-            bad_files.append((filename, file_path, "Unexpected file extension."))
-            # Stop processing further for this file
-            continue
 
-        # Process file content
-        try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                print(f"Checking content in {filename}")
-                content = file.read()
-                # duplicate code with extract
-                pattern = r"## Usage\s+([\s\S]*?)(\n##|\Z)"
-                match = re.search(pattern, content)
-                if match:
-                    usage_section = match.group(
-                        1
-                    ).strip()  # Extract and trim the Usage section
-                    code_blocks = extract_code_blocks(usage_section)
-
-                    if len(code_blocks) > 2:
-                        # print(f"Error: too much, need manual check {filename}")
-                        bad_files.append(
-                            (filename, file_path, "Has more than 2 code blocks.")
-                        )
-                        continue
-                    elif len(code_blocks) < 2:
-                        bad_files.append(
-                            (filename, file_path, "Has less than 2 code blocks.")
-                        )
-                        continue
-
-                    # check if import is okay
-                    # print(code_blocks[0])
-                    # should only have one import string, should end with "
-
-                    if code_blocks[0].count("import") > 1:
-                        bad_files.append(
-                            (
-                                filename,
-                                file_path,
-                                "Import code block has more than one import.",
-                            )
-                        )
-                        continue
-
-                    if not code_blocks[0].endswith('"') and not code_blocks[0].endswith(
-                        '";'
-                    ):
-                        bad_files.append(
-                            (
-                                filename,
-                                file_path,
-                                'Import code block does not end with expected " or "; char.',
-                            )
-                        )
-                        continue
-
-                    # component should start with < and end with >
-                    # otherwise it needs manual check
-                    usage_code_block = code_blocks[1]
-                    if not usage_code_block.startswith(
-                        "<"
-                    ) or not usage_code_block.endswith(">"):
-                        bad_files.append(
-                            (
-                                filename,
-                                file_path,
-                                "Usage code block is not a simple component.",
-                            )
-                        )
-                        continue
-
-                    good_files.append((filename, file_path, usage_section))
-                else:
-                    # print(f"Couldn't find Usage section in {filename}")
-                    bad_files.append(
-                        (filename, file_path, "Could not find Usage section.")
-                    )
-                    cant_find_usage_section_files.append(file_path)
-                    continue
+def check_doc_source_content(filename, key, source):
+    # Same as check_doc_read, a doc that isn't UTF-8 fails on its own
+    try:
+        content = source.read_text(filename)
+    except UnicodeDecodeError as e:
+        logger.error("Error checking content in %s: %s", key, e)
+        metrics.count("check.files_failed")
+        metrics.fail_with(key, e)
+        return None
 
-        except Exception as e:
-            print(f"Error checking content in {filename}: {e}")
+    return check_doc_content(filename, key, content)
+
+
+def check_files_in_source(source, filenames=None):
+    # Same as check_files_in_directory for docs read from a git_source.GitSource
+    # or an archive_source.ArchiveSource
+    if filenames is None:
+        filenames = source.blobs
+    return collect_results(
+        check_doc_source(filename, source) for filename in sorted(filenames)
+    )
+
+
+def collect_results(results):
 
-    print(f"BAD FILES {len(bad_files)}")
+    good_files = []
+    bad_files = []
+
+    for result in results:
+        if result is None:
+            continue
+
+        is_good, entry = result
+        if is_good:
+            good_files.append(entry)
+        else:
+            bad_files.append(entry)
+
+    logger.info("BAD FILES %d", len(bad_files))
     for f in bad_files:
-        print(f[0])
-    print(f"GOOD FILES {len(good_files)}")
+        logger.debug("%s", f[0])
+    logger.info("GOOD FILES %d", len(good_files))
     for f in good_files:
-        print(f[0])
+        logger.debug("%s", f[0])
 
     return good_files, bad_files
 
@@ -153,41 +298,79 @@ def create_doc_file(target_directory, filename, content="", overwrite=False):
             # Create the file
             with open(file_path, "w", encoding="utf-8") as file:
                 file.write(content)
-            print(f"Created: {file_path}")
+                metrics.count_written(file)
+            logger.debug("Created: %s", file_path)
+            return True
         except Exception as e:
-            print(f"Error creating file {file_path}: {e}")
+            logger.error("Error creating file %s: %s", file_path, e)
             if os.path.exists(file_path):
                 os.remove(file_path)
-                print(f"Deleted the file: {file_path}")
+                logger.debug("Deleted the file: %s", file_path)
     else:
-        print(f"File already exists, skipping: {file_path}")
+        logger.debug("File already exists, skipping: %s", file_path)
+
+    return False
+
+
+def plan_docs(directory_path=config.DIR_DOCS_FROM_REPO, source=None, filenames=None):
+    # Returns (good_files, bad_files, [auto docs plan, manual docs plan])
+    # The docs are read from source instead of directory_path when it's given
+    # With filenames only those docs are checked and planned, e.g. the ones
+    # git_source.diff_docs reports, everything else is kept as it is
+    # Auto docs follow upstream, so changed ones are rewritten and ones that
+    # stopped passing the check are dropped. Manual docs get edited by hand
+    # once created, so missing ones are only ever added
+    if source is not None:
+        good_files, bad_files = check_files_in_source(source, filenames)
+    else:
+        good_files, bad_files = check_files_in_directory(directory_path, filenames)
+
+    auto_plan = reconcile.plan_directory(
+        config.DIR_AUTO_DOCS,
+        {file[0]: file[2] for file in good_files},
+        scope=filenames,
+    )
+    manual_plan = reconcile.plan_directory(
+        config.DIR_MANUAL_DOCS,
+        {file[0]: TEMPLATE_DOC_USAGE_SECTION for file in bad_files},
+        update=False,
+        delete=False,
+        scope=filenames,
+    )
+    return good_files, bad_files, [auto_plan, manual_plan]
+
+
+def plan_stale_auto_docs(upstream_filenames):
+    # The deletes plan_docs makes for auto docs upstream doesn't have any more,
+    # without checking anything, so pipeline.py drops the same ones
+    return reconcile.plan_directory(
+        config.DIR_AUTO_DOCS, dict.fromkeys(upstream_filenames), update=False
+    )
 
 
 # returns true if no manual intervention needed, false if needed
-def check_and_generate_docs():
+@metrics.timed("stage.check_and_generate_docs")
+@profiling.profiled("check_and_generate_docs")
+def check_and_generate_docs(dry_run=False, filenames=None):
     # don't take a directory directly
     # just take the files
     # combine files from auto and manual
     # maybe have script to check how many components are on shadcn, then compare with how many we have
     #   like how many can be processed, how many snippets were generated
 
-    good_files, bad_files = check_files_in_directory(config.DIR_DOCS_FROM_REPO)
-
-    for file in good_files:
-        create_doc_file(
-            target_directory=config.DIR_AUTO_DOCS,
-            filename=file[0],
-            content=file[2],
-            overwrite=False,
+    # with dry_run the plans are only logged, see pipeline.py --dry-run to print them
+    # filenames limits the run to those upstream docs, see plan_docs
+    with mapped_docs.FILES.build():
+        good_files, bad_files, plans = plan_docs(
+            config.DIR_DOCS_FROM_REPO, filenames=filenames
         )
 
-    for file in bad_files:
-        create_doc_file(
-            target_directory=config.DIR_MANUAL_DOCS,
-            filename=file[0],
-            content=TEMPLATE_DOC_USAGE_SECTION,
-            overwrite=False,
-        )
+        for plan in plans:
+            if dry_run:
+                for line in plan.describe():
+                    logger.info("%s", line)
+            else:
+                plan.apply()
 
     if len(bad_files) > 0:
         return False
@@ -1,7 +1,30 @@
 DIR_DOCS_FROM_REPO = "1_components-from-repo"
 DIR_AUTO_DOCS = "2_auto-docs"
 DIR_MANUAL_DOCS = "2_manual-docs"
+# Per-team docs that win over both auto and manual docs
+DIR_OVERRIDE_DOCS = "2_override-docs"
 DIR_GENERATED_JSONS = "3_generated-jsons"
+# Every extracted record in one SQLite file, the JSONs above are an export of it
+RECORD_STORE_FILE = "3_generated-records.db"
 DIR_GENERATED_LIVE_TEMPLATES = "4_generated-live-templates"
+# VS Code, Zed and Sublime snippets, a folder per editor
+DIR_GENERATED_EDITOR_SNIPPETS = "4_generated-editor-snippets"
 
 DIR_PLUGIN_RESOURCE_FOLDER = "../../src/main/resources/liveTemplates"
+
+MANIFEST_FILE = "build-manifest.json"
+OVERLAY_INDEX_FILE = "overlay-index.json"
+# Docs a pipeline run gave up on and why, only there while some are quarantined
+FAILURE_REPORT_FILE = "failure-report.json"
+
+# Where the component docs live inside the shadcn/ui repository
+GIT_DOCS_PATH = "apps/www/content/docs/components"
+
+# Parse results shared between builds of different upstream versions
+CONTENT_STORE_FILE = "content-store.json"
+DIR_GENERATED_VERSIONS = "4_generated-versions"
+
+# Where daemon.py listens, the address it actually got is written to DAEMON_FILE
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 7457
+DAEMON_FILE = "daemon.json"
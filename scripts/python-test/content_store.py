@@ -0,0 +1,122 @@
+import config
+import hashlib
+import json
+import metrics
+import os
+from collections import OrderedDict
+
+logger = metrics.get_logger(__name__)
+
+# Bump this when what's stored for the same doc content changes
+STORE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def content_key(data):
+    # The git blob id of the bytes, so docs read from git are keyed by the id
+    # git already has and files on disk end up with the same key
+    digest = hashlib.sha1(b"blob %d\0" % len(data))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def entry_size(entry):
+    return len(json.dumps(entry, ensure_ascii=True))
+
+
+class ContentStore:
+    """
+    Parse results keyed by doc content, shared by every build that sees the same doc.
+    Entries are kept in least recently used order and the oldest ones are dropped
+    once the store grows past max_bytes. Hits only reorder the entries in memory,
+    the order is saved along with the next entry that's added or dropped, so a build
+    that only hits never rewrites the store.
+    """
+
+    def __init__(self, path=config.CONTENT_STORE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.changed = False
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning("Ignoring unreadable content store %s: %s", self.path, e)
+            return
+
+        if data.get("version") != STORE_VERSION:
+            logger.info("Content store is from a different version, starting over.")
+            return
+
+        # Saved oldest first, so the order is the LRU order
+        for key, entry in data["entries"]:
+            self.entries[key] = entry
+            self.size += entry_size(entry)
+        self.evict()
+
+    def save(self):
+        if not self.changed or self.path is None:
+            return
+        # Write to a temp file first so a crash never leaves half a store behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"version": STORE_VERSION, "entries": list(self.entries.items())},
+                file,
+                ensure_ascii=True,
+            )
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            metrics.count("store.misses")
+            return None
+        metrics.count("store.hits")
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= entry_size(previous)
+        self.entries[key] = entry
+        self.size += entry_size(entry)
+        self.changed = True
+        self.evict()
+
+    def evict(self):
+        # The entry that was just added or used is last, so it's the one that stays
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry_size(entry)
+            self.changed = True
+            metrics.count("store.evicted")
+
+    def get_or_create(self, key, create):
+        # Returns the stored entry, or stores what create() returns
+        entry = self.get(key)
+        if entry is None:
+            entry = create()
+            self.put(key, entry)
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.save()
@@ -0,0 +1,376 @@
+import config
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import manifest
+import metrics
+import overlay_index
+import pipeline
+import record_store
+import watch
+
+logger = metrics.get_logger(__name__)
+
+
+class DaemonError(Exception):
+    pass
+
+
+class SnippetDaemon:
+    """
+    Keeps the build manifest and the overlay index of the last build in memory, so
+    regenerating a component only costs checking and extracting that one doc and
+    patching its templates, same as watch does on a change.
+    Builds never run at the same time, status is answered while one is running
+    from what the last build left, the manifest itself is only touched under lock.
+    """
+
+    def __init__(self, copy_to_plugin=True, manifest_path=config.MANIFEST_FILE):
+        self.copy_to_plugin = copy_to_plugin
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        # Guards requests and built, which request threads read and write while a
+        # build holds lock
+        self.stats_lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.built = {"docs": 0, "snippets": 0, "last_build": None, "options": None}
+        self.build_manifest = None
+        self.index = None
+
+    def count_request(self):
+        with self.stats_lock:
+            self.requests += 1
+
+    def record_build(self):
+        # Called with lock held, once the manifest is up to date
+        docs = self.build_manifest["docs"]
+        built = {
+            "docs": len(docs),
+            "snippets": sum(
+                1 for entry in docs.values() if entry["record"] is not None
+            ),
+            "last_build": time.time(),
+            "options": dict(self.build_manifest["options"]),
+        }
+        with self.stats_lock:
+            self.built = built
+
+    def rebuild(self):
+        # Same as a pipeline run with the options the last one used, then warms up
+        with self.lock:
+            started = time.perf_counter()
+            options = manifest.read_manifest_options(self.manifest_path) or {}
+            summary = pipeline.run_pipeline(
+                workers=1,
+                copy_to_plugin=self.copy_to_plugin,
+                incremental=True,
+                manifest_path=self.manifest_path,
+                **options,
+            )
+            # The run fills in defaults for options a first run didn't have
+            options = manifest.read_manifest_options(self.manifest_path)
+            self.build_manifest = manifest.load_manifest(self.manifest_path, options)
+            self.index = overlay_index.load_index()
+            self.record_build()
+            return {
+                "processed": summary["processed"],
+                "removed": summary["removed"],
+                "snippets": len(summary["snippets"]),
+                "ms": (time.perf_counter() - started) * 1000,
+            }
+
+    def get_doc_filenames(self, component):
+        # Every doc of the component, the ones already built and any new ones
+        filenames = {
+            filename
+            for filename in self.build_manifest["docs"]
+            if overlay_index.get_component_name(filename) == component
+        }
+        for directory in manifest.SOURCE_DIRS:
+            for extension in overlay_index.DOC_EXTENSIONS:
+                if os.path.isfile(os.path.join(directory, component + extension)):
+                    filenames.add(component + extension)
+        return filenames
+
+    def regenerate(self, components):
+        # Names come from whoever sent the request, one like "../x" would reach
+        # files outside the doc folders
+        for component in components:
+            record_store.validate_name(component)
+        with self.lock:
+            started = time.perf_counter()
+            filenames = set()
+            unknown = []
+            for component in components:
+                component_filenames = self.get_doc_filenames(component)
+                if not component_filenames:
+                    unknown.append(component)
+                filenames |= component_filenames
+
+            dirty, removed = [], []
+            if filenames:
+                dirty, removed = watch.update_components(
+                    sorted(filenames),
+                    self.build_manifest,
+                    self.index,
+                    self.copy_to_plugin,
+                )
+                if dirty or removed:
+                    manifest.save_manifest(self.build_manifest, self.manifest_path)
+                    self.record_build()
+            return {
+                "processed": dirty,
+                "removed": removed,
+                "unknown": unknown,
+                "ms": (time.perf_counter() - started) * 1000,
+            }
+
+    def status(self):
+        # Never waits for a build, regenerate changes the manifest's docs in place
+        with self.stats_lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": time.time() - self.started,
+                "busy": self.lock.locked(),
+                "requests": self.requests,
+                **self.built,
+            }
+
+    def create_server(self, host=config.DAEMON_HOST, port=config.DAEMON_PORT):
+        server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        server.snippet_daemon = self
+        return server
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    # GET /status, POST /rebuild, POST /regenerate {"components": [...]}, POST /stop
+    server_version = "SnippetDaemon"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def refuse(self):
+        # (status, reason) for a request that didn't come from a local tool, None
+        # otherwise. Browsers send an Origin with every request a web page makes
+        # to another site, and without a preflight (which this server never
+        # answers) a page can't send an application/json body
+        if self.headers.get("Origin") is not None:
+            return 403, "Requests from web pages aren't accepted."
+        if self.command == "POST":
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.split(";")[0].strip().lower() != "application/json":
+                return 415, "POST requests need Content-Type: application/json."
+        return None
+
+    def handle_request(self, routes):
+        daemon = self.server.snippet_daemon
+        daemon.count_request()
+        refused = self.refuse()
+        if refused is not None:
+            status, reason = refused
+            logger.warning("Refused %s %s: %s", self.command, self.path, reason)
+            self.send_json(status, {"ok": False, "error": reason})
+            return
+        route = routes.get(self.path.rstrip("/"))
+        if route is None:
+            self.send_json(404, {"ok": False, "error": f"Unknown path '{self.path}'."})
+            return
+        try:
+            body = route()
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"ok": False, "error": str(e)})
+            return
+        except Exception as e:
+            logger.exception("Request %s failed", self.path)
+            self.send_json(500, {"ok": False, "error": str(e)})
+            return
+        self.send_json(200, {"ok": True, **body})
+
+    def do_GET(self):
+        self.handle_request({"/status": self.server.snippet_daemon.status})
+
+    def do_POST(self):
+        self.handle_request(
+            {
+                "/status": self.server.snippet_daemon.status,
+                "/rebuild": self.server.snippet_daemon.rebuild,
+                "/regenerate": self.regenerate,
+                "/stop": self.stop,
+            }
+        )
+
+    def regenerate(self):
+        components = self.read_json()["components"]
+        if not isinstance(components, list):
+            raise TypeError("components needs to be a list of component names.")
+        result = self.server.snippet_daemon.regenerate(components)
+        logger.info(
+            "Regenerated %s in %.1f ms",
+            ", ".join(components) or "nothing",
+            result["ms"],
+        )
+        return result
+
+    def stop(self):
+        # shutdown blocks until serve_forever returns, so the answer goes out first
+        threading.Thread(target=self.server.shutdown).start()
+        return {}
+
+
+def write_daemon_file(path, host, port):
+    # Tells clients (the plugin, the client below) where the daemon listens
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"host": host, "port": port, "pid": os.getpid()}, file)
+    os.replace(tmp_path, path)
+
+
+def serve(
+    host=config.DAEMON_HOST,
+    port=config.DAEMON_PORT,
+    copy_to_plugin=True,
+    daemon_file=config.DAEMON_FILE,
+):
+    daemon = SnippetDaemon(copy_to_plugin)
+    result = daemon.rebuild()
+    logger.info(
+        "Built %d snippets in %.0f ms, %d docs processed",
+        result["snippets"],
+        result["ms"],
+        len(result["processed"]),
+    )
+
+    server = daemon.create_server(host, port)
+    host, port = server.server_address[:2]
+    write_daemon_file(daemon_file, host, port)
+    logger.info("Listening on http://%s:%d", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(daemon_file):
+            os.remove(daemon_file)
+        logger.info("Stopped.")
+
+
+class DaemonClient:
+    # What the plugin would do over HTTP, for scripts and for trying the daemon out
+
+    def __init__(self, host=config.DAEMON_HOST, port=config.DAEMON_PORT, timeout=60):
+        self.url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    @classmethod
+    def from_daemon_file(cls, path=config.DAEMON_FILE, timeout=60):
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                address = json.load(file)
+        except FileNotFoundError:
+            raise DaemonError(f"No daemon running, {path} does not exist.") from None
+        return cls(address["host"], address["port"], timeout)
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        request = urllib.request.Request(
+            self.url + path,
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise DaemonError(json.load(e).get("error", str(e))) from None
+        except urllib.error.URLError as e:
+            raise DaemonError(f"Could not reach the daemon at {self.url}: {e.reason}")
+
+    def status(self):
+        return self.request("GET", "/status")
+
+    def rebuild(self):
+        return self.request("POST", "/rebuild")
+
+    def regenerate(self, components):
+        return self.request("POST", "/regenerate", {"components": list(components)})
+
+    def stop(self):
+        return self.request("POST", "/stop")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Daemon",
+        description="Keep the snippets build warm and regenerate on request.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start the daemon.")
+    serve_parser.add_argument("--host", default=config.DAEMON_HOST)
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=config.DAEMON_PORT,
+        help=f"0 picks a free port, clients find it in {config.DAEMON_FILE}.",
+    )
+    serve_parser.add_argument(
+        "--no-copy",
+        help="Don't copy the templates into the plugin resource folder.",
+        action="store_true",
+    )
+    metrics.add_verbosity_arguments(serve_parser)
+
+    subparsers.add_parser("status", help="Print the state of the running daemon.")
+    subparsers.add_parser("rebuild", help="Run the whole pipeline in the daemon.")
+    subparsers.add_parser("stop", help="Stop the running daemon.")
+    regenerate_parser = subparsers.add_parser(
+        "regenerate", help="Regenerate the snippets of the given components."
+    )
+    regenerate_parser.add_argument("components", nargs="+", metavar="COMPONENT")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        # Same as watch, the progress lines are what this is run for
+        metrics.configure_logging(-1 if args.quiet else max(1, args.verbose))
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        serve(args.host, args.port, copy_to_plugin=not args.no_copy)
+        return
+
+    try:
+        client = DaemonClient.from_daemon_file()
+        if args.command == "regenerate":
+            response = client.regenerate(args.components)
+        else:
+            response = getattr(client, args.command)()
+    except DaemonError as e:
+        parser.exit(1, f"{e}\n")
+    print(json.dumps(response, indent=2))
+
+
+if __name__ == "__main__":
+    main()
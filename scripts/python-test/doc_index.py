@@ -0,0 +1,144 @@
+import re
+
+# The patterns the checker and the extractor have always used. They're applied
+# to the doc in place, so a match is only a pair of offsets, but what they match
+# is exactly what they matched on the decoded text. That includes their quirks:
+# "### Usage" has a "## Usage" in it, only "\n##" ends a section (a "# Heading"
+# doesn't), and a fence closes wherever the next ``` is, even mid line
+SECTION_PATTERN = r"## {title}\s+([\s\S]*?)(\n##|\Z)"
+CODE_BLOCK_PATTERN = re.compile(r"```(?:[^\n]*\n)(.*?)```", re.DOTALL)
+BYTES_CODE_BLOCK_PATTERN = re.compile(
+    CODE_BLOCK_PATTERN.pattern.encode("ascii"), re.DOTALL
+)
+
+# What bytes.strip() trims
+BYTES_WHITESPACE = b" \t\n\r\f\v"
+# What str.strip() trims, which is also what \s matches in a str pattern. Beyond
+# ASCII it's these, mapped_docs.prepare decodes docs that have any of them since
+# a bytes pattern wouldn't see them as whitespace
+UNICODE_WHITESPACE = (
+    "\x1c\x1d\x1e\x1f\x85\xa0\u1680"
+    + "".join(chr(code) for code in range(0x2000, 0x200B))
+    + "\u2028\u2029\u202f\u205f\u3000"
+)
+WHITESPACE = " \t\n\r\f\v" + UNICODE_WHITESPACE
+
+
+def trim_span(source, start, end, whitespace=WHITESPACE):
+    # Moves start and end past surrounding whitespace without copying the text,
+    # same as strip() on source[start:end]
+    while start < end and source[start] in whitespace:
+        start += 1
+    while end > start and source[end - 1] in whitespace:
+        end -= 1
+    return start, end
+
+
+class CodeBlock:
+    __slots__ = ("source", "start", "end", "body_start", "body_end")
+
+    def __init__(self, source, start, end, body_start, body_end):
+        self.source = source
+        # Offsets of the whole block including fences, and of the trimmed code
+        # inside the fences
+        self.start = start
+        self.end = end
+        self.body_start = body_start
+        self.body_end = body_end
+
+    @property
+    def text(self):
+        return self.source[self.body_start : self.body_end]
+
+    def __repr__(self):
+        return f"CodeBlock({self.start}, {self.end})"
+
+
+class Section:
+    __slots__ = ("index", "start", "end")
+
+    def __init__(self, index, start, end):
+        self.index = index
+        # Trimmed offsets of the section body, without the heading
+        self.start = start
+        self.end = end
+
+    @property
+    def text(self):
+        return self.index.source[self.start : self.end]
+
+    @property
+    def code_blocks(self):
+        # Found in the section's text alone, a fence left open at its end
+        # doesn't pick up code from the rest of the doc
+        return self.index.find_code_blocks(self.start, self.end)
+
+    def __repr__(self):
+        return f"Section({self.start}, {self.end})"
+
+
+class DocIndex:
+    def __init__(self, source):
+        self.source = source
+        self.is_text = isinstance(source, str)
+        self.whitespace = WHITESPACE if self.is_text else BYTES_WHITESPACE
+        self._code_blocks = None
+
+    @property
+    def code_blocks(self):
+        # Every code block of the doc, found once on first use
+        if self._code_blocks is None:
+            self._code_blocks = self.find_code_blocks(0, len(self.source))
+        return self._code_blocks
+
+    def find_code_blocks(self, start, end):
+        # Same as CODE_BLOCK_PATTERN.findall on source[start:end], stripped
+        pattern = CODE_BLOCK_PATTERN if self.is_text else BYTES_CODE_BLOCK_PATTERN
+        blocks = []
+        for match in pattern.finditer(self.source, start, end):
+            body_start, body_end = trim_span(
+                self.source, match.start(1), match.end(1), self.whitespace
+            )
+            blocks.append(
+                CodeBlock(self.source, match.start(), match.end(), body_start, body_end)
+            )
+        return blocks
+
+    def find_section(self, title):
+        # Returns the first section the old "## <title>\s+([\s\S]*?)(\n##|\Z)"
+        # pattern finds, stripped, or None
+        match = get_section_pattern(title, self.is_text).search(self.source)
+        if match is None:
+            return None
+        start, end = trim_span(
+            self.source, match.start(1), match.end(1), self.whitespace
+        )
+        return Section(self, start, end)
+
+
+SECTION_PATTERNS = {}
+
+
+def get_section_pattern(title, is_text):
+    key = (title, is_text)
+    pattern = SECTION_PATTERNS.get(key)
+    if pattern is None:
+        pattern = SECTION_PATTERN.format(title=re.escape(title))
+        if not is_text:
+            pattern = pattern.encode("utf-8")
+        pattern = SECTION_PATTERNS[key] = re.compile(pattern)
+    return pattern
+
+
+def index_doc(source):
+    """
+    Wraps a markdown/MDX doc so its sections and fenced code blocks can be looked
+    up as offsets. Nothing is copied out of the source, code blocks and sections
+    only keep offsets into it and are found when they're asked for.
+
+    :param source: The doc content, as str or as UTF-8 bytes (bytes, an mmap), in
+        which case all offsets are byte offsets and the texts come out as bytes.
+        Bytes have to come from mapped_docs.prepare to match what the text would.
+    :return: A DocIndex over the content.
+    """
+    return DocIndex(source)
@@ -0,0 +1,324 @@
+import config
+import json
+import metrics
+import os
+import reconcile
+import write_to_template
+
+logger = metrics.get_logger(__name__)
+
+
+def get_description(name):
+    return f"https://ui.shadcn.com/docs/components/{name}"
+
+
+def get_snippets(record):
+    # (template name, snippet text) pairs every format writes for a record
+    return (
+        (f"cni-{record['name']}", record["import"]),
+        (f"cnu-{record['name']}", record["usage"]),
+    )
+
+
+def escape_snippet_body(value):
+    # VS Code, Zed and Sublime read $ as the start of a tab stop or variable
+    return value.replace("\\", "\\\\").replace("$", "\\$")
+
+
+class Emitter:
+    """
+    One output format. Records are serialised by the classmethod serialize, which
+    pool workers call without opening anything, and the result is streamed into the
+    open output with write, so every format is fed from the same pass over the records.
+
+    Subclasses set name and implement serialize, write, close, abort and get_file_paths.
+    """
+
+    name = None
+
+    @classmethod
+    def serialize(cls, record):
+        raise NotImplementedError
+
+    @classmethod
+    def get_file_paths(cls, shards=1):
+        # The files the format always writes, known before anything is written
+        raise NotImplementedError
+
+    def write(self, name, payload):
+        raise NotImplementedError
+
+    def emit(self, record):
+        self.write(record["name"], self.serialize(record))
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class IntelliJEmitter(Emitter):
+    # The live template sets the plugin ships, see write_to_template
+    name = "intellij"
+    directory = config.DIR_GENERATED_LIVE_TEMPLATES
+
+    def __init__(self, shards=1, group_per_shard=False):
+        os.makedirs(self.directory, exist_ok=True)
+        self.import_writer = write_to_template.ShardedTemplateSetWriter(
+            self.directory,
+            write_to_template.IMPORT_SNIPPETS_FILE,
+            write_to_template.IMPORT_GROUP,
+            shards,
+            group_per_shard,
+        )
+        self.usage_writer = write_to_template.ShardedTemplateSetWriter(
+            self.directory,
+            write_to_template.USAGE_SNIPPETS_FILE,
+            write_to_template.USAGE_GROUP,
+            shards,
+            group_per_shard,
+        )
+        self.file_paths = self.import_writer.file_paths + self.usage_writer.file_paths
+
+    @classmethod
+    def serialize(cls, record):
+        return write_to_template.serialize_snippets_for_record(record)
+
+    @classmethod
+    def get_file_paths(cls, shards=1):
+        return write_to_template.get_template_file_paths(cls.directory, shards)
+
+    def write(self, name, payload):
+        import_snippet, usage_snippet = payload
+        self.import_writer.write(name, import_snippet)
+        self.usage_writer.write(name, usage_snippet)
+
+    def close(self):
+        self.import_writer.close()
+        self.usage_writer.close()
+
+    def abort(self):
+        self.import_writer.abort()
+        self.usage_writer.abort()
+
+
+class JsonSnippetsEmitter(Emitter):
+    """
+    A single JSON object of snippets, the format VS Code and Zed share. Entries are
+    written as they come in and the file only replaces the old one once it's complete,
+    or not at all if nothing changed.
+    """
+
+    directory = None
+    file_name = None
+    # The languages a snippet shows up in, None for every language
+    scope = None
+
+    def __init__(self, shards=1, group_per_shard=False):
+        # Editors don't merge sets by group, so these formats are never sharded
+        os.makedirs(self.directory, exist_ok=True)
+        self.file_path = os.path.join(self.directory, self.file_name)
+        self.file_paths = [self.file_path]
+        self.count = 0
+        self.file = reconcile.ChangedFileWriter(self.file_path)
+        self.file.write(b"{")
+
+    @classmethod
+    def serialize(cls, record):
+        entries = []
+        for name, value in get_snippets(record):
+            snippet = {"prefix": name}
+            if cls.scope is not None:
+                snippet["scope"] = cls.scope
+            snippet["body"] = escape_snippet_body(value).split("\n")
+            snippet["description"] = get_description(record["name"])
+            entries.append(
+                f"\n  {json.dumps(name)}: {json.dumps(snippet, ensure_ascii=False)}"
+            )
+        return ",".join(entries).encode("utf-8")
+
+    @classmethod
+    def get_file_paths(cls, shards=1):
+        return [os.path.join(cls.directory, cls.file_name)]
+
+    def write(self, name, payload):
+        if self.count > 0:
+            self.file.write(b",")
+        self.file.write(payload)
+        self.count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(b"\n}\n")
+        self.file.close()
+
+    def abort(self):
+        self.file.abort()
+
+
+class VSCodeEmitter(JsonSnippetsEmitter):
+    name = "vscode"
+    directory = os.path.join(config.DIR_GENERATED_EDITOR_SNIPPETS, "vscode")
+    file_name = "shadcn-ui.code-snippets"
+    scope = "javascript,javascriptreact,typescript,typescriptreact"
+
+
+class ZedEmitter(JsonSnippetsEmitter):
+    # Zed applies snippets.json to every language, same syntax as VS Code
+    name = "zed"
+    directory = os.path.join(config.DIR_GENERATED_EDITOR_SNIPPETS, "zed")
+    file_name = "snippets.json"
+
+
+SUBLIME_SCOPE = "source.js, source.jsx, source.ts, source.tsx"
+
+
+class SublimeEmitter(Emitter):
+    """
+    Sublime Text wants one .sublime-snippet file per snippet. Each file is only
+    rewritten when it changed, and the ones no record wrote are removed on close.
+    """
+
+    name = "sublime"
+    directory = os.path.join(config.DIR_GENERATED_EDITOR_SNIPPETS, "sublime")
+
+    def __init__(self, shards=1, group_per_shard=False):
+        os.makedirs(self.directory, exist_ok=True)
+        self.file_paths = []
+
+    @classmethod
+    def serialize(cls, record):
+        files = []
+        for name, value in get_snippets(record):
+            content = escape_snippet_body(value).replace("]]>", "]]]]><![CDATA[>")
+            files.append(
+                (
+                    f"{name}.sublime-snippet",
+                    "<snippet>\n"
+                    f"    <content><![CDATA[{content}]]></content>\n"
+                    f"    <tabTrigger>{write_to_template.escape_attribute(name)}</tabTrigger>\n"
+                    f"    <scope>{SUBLIME_SCOPE}</scope>\n"
+                    f"    <description>{get_description(record['name'])}</description>\n"
+                    "</snippet>\n",
+                )
+            )
+        return files
+
+    @classmethod
+    def get_file_paths(cls, shards=1):
+        # Depends on the records, whatever the last run wrote is in the manifest
+        return []
+
+    def write(self, name, payload):
+        for file_name, content in payload:
+            file_path = os.path.join(self.directory, file_name)
+            if reconcile.write_if_changed(file_path, content) != "unchanged":
+                metrics.count("emit.sublime_written")
+            self.file_paths.append(file_path)
+
+    def close(self):
+        reconcile.plan_directory(
+            self.directory,
+            {os.path.basename(file_path): None for file_path in self.file_paths},
+            update=False,
+        ).apply()
+
+    def abort(self):
+        # Every file went in atomically on its own, there's nothing half written
+        pass
+
+
+EMITTERS = {
+    emitter.name: emitter
+    for emitter in (IntelliJEmitter, VSCodeEmitter, ZedEmitter, SublimeEmitter)
+}
+
+DEFAULT_EMITTERS = ("intellij",)
+
+
+def check_emitter_names(names):
+    unknown = [name for name in names if name not in EMITTERS]
+    if unknown:
+        raise ValueError(f"Unknown output format '{', '.join(unknown)}'.")
+
+
+def serialize_record(record, names=DEFAULT_EMITTERS):
+    # What every format writes for a record, done up front so pool workers can do it
+    return {name: EMITTERS[name].serialize(record) for name in names}
+
+
+def get_file_paths(names=DEFAULT_EMITTERS, shards=1):
+    return [
+        file_path
+        for name in names
+        for file_path in EMITTERS[name].get_file_paths(shards)
+    ]
+
+
+class EmitterSet:
+    """
+    Fans one stream of records out to several formats at once, so adding a format
+    adds a writer and not another pass over the docs.
+    """
+
+    def __init__(self, names=DEFAULT_EMITTERS, shards=1, group_per_shard=False):
+        check_emitter_names(names)
+        self.emitters = []
+        try:
+            for name in names:
+                self.emitters.append(EMITTERS[name](shards, group_per_shard))
+        except Exception:
+            self.abort()
+            raise
+
+    @property
+    def file_paths(self):
+        # Everything written, only complete once closed
+        return [
+            file_path for emitter in self.emitters for file_path in emitter.file_paths
+        ]
+
+    def write(self, record, payloads=None):
+        # payloads is what serialize_record returned for the record, if it's at hand
+        for emitter in self.emitters:
+            if payloads is not None and emitter.name in payloads:
+                emitter.write(record["name"], payloads[emitter.name])
+            else:
+                emitter.emit(record)
+
+    def close(self):
+        for emitter in self.emitters:
+            emitter.close()
+
+    def abort(self):
+        for emitter in self.emitters:
+            emitter.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_records(records, names=DEFAULT_EMITTERS, shards=1, group_per_shard=False):
+    # Streams name ordered {name, import, usage} records into every format, returns
+    # the written files, see write_to_template.check_record_order
+    with EmitterSet(names, shards, group_per_shard) as emitter_set:
+        for record in write_to_template.check_record_order(records):
+            emitter_set.write(record)
+    return emitter_set.file_paths
@@ -1,173 +1,164 @@
+import bulk_read
 import config
+import doc_index
 import json
+import mapped_docs
+import metrics
+import profiling
+import overlay_index
+import reconcile
+import record_store
 import os
-import re
 import argparse
 import sys
 from pathlib import Path
 
+logger = metrics.get_logger(__name__)
+
+DOC_EXTENSIONS = overlay_index.DOC_EXTENSIONS
+
 
 def get_file_name_from_path(file_path):
     return os.path.basename(file_path)
 
 
 def get_doc_files_from_dir(directory):
-    print("Checking directory...")
+    logger.debug("Checking directory...")
 
     path = Path(directory)
     if not path.is_dir():
-        print(f"Error: '{directory}' is not a valid directory.")
+        logger.error("Error: '%s' is not a valid directory.", directory)
         sys.exit(1)
 
     doc_files = []
     for item in path.iterdir():
-        if item.is_file() and (
-            item.suffix == ".md" or item.suffix == ".mdx" or item.suffix == ".txt"
-        ):  # Check for .md, .txt, or .mdx file
+        if item.is_file() and item.suffix in DOC_EXTENSIONS:
             doc_files.append(item)
 
-    print(f"Doc files found in '{directory}':")
+    logger.info("%d doc files found in '%s'", len(doc_files), directory)
     for doc_file in doc_files:
-        print(doc_file)
+        logger.debug("%s", doc_file)
 
     return doc_files
 
 
 def extract_code_blocks(text):
-    # Regular expression to match content between code blocks, ignoring any metadata
-    pattern = r"```(?:[^\n]*\n)(.*?)```"
-    # re.DOTALL allows . to match newlines
-    matches = re.findall(pattern, text, re.DOTALL)
-    return [match.strip() for match in matches]
+    return [block.text for block in doc_index.index_doc(text).code_blocks]
 
 
 def remove_extension(text):
-    return text.split(".")[0]
+    return overlay_index.get_component_name(text)
 
 
-def parse_component_doc_file(doc_file_path):
-    print(f"Parsing {doc_file_path}")
+def get_component_name(doc_file_path):
+    return overlay_index.get_component_name(get_file_name_from_path(doc_file_path))
 
-    with open(doc_file_path, "r", encoding="utf-8") as test:
-        content = test.read()
 
-        # Regular expression to get the Usage section of the doc
-        pattern = r"## Usage\s+([\s\S]*?)(\n##|\Z)"
-        match = re.search(pattern, content)
+def extract_record_from_content(name, content):
+    # Returns the {name, import, usage} record for a doc, or None if the doc
+    # doesn't have the expected code blocks
+    # content is the doc's text, or its UTF-8 bytes, see doc_index.index_doc
 
-        if match:
-            usage_section = match.group(1).strip()  # Extract and trim the Usage section
+    blocks = doc_index.index_doc(content).code_blocks
 
-            code_blocks = extract_code_blocks(usage_section)
+    if len(blocks) != 2:
+        logger.debug("WRONG AMOUNT OF CODE BLOCKS in %s: %d", name, len(blocks))
+        metrics.count("extract.wrong_code_blocks")
+        return None
 
-            imports = []
-            usage = []
+    code_blocks = [mapped_docs.as_text(block.text) for block in blocks]
 
-            # The usage section should have the first code block to show the import code
-            # Then the next code block should be the example
-            # In some cases it's not like that and it needs to be excluded from this process
-            for block in code_blocks:
-                if "import" in block:
-                    # This will not work as expected with multiple imports (it will include all of them)
-                    imports.append(block.strip())
-                else:
-                    usage.append(block.strip())
+    # now we now it has 2 code blocks
 
-            output_file = f"{remove_extension(get_file_name_from_path(test.name))}.json"
-            output_dir = "auto-defaults"
+    # check if each code block has expected content
+    # import starts with import ends with " or ";
+    # usage has some code
 
-            os.makedirs(output_dir, exist_ok=True)
+    import_code_block = code_blocks[0]
+    usage_code_block = code_blocks[1]
 
-            print(
-                f"Writing {output_file} contents to {os.path.join(output_dir, output_file)}"
-            )
-            with open(
-                os.path.join(output_dir, output_file), "w", encoding="utf-8"
-            ) as write_file:
-                data = {
-                    "name": remove_extension(
-                        get_file_name_from_path(test.name)
-                    ),  # duplicate code
-                    "import": imports[0],
-                    "usage": usage[0],
-                }
-                json.dump(data, write_file, indent=2, ensure_ascii=True)
-
-                # for block in imports:
-                #     write_file.write("$IMPORT$\n")
-                #     write_file.write(block + "\n")
-
-                # write_file.write("\n")
-                # for index, block in enumerate(components):
-                #     write_file.write(f"$USAGE$\n")
-                #     write_file.write(block + "\n")
-
-        else:
-            print(f"No Usage section found for {get_file_name_from_path(test.name)}.")
+    if len(import_code_block) == 0:
+        valid = import_code_block.startswith("import") and (
+            import_code_block.endswith('"') or import_code_block.endswith('";')
+        )
+        if not valid:
+            logger.debug("IMPROPER IMPORT: %s", name)
+            metrics.count("extract.improper_import")
+            return None
 
+    # Fences trim ASCII whitespace only, a block of e.g. a non-breaking space is
+    # just as empty
+    if not usage_code_block.strip():
+        logger.debug("NO USAGE CODE: %s", name)
+        metrics.count("extract.no_usage_code")
+        return None
 
-def parse_component_doc_file(doc_file_path):
-    print(f"Parsing {doc_file_path}")
+    record = {
+        "name": name,
+        "import": import_code_block,
+        "usage": usage_code_block,
+    }
+    # Anything else the record store would refuse means no record either, instead
+    # of failing the whole run once the records get stored
     try:
-        with open(doc_file_path, "r", encoding="utf-8") as test:
-            content = test.read()
-
-            # Regular expression to get the Usage section of the doc
-            # pattern = r"## Usage\s+([\s\S]*?)(\n##|\Z)"
-            # match = re.search(pattern, content)
-            # usage_section = match.group(1).strip()  # Extract and trim the Usage section
-
-            code_blocks = extract_code_blocks(content)
-
-            if len(code_blocks) != 2:
-                print("WRONG AMOUNT OF CODE BLOCKS")
-                print(code_blocks)
-                return False
+        return record_store.validate_record(record)
+    except record_store.RecordError as e:
+        logger.debug("INVALID RECORD %s: %s", name, e)
+        metrics.count("extract.invalid_record")
+        return None
+
+
+def extract_record(doc_file_path):
+    # The doc is mapped instead of read, only its two code blocks ever get decoded
+    logger.debug("Parsing %s", doc_file_path)
+    with metrics.timer("file.extract", doc_file_path):
+        try:
+            with mapped_docs.map_file(doc_file_path) as view:
+                data = extract_record_from_content(
+                    get_component_name(doc_file_path), mapped_docs.prepare(view)
+                )
+        except Exception as e:
+            logger.error("Failed to parse %s: %s", doc_file_path, e)
+            metrics.count("extract.failed")
+            metrics.fail_with(doc_file_path, e)
+            return None
 
-            # now we now it has 2 code blocks
+    if data is not None:
+        metrics.count("extract.records")
+    return data
 
-            # check if each code block has expected content
-            # import starts with import ends with " or ";
-            # usage has some code
 
-            import_code_block = code_blocks[0]
-            usage_code_block = code_blocks[1]
+def serialize_record_json(data):
+    return record_store.serialize_record_json(data)
 
-            if len(import_code_block) == 0:
-                valid = import_code_block.startswith("import") and (
-                    import_code_block.endswith('"') or import_code_block.endswith('";')
-                )
-                if not valid:
-                    print(f"IMPROPER IMPORT: {get_file_name_from_path(test.name)}")
-                    return False
 
-            if len(usage_code_block) == 0:
-                print(f"NO USAGE CODE: {get_file_name_from_path(test.name)}")
-                return False
+def write_record_json(data):
+    output_file = f"{data['name']}.json"
 
-            output_file = f"{remove_extension(get_file_name_from_path(test.name))}.json"
+    logger.debug(
+        "Writing %s contents to %s",
+        output_file,
+        os.path.join(config.DIR_GENERATED_JSONS, output_file),
+    )
+    # Left alone when it already holds the same record
+    return reconcile.write_if_changed(
+        os.path.join(config.DIR_GENERATED_JSONS, output_file),
+        serialize_record_json(data),
+    )
 
-            os.makedirs(config.DIR_GENERATED_JSONS, exist_ok=True)
 
-            print(
-                f"Writing {output_file} contents to {os.path.join(config.DIR_GENERATED_JSONS, output_file)}"
-            )
-            with open(
-                os.path.join(config.DIR_GENERATED_JSONS, output_file),
-                "w",
-                encoding="utf-8",
-            ) as write_file:
-                data = {
-                    "name": remove_extension(
-                        get_file_name_from_path(test.name)
-                    ),  # duplicate code
-                    "import": import_code_block,
-                    "usage": usage_code_block,
-                }
-                json.dump(data, write_file, indent=2, ensure_ascii=True)
+def parse_component_doc_file(doc_file_path):
+    data = extract_record(doc_file_path)
+    if data is None:
+        return False
 
+    try:
+        write_record_json(data)
     except Exception as e:
-        print(f"Failed to parse {doc_file_path}", e)
+        logger.error("Failed to write %s: %s", doc_file_path, e)
+        return False
+
+    return True
 
 
 def clean_directory(directory_path):
@@ -180,57 +171,171 @@ def clean_directory(directory_path):
             # Check if it's a file (not a directory)
             if os.path.isfile(file_path):
                 os.remove(file_path)  # Remove the file
-                print(f"Deleted file: {file_path}")
+                logger.debug("Deleted file: %s", file_path)
             # Optionally, you can also check for directories and remove files inside
             # elif os.path.isdir(file_path):
             #     clean_directory(file_path)  # Recursively clean subdirectories
-        print(f"Directory cleaned: {directory_path}")
+        logger.info("Directory cleaned: %s", directory_path)
     except Exception as e:
-        print(f"Error cleaning directory: {e}")
-
-
-def filter_unique_filenames(paths1, paths2):
-    seen_filenames = {}  # Maps filename to its full path
-    unique_paths = []
-    duplicate_paths = []
-
-    # Combine both path arrays
-    all_paths = paths1 + paths2
-
-    for path in all_paths:
-        filename = os.path.basename(path)
-
-        if filename not in seen_filenames:
-            # First time seeing this filename
-            seen_filenames[filename] = path
-            unique_paths.append(path)
-        else:
-            # We've seen this filename before
-            duplicate_paths.append(path)
-
-    return unique_paths, duplicate_paths
-
+        logger.error("Error cleaning directory: %s", e)
+
+
+def get_unique_doc_files():
+    # One doc per component, override docs first, then auto, then manual docs
+    index = overlay_index.load_index()
+
+    shadowed = index.shadowed()
+    if len(shadowed) > 0:
+        logger.warning(
+            "THERE ARE DUPLICATE DOCS FOR %s",
+            ", ".join(f"{path} ({layer})" for _, layer, path in shadowed),
+        )
+    for layer, filenames in index.conflicts.items():
+        if len(filenames) > 0:
+            logger.warning(
+                "More than one %s doc for the same component, ignoring %s",
+                layer,
+                ", ".join(filenames),
+            )
 
-def extract_defaults():
-    auto_docs = get_doc_files_from_dir(config.DIR_AUTO_DOCS)
-    manual_docs = get_doc_files_from_dir(config.DIR_MANUAL_DOCS)
+    overlay_index.save_index(index)
+    return index.resolved_paths()
 
-    # check for duplicates
-    # exit if duplicates file names, sort it out!
-    unique_filepaths, duplicate_filepaths = filter_unique_filenames(
-        auto_docs, manual_docs
-    )
 
-    if len(duplicate_filepaths) > 0:
-        print("THERE ARE DUPLICATE DOCS FOR")
-        print(duplicate_filepaths)
+def iter_records(doc_file_paths):
+    # Yields the {name, import, usage} record of every doc that has one
+    # Docs are mapped and parsed ahead in bulk while earlier records are consumed
+    records = bulk_read.read_files(doc_file_paths, read=extract_record)
+    try:
+        for data in records:
+            if data is not None:
+                yield data
+    finally:
+        records.close()
+
+
+def tee_records_to_jsonl(records, jsonl_path):
+    # Passes the records through, writing each one as a line of a JSONL file on the way
+    with open(jsonl_path, "w", encoding="utf-8") as file:
+        for data in records:
+            file.write(json.dumps(data, ensure_ascii=True))
+            file.write("\n")
+            yield data
+        metrics.count_written(file)
+
+
+def write_records_jsonl(records, jsonl_path):
+    for _ in tee_records_to_jsonl(records, jsonl_path):
+        pass
+
+
+def plan_jsons(doc_plans=None, filenames=None):
+    """
+    Plans the generated JSONs folder from the docs, without writing anything.
+
+    :param doc_plans: The auto and manual docs plans from check_component_docs.plan_docs,
+        to plan against the docs as they'll be once those are applied. By default
+        the docs on disk are used.
+    :param filenames: Only plan the JSONs of these doc filenames, the rest are kept.
+    """
+    desired = {}
+    scope = None
+    if filenames is not None:
+        scope = {f"{get_component_name(filename)}.json" for filename in filenames}
+
+    for data in iter_doc_records(doc_plans, filenames):
+        desired[f"{data['name']}.json"] = serialize_record_json(data)
+    return reconcile.plan_directory(config.DIR_GENERATED_JSONS, desired, scope=scope)
+
+
+def plan_store(store, doc_plans=None, filenames=None):
+    # Same as plan_jsons for the record store
+    scope = None
+    if filenames is not None:
+        scope = {get_component_name(filename) for filename in filenames}
+    return store.plan(iter_doc_records(doc_plans, filenames), scope)
+
+
+def iter_doc_records(doc_plans=None, filenames=None):
+    # The records of the docs the JSONs and the store are planned from,
+    # see plan_jsons for the arguments
+    if doc_plans is not None:
+        # Override docs aren't planned, they're only ever edited by hand
+        override_plan = reconcile.plan_directory(
+            config.DIR_OVERRIDE_DOCS, {}, update=False, delete=False
+        )
+        records = iter_planned_records([override_plan, *doc_plans], filenames)
+    elif filenames is not None:
+        records = iter_records(get_doc_files_by_name(filenames))
+    else:
+        records = iter_records(get_unique_doc_files())
+    return records
+
+
+def get_doc_files_by_name(filenames):
+    # Same precedence as get_unique_doc_files, for just the given filenames
+    index = overlay_index.load_index()
+    doc_files = []
+    for component in sorted({get_component_name(filename) for filename in filenames}):
+        resolved = index.resolve(component)
+        if resolved is not None:
+            doc_files.append(resolved[1])
+    overlay_index.save_index(index)
+    return doc_files
 
-    # Clean output directory
-    clean_directory(config.DIR_GENERATED_JSONS)
 
-    # Parse and create JSON from each doc
-    for x in unique_filepaths:
-        parse_component_doc_file(x)
+def iter_planned_records(doc_plans, filenames=None):
+    # Same precedence as get_unique_doc_files, the first plan wins a component
+    components = None
+    if filenames is not None:
+        components = {get_component_name(filename) for filename in filenames}
+    seen = set()
+    for plan in doc_plans:
+        for filename in plan.file_names():
+            component = get_component_name(filename)
+            if component in seen or os.path.splitext(filename)[1] not in DOC_EXTENSIONS:
+                continue
+            if components is not None and component not in components:
+                continue
+            seen.add(component)
+            try:
+                data = extract_record_from_content(
+                    get_component_name(filename), plan.read(filename)
+                )
+            except Exception as e:
+                logger.error("Failed to parse %s: %s", filename, e)
+                metrics.count("extract.failed")
+                continue
+            if data is not None:
+                yield data
+
+
+@metrics.timed("stage.extract_defaults")
+@profiling.profiled("extract_defaults")
+def extract_defaults(dry_run=False, filenames=None, export_jsons=False):
+    # Only records that differ get rewritten and only ones without a doc get removed,
+    # all in one transaction
+    # filenames limits the run to the records of those docs, see plan_jsons
+    # export_jsons also writes the store out as one JSON file per component
+    with record_store.RecordStore() as store:
+        plan = plan_store(store, filenames=filenames)
+        if dry_run:
+            for line in plan.describe():
+                logger.info("%s", line)
+            return plan
+        plan.apply()
+        if export_jsons:
+            record_store.plan_json_export(store).apply()
+    return plan
+
+
+def stream_defaults(jsonl_path=None):
+    # Same as extract_defaults but hands the records over as a generator instead of
+    # writing a JSON file per component, pass it to write_to_template directly
+    records = iter_records(get_unique_doc_files())
+    if jsonl_path is not None:
+        records = tee_records_to_jsonl(records, jsonl_path)
+    return records
 
 
 # Needs argument for output destination
@@ -0,0 +1,176 @@
+import config
+import argparse
+import os
+import random
+
+# Real shadcn/ui component names, numbered copies are added on top for big corpora
+COMPONENT_NAMES = [
+    "accordion",
+    "alert",
+    "alert-dialog",
+    "aspect-ratio",
+    "avatar",
+    "badge",
+    "breadcrumb",
+    "button",
+    "calendar",
+    "card",
+    "carousel",
+    "chart",
+    "checkbox",
+    "collapsible",
+    "combobox",
+    "command",
+    "context-menu",
+    "data-table",
+    "date-picker",
+    "dialog",
+    "drawer",
+    "dropdown-menu",
+    "form",
+    "hover-card",
+    "input",
+    "input-otp",
+    "label",
+    "menubar",
+    "navigation-menu",
+    "pagination",
+    "popover",
+    "progress",
+    "radio-group",
+    "resizable",
+    "scroll-area",
+    "select",
+    "separator",
+    "sheet",
+    "sidebar",
+    "skeleton",
+    "slider",
+    "sonner",
+    "switch",
+    "table",
+    "tabs",
+    "textarea",
+    "toast",
+    "toggle",
+    "toggle-group",
+    "tooltip",
+]
+
+# The shapes check_files_in_directory has to deal with, and how often they show up
+DOC_SHAPES = {
+    "good": 0.6,
+    "too_many_code_blocks": 0.1,
+    "multiple_imports": 0.1,
+    "not_simple_usage": 0.1,
+    "no_usage_section": 0.1,
+}
+
+EXTENSIONS = [".mdx", ".mdx", ".mdx", ".md", ".txt"]
+
+
+def to_component(name):
+    return "".join(part.capitalize() for part in name.split("-"))
+
+
+def fence(code, info="tsx"):
+    return f"```{info}\n{code}\n```\n"
+
+
+def make_doc(name, shape, rng):
+    component = to_component(name)
+    import_code = f'import {{ {component} }} from "@/components/ui/{name}"'
+    usage_code = f"<{component}>\n  <{component}Content>Hello</{component}Content>\n</{component}>"
+
+    parts = [
+        "---\n",
+        f"title: {component}\n",
+        f"description: Displays a {name.replace('-', ' ')} component.\n",
+        "component: true\n",
+        "---\n\n",
+        f'<ComponentPreview name="{name}-demo" />\n\n',
+        "## Installation\n\n",
+        '<CodeTabs>\n\n<TabsList>\n  <TabsTrigger value="cli">CLI</TabsTrigger>\n</TabsList>\n\n',
+        '<TabsContent value="cli">\n\n',
+        fence(f"npx shadcn@latest add {name}", "bash"),
+        "\n</TabsContent>\n\n</CodeTabs>\n\n",
+    ]
+
+    if shape != "no_usage_section":
+        parts.append("## Usage\n\n")
+        if shape == "multiple_imports":
+            parts.append(fence(f'{import_code}\nimport {{ cn }} from "@/lib/utils"'))
+        else:
+            parts.append(fence(import_code))
+        parts.append("\n")
+        if shape == "not_simple_usage":
+            parts.append(
+                fence(
+                    f"export function {component}Demo() {{\n  return {usage_code}\n}}"
+                )
+            )
+        else:
+            parts.append(fence(usage_code, 'tsx showLineNumbers title="example.tsx"'))
+        if shape == "too_many_code_blocks":
+            parts.append("\n")
+            parts.append(fence(usage_code.replace("Hello", "Again")))
+
+    parts.append("\n## Examples\n\n")
+    for example in range(rng.randint(1, 4)):
+        parts.append(f"### Example {example + 1}\n\n")
+        parts.append(f'<ComponentPreview name="{name}-example-{example}" />\n\n')
+        parts.append(rng.choice(["Some text about it.\n\n", "", "See the API.\n\n"]))
+
+    return "".join(parts)
+
+
+def pick_shape(rng, shapes=DOC_SHAPES):
+    point = rng.random() * sum(shapes.values())
+    for shape, weight in shapes.items():
+        point -= weight
+        if point < 0:
+            return shape
+    return "good"
+
+
+def generate_corpus(directory=config.DIR_DOCS_FROM_REPO, docs=1000, seed=0):
+    # Writes a deterministic shadcn-style doc corpus, returns {filename: shape}
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    shapes = {}
+    for position in range(docs):
+        base = COMPONENT_NAMES[position % len(COMPONENT_NAMES)]
+        copy = position // len(COMPONENT_NAMES)
+        name = base if copy == 0 else f"{base}-{copy}"
+        filename = name + rng.choice(EXTENSIONS)
+        shape = pick_shape(rng)
+
+        with open(os.path.join(directory, filename), "w", encoding="utf-8") as file:
+            file.write(make_doc(name, shape, rng))
+        shapes[filename] = shape
+
+    return shapes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="GenerateCorpus",
+        description="Generate a synthetic shadcn/ui style component doc corpus.",
+    )
+    parser.add_argument("-n", "--docs", type=int, default=1000, help="Number of docs.")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=config.DIR_DOCS_FROM_REPO,
+        help="Folder to write the docs into.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    shapes = generate_corpus(args.output, args.docs, args.seed)
+    print(f"Generated {len(shapes)} docs in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import config
+import mapped_docs
+import metrics
+import posixpath
+import subprocess
+import threading
+
+logger = metrics.get_logger(__name__)
+
+# Tree entry modes of files, symlinks and submodules aren't docs
+BLOB_MODES = {b"100644", b"100755"}
+
+
+class GitError(Exception):
+    pass
+
+
+class DocChange:
+    """
+    One upstream doc that differs between two commits.
+    status is "A" (added), "M" (modified), "D" (deleted) or "R" (renamed, from old_filename).
+    """
+
+    def __init__(self, status, filename, old_filename=None):
+        self.status = status
+        self.filename = filename
+        self.old_filename = old_filename
+
+    def __repr__(self):
+        if self.old_filename is not None:
+            return f"{self.status} {self.old_filename} -> {self.filename}"
+        return f"{self.status} {self.filename}"
+
+
+def diff_docs(repo_dir, old_commit, new_commit, docs_path=config.GIT_DOCS_PATH):
+    """
+    Lists the docs right in docs_path that were added, modified, deleted or renamed
+    between two commits, using the local repository only.
+
+    :return: List of DocChange.
+    """
+    docs_path = docs_path.strip("/")
+    try:
+        output = subprocess.run(
+            [
+                "git",
+                "diff-tree",
+                "-r",
+                "-z",
+                "-M",
+                "--name-status",
+                old_commit,
+                new_commit,
+                "--",
+                docs_path,
+            ],
+            cwd=repo_dir,
+            capture_output=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GitError(
+            f"Could not diff {old_commit[:12]}..{new_commit[:12]} in {repo_dir}."
+        ) from e
+
+    def doc_filename(path):
+        # None for anything that isn't right in the docs folder
+        directory, filename = posixpath.split(path)
+        return filename if directory == docs_path else None
+
+    changes = []
+    fields = output.decode("utf-8", "surrogateescape").split("\0")
+    position = 0
+    while position < len(fields) and fields[position]:
+        status = fields[position][0]
+        if status in "RC":
+            old_path, new_path = fields[position + 1], fields[position + 2]
+            position += 3
+        else:
+            old_path = new_path = fields[position + 1]
+            position += 2
+
+        old_filename, filename = doc_filename(old_path), doc_filename(new_path)
+        if status == "R" and old_filename and filename:
+            changes.append(DocChange("R", filename, old_filename))
+        elif status == "D" or (status == "R" and old_filename):
+            if old_filename:
+                changes.append(DocChange("D", old_filename))
+        elif status in "RCA":
+            if filename:
+                changes.append(DocChange("A", filename))
+        elif filename:
+            # Modified, or its type changed
+            changes.append(DocChange("M", filename))
+    return changes
+
+
+def changed_filenames(changes):
+    # Every doc filename a list of DocChange touches, both sides of a rename
+    filenames = set()
+    for change in changes:
+        filenames.add(change.filename)
+        if change.old_filename is not None:
+            filenames.add(change.old_filename)
+    return filenames
+
+
+class CatFileBatch:
+    """
+    One long-lived `git cat-file --batch` process, objects are asked for one at a time
+    over its stdin instead of starting git for every file.
+    """
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.lock = threading.Lock()
+        try:
+            self.process = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                cwd=repo_dir,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        except OSError as e:
+            raise GitError(f"Could not start git in {repo_dir}: {e}") from e
+
+    def read(self, object_name):
+        """
+        :param object_name: Anything git can resolve, e.g. a blob id, "main^{commit}"
+            or "<commit>:<tree path>".
+        :return: (object id, type, content bytes).
+        """
+        with self.lock:
+            self.process.stdin.write(object_name.encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+            if not header:
+                raise GitError(f"git cat-file exited in {self.repo_dir}.")
+            if header.endswith(b" missing\n") or header.endswith(b" ambiguous\n"):
+                raise KeyError(object_name)
+            object_id, object_type, size = header.split()
+            data = self.process.stdout.read(int(size))
+            # Every object is followed by a newline
+            self.process.stdout.read(1)
+
+        metrics.count("io.git_objects_read")
+        metrics.count("io.bytes_read", len(data))
+        return object_id.decode("ascii"), object_type.decode("ascii"), data
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def parse_tree(data, hash_size):
+    # Raw tree objects are "<mode> <name>\0<binary id>" entries back to back
+    entries = []
+    position = 0
+    while position < len(data):
+        space = data.index(b" ", position)
+        nul = data.index(b"\0", space)
+        mode = data[position:space]
+        name = data[space + 1 : nul]
+        object_id = data[nul + 1 : nul + 1 + hash_size].hex()
+        entries.append((mode, name.decode("utf-8", "surrogateescape"), object_id))
+        position = nul + 1 + hash_size
+    return entries
+
+
+class GitSource:
+    """
+    Upstream docs read straight out of a local git repository at a given ref, nothing
+    gets checked out. Docs are keyed by their tree path and blob id, so an unchanged
+    blob is an unchanged doc.
+
+    Instances can be sent to pool workers, each process starts its own cat-file.
+    """
+
+    def __init__(self, repo_dir, ref="HEAD", docs_path=config.GIT_DOCS_PATH):
+        self.repo_dir = repo_dir
+        self.ref = ref
+        self.docs_path = docs_path.strip("/")
+        self.batch = None
+        # Blob sizes are only known once a blob has been read
+        self.sizes = {}
+        try:
+            self.commit, _, _ = self.get_batch().read(f"{ref}^{{commit}}")
+        except KeyError:
+            raise GitError(f"Could not resolve '{ref}' in {repo_dir}.") from None
+        self.blobs = self.list_blobs()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["batch"] = None
+        return state
+
+    def get_batch(self):
+        if self.batch is None:
+            self.batch = CatFileBatch(self.repo_dir)
+        return self.batch
+
+    def list_blobs(self):
+        # Maps filename -> blob id for the files right in the docs folder
+        try:
+            tree_id, object_type, data = self.get_batch().read(
+                f"{self.commit}:{self.docs_path}"
+            )
+        except KeyError:
+            raise GitError(
+                f"'{self.docs_path}' does not exist at {self.commit[:12]} ({self.ref})."
+            ) from None
+        if object_type != "tree":
+            raise GitError(f"'{self.docs_path}' is not a folder.")
+
+        return {
+            name: object_id
+            for mode, name, object_id in parse_tree(data, len(tree_id) // 2)
+            if mode in BLOB_MODES
+        }
+
+    def key(self, filename):
+        # What the build manifest records the doc under
+        return f"git:{self.docs_path}/{filename}"
+
+    def scan(self):
+        # Same shape as manifest.scan_sources, with the blob id as the signature
+        return {
+            filename: {self.key(filename): blob_id}
+            for filename, blob_id in self.blobs.items()
+        }
+
+    def changes_since(self, old_commit):
+        # The docs that changed between old_commit and this source's commit
+        return diff_docs(self.repo_dir, old_commit, self.commit, self.docs_path)
+
+    def read_text(self, filename):
+        # The doc as text, or None if the ref doesn't have it
+        blob_id = self.blobs.get(filename)
+        if blob_id is None:
+            return None
+        _, _, data = self.get_batch().read(blob_id)
+        self.sizes[filename] = len(data)
+        # Same newlines as reading a checked out file in text mode
+        return mapped_docs.decode(data)
+
+    def size(self, filename):
+        # Bytes of the doc if it has been read in this process, for the per-file timings
+        return self.sizes.get(filename)
+
+    def close(self):
+        if self.batch is not None:
+            self.batch.close()
+            self.batch = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,218 @@
+import metrics
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows, docs only get the time budget there
+    resource = None
+
+logger = metrics.get_logger(__name__)
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MEMORY_LIMIT_MB = 1024
+
+
+def get_address_space_size():
+    # Virtual memory of this process in bytes, None where /proc isn't around
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def set_memory_limit(memory_limit_mb):
+    # The budget comes on top of what the worker already has mapped, so it means
+    # the same thing however big the interpreter and its imports are
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024 + (get_address_space_size() or 0)
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def worker_main(connection, initializer, memory_limit_mb):
+    if initializer is not None:
+        initializer()
+    set_memory_limit(memory_limit_mb)
+    # The function comes over the pipe, so it's pickled like pool tasks are and
+    # nothing like a live git process gets shared with the parent
+    function = connection.recv()
+    while True:
+        try:
+            item = connection.recv()
+        except EOFError:
+            return
+        if item is None:
+            return
+        try:
+            connection.send(("done", function(item)))
+        except Exception as e:
+            reason = "memory" if isinstance(e, MemoryError) else "error"
+            connection.send(("failed", reason, metrics.describe_error(e)))
+
+
+class IsolatedWorker:
+    def __init__(self, context, function, initializer, memory_limit_mb):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child_connection, initializer, memory_limit_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.connection.send(function)
+        self.item = None
+        self.deadline = None
+
+    def assign(self, item, timeout):
+        self.item = item
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.connection.send(item)
+
+    def finish(self):
+        item = self.item
+        self.item = None
+        self.deadline = None
+        return item
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class IsolatedPool:
+    """
+    Runs every item in a worker process, with a wall-clock budget per item and a
+    memory budget per worker. A worker whose item runs over its time, raises or
+    crashes is replaced and only that item fails, the other workers keep going.
+    Failed items end up in failures as (item, reason, detail), reason being
+    "timeout", "memory", "crash" or "error".
+
+    Used like the concurrent.futures executors, see pipeline.EXECUTORS.
+    """
+
+    def __init__(
+        self,
+        max_workers=None,
+        initializer=None,
+        timeout=DEFAULT_TIMEOUT,
+        memory_limit=DEFAULT_MEMORY_LIMIT_MB,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.initializer = initializer
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.context = multiprocessing.get_context()
+        self.failures = []
+
+    def map(self, function, items, chunksize=None):
+        # chunksize is only there for the executor interface, every item goes on
+        # its own so a bad one can't take others down with it
+        # Results come in the order items finish, failed items have none
+        pending = deque(items)
+        results = []
+        workers = []
+
+        def start_worker():
+            return IsolatedWorker(
+                self.context, function, self.initializer, self.memory_limit
+            )
+
+        def fail(worker, reason, detail):
+            item = worker.finish()
+            self.failures.append((item, reason, detail))
+            logger.warning("Quarantined %s (%s): %s", item, reason, detail)
+
+        try:
+            for _ in range(min(self.max_workers, len(pending))):
+                workers.append(start_worker())
+            for worker in workers:
+                if pending:
+                    worker.assign(pending.popleft(), self.timeout)
+
+            while any(worker.item is not None for worker in workers):
+                busy = [worker for worker in workers if worker.item is not None]
+                deadlines = [w.deadline for w in busy if w.deadline is not None]
+                wait_for = None
+                if deadlines:
+                    wait_for = max(0.0, min(deadlines) - time.monotonic())
+                ready = wait(
+                    [w.connection for w in busy] + [w.process.sentinel for w in busy],
+                    timeout=wait_for,
+                )
+
+                now = time.monotonic()
+                for position, worker in enumerate(workers):
+                    if worker.item is None:
+                        continue
+                    replace = None
+                    if worker.connection in ready:
+                        try:
+                            message = worker.connection.recv()
+                        except (EOFError, OSError):
+                            message = None
+                        if message is None:
+                            replace = worker.kill
+                            fail(
+                                worker,
+                                "crash",
+                                f"Worker exited with code {worker.process.exitcode}.",
+                            )
+                        elif message[0] == "done":
+                            worker.finish()
+                            results.append(message[1])
+                        else:
+                            # Whatever half done state the item left behind
+                            # goes with the worker, it's still fine to
+                            # wind down on its own
+                            replace = worker.stop
+                            fail(worker, message[1], message[2])
+                    elif worker.process.sentinel in ready:
+                        worker.process.join()
+                        replace = worker.kill
+                        fail(
+                            worker,
+                            "crash",
+                            f"Worker exited with code {worker.process.exitcode}.",
+                        )
+                    elif worker.deadline is not None and now >= worker.deadline:
+                        replace = worker.kill
+                        fail(worker, "timeout", f"Took longer than {self.timeout:g}s.")
+
+                    if replace is not None:
+                        replace()
+                        worker = workers[position] = start_worker()
+                    if worker.item is None and pending:
+                        worker.assign(pending.popleft(), self.timeout)
+        finally:
+            for worker in workers:
+                if worker.item is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
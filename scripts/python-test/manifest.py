@@ -0,0 +1,178 @@
+import config
+import hashlib
+import json
+import metrics
+import os
+
+logger = metrics.get_logger(__name__)
+
+# Bump this when the output of the pipeline changes for the same input,
+# an older manifest then just triggers a full rebuild
+MANIFEST_VERSION = 4
+
+SOURCE_DIRS = (
+    config.DIR_DOCS_FROM_REPO,
+    config.DIR_AUTO_DOCS,
+    config.DIR_MANUAL_DOCS,
+)
+
+
+def empty_manifest(options=None):
+    return {
+        "version": MANIFEST_VERSION,
+        "options": options or {},
+        "docs": {},
+        "templates": {},
+    }
+
+
+def load_manifest(manifest_path=config.MANIFEST_FILE, options=None):
+    # options are the pipeline settings that change which outputs get written,
+    # a manifest built with different ones can't be reused
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return empty_manifest(options)
+    except Exception as e:
+        logger.warning("Ignoring unreadable manifest %s: %s", manifest_path, e)
+        return empty_manifest(options)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.info("Manifest is from a different version, doing a full rebuild.")
+        return empty_manifest(options)
+
+    if manifest.get("options") != (options or {}):
+        logger.info("Manifest was built with different options, doing a full rebuild.")
+        return empty_manifest(options)
+
+    return manifest
+
+
+def read_manifest_options(manifest_path=config.MANIFEST_FILE):
+    # The options the last run was built with, or None if there is no usable manifest
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file).get("options")
+    except Exception:
+        return None
+
+
+def read_manifest_upstream(manifest_path=config.MANIFEST_FILE):
+    # The upstream commit the last run read its docs from, None if it didn't use git
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file).get("upstream")
+    except Exception:
+        return None
+
+
+def save_manifest(manifest, manifest_path=config.MANIFEST_FILE):
+    # Write to a temp file first so a crash never leaves half a manifest behind.
+    # One dumps call, json.dump writes every little piece on its own
+    data = json.dumps(manifest, ensure_ascii=True, sort_keys=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(data)
+    os.replace(tmp_path, manifest_path)
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def stat_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def scan_sources(source_dirs=SOURCE_DIRS):
+    # Maps filename -> {path: [size, mtime_ns]} for every doc in the source folders
+    # Only stats files, nothing gets read here
+    sources = {}
+    for directory in source_dirs:
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                # entry.path is the directory joined with the name
+                sources.setdefault(entry.name, {})[entry.path] = [
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ]
+    return sources
+
+
+def describe_file(file_path, signature=None):
+    return {
+        "stat": signature or stat_signature(file_path),
+        "sha256": hash_file(file_path),
+    }
+
+
+def inputs_unchanged(entry, signatures, refreshed=None):
+    # Cheap stat comparison first, only rehash files whose stat changed
+    # Updates the recorded stat when the content turns out to be the same,
+    # adding the file to refreshed
+    inputs = entry["inputs"]
+    if set(inputs) != set(signatures):
+        return False
+
+    for file_path, signature in signatures.items():
+        recorded = inputs[file_path]
+        if "blob" in recorded:
+            # Docs read from git, the blob id already is a content hash
+            if recorded["blob"] != signature:
+                return False
+            continue
+        if recorded["stat"] == signature:
+            continue
+        if recorded["stat"][0] != signature[0]:
+            return False
+        if hash_file(file_path) != recorded["sha256"]:
+            return False
+        recorded["stat"] = signature
+        if refreshed is not None:
+            refreshed.append(file_path)
+
+    return True
+
+
+def outputs_present(entry):
+    return all(os.path.isfile(file_path) for file_path in entry["outputs"])
+
+
+def remove_unmodified_outputs(entry, file_paths):
+    # Deletes the given outputs if they still have the content the pipeline wrote
+    # Anything edited by hand since is left alone
+    removed = []
+    for file_path in file_paths:
+        recorded = entry["outputs"].get(file_path)
+        if recorded is None or not os.path.isfile(file_path):
+            continue
+        if hash_file(file_path) == recorded:
+            os.remove(file_path)
+            logger.debug("Deleted stale output: %s", file_path)
+            removed.append(file_path)
+    return removed
+
+
+def templates_unchanged(manifest, template_paths):
+    recorded = manifest.get("templates", {})
+    for file_path in template_paths:
+        if file_path not in recorded or not os.path.isfile(file_path):
+            return False
+        if recorded[file_path]["stat"] != stat_signature(file_path):
+            return False
+    return True
@@ -0,0 +1,172 @@
+import codecs
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+logger = metrics.get_logger(__name__)
+
+# Docs that are indexed as decoded text instead of bytes. A carriage return without
+# a newline after it, text mode turns those into newlines which moves line starts
+# around, and the UTF-8 of doc_index.UNICODE_WHITESPACE, which \s and strip() only
+# see as whitespace in text
+NEEDS_TEXT = re.compile(
+    rb"\r(?!\n)|[\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80"
+    rb"|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80"
+)
+
+VALIDATE_CHUNK_SIZE = 64 * 1024
+
+
+@contextmanager
+def map_file(path):
+    # The file mapped read only, empty files can't be mapped and come out as b""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        metrics.count("io.files_mapped")
+        if size == 0:
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            yield view
+
+
+def stat_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def decode(data):
+    # Same as reading the bytes in text mode
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def as_text(value):
+    # str stays as it is, bytes get decoded and a TextSpan reads its text
+    if isinstance(value, str):
+        return value
+    if isinstance(value, TextSpan):
+        return value.text()
+    return decode(value)
+
+
+def prepare(data):
+    """
+    Gets mapped (or read) doc bytes ready for doc_index.index_doc, without decoding
+    the whole doc. Raises UnicodeDecodeError for a doc that isn't UTF-8, same as
+    reading it in text mode would.
+
+    :return: data itself, or the decoded text if the bytes wouldn't match the way
+        text mode sees the doc.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for position in range(0, len(data), VALIDATE_CHUNK_SIZE):
+        decoder.decode(data[position : position + VALIDATE_CHUNK_SIZE])
+    decoder.decode(b"", final=True)
+    if NEEDS_TEXT.search(data) is not None:
+        return decode(data[:])
+    return data
+
+
+class StaleSpanError(RuntimeError):
+    # A TextSpan whose doc changed (or was released) since it was indexed, its
+    # offsets don't point at the text they were made for any more
+    def __init__(self, path, message):
+        super().__init__(message)
+        self.path = path
+
+
+class FileTable:
+    """
+    Gives every mapped doc a small id, so a TextSpan only needs to hold two offsets
+    and an int. The size and mtime are kept to catch a doc changing under its spans.
+    Entries are dropped when the last build() ends, so a watch or the daemon doesn't
+    keep one for every doc it ever checked.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.ids = {}
+        # Ids are never reused, a span that outlived its build can't read another doc
+        self.next_id = 0
+        self.builds = 0
+
+    @contextmanager
+    def build(self):
+        # Spans made inside are only good until the last build that's running ends
+        with self.lock:
+            self.builds += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.builds -= 1
+                if self.builds == 0:
+                    metrics.count("mapped.files_released", len(self.files))
+                    self.files.clear()
+                    self.ids.clear()
+
+    def add(self, path):
+        signature = stat_signature(path)
+        with self.lock:
+            file_id = self.ids.get(path)
+            if file_id is None or self.files[file_id][1] != signature:
+                file_id = self.next_id
+                self.next_id += 1
+                self.files[file_id] = (path, signature)
+                self.ids[path] = file_id
+            return file_id
+
+    def path(self, file_id):
+        entry = self.files.get(file_id)
+        return None if entry is None else entry[0]
+
+    def read(self, file_id, start, end):
+        entry = self.files.get(file_id)
+        if entry is None:
+            raise StaleSpanError(None, f"Doc {file_id} was released after its build.")
+        path, signature = entry
+        try:
+            changed = stat_signature(path) != signature
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            raise StaleSpanError(path, f"{path} changed since it was indexed.")
+        with map_file(path) as view:
+            return view[start:end]
+
+
+FILES = FileTable()
+
+
+class TextSpan:
+    """
+    A piece of a mapped doc, e.g. its Usage section. The text is only read and
+    decoded when text() is called, so holding thousands of these costs next to nothing.
+    Spans point into this process' FILES, they can't be sent to other processes.
+    """
+
+    __slots__ = ("file_id", "start", "end")
+
+    def __init__(self, file_id, start, end):
+        self.file_id = file_id
+        self.start = start
+        self.end = end
+
+    @property
+    def path(self):
+        return FILES.path(self.file_id)
+
+    def text(self):
+        metrics.count("mapped.spans_decoded")
+        return decode(FILES.read(self.file_id, self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"TextSpan({self.path!r}, {self.start}, {self.end})"
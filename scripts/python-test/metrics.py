@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+LOGGER_NAME = "snippets"
+
+# Silent unless a script opts into output with configure_logging
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+VERBOSITY_LEVELS = {
+    -1: logging.CRITICAL + 1,
+    0: logging.WARNING,
+    1: logging.INFO,
+    2: logging.DEBUG,
+}
+
+
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def configure_logging(verbosity=0):
+    # -1 is fully quiet, 0 warnings and errors, 1 progress, 2 every file
+    level = VERBOSITY_LEVELS[max(-1, min(verbosity, 2))]
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    if not any(
+        isinstance(handler, logging.StreamHandler) for handler in logger.handlers
+    ):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+def add_verbosity_arguments(parser):
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Print progress, twice to print every file.",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Don't print anything, not even warnings.",
+    )
+
+
+def get_verbosity(args):
+    return -1 if args.quiet else args.verbose
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.track_files = False
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.rejections = {}
+        self.timers = {}
+        self.files = []
+        self.failures = []
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reject(self, reason):
+        with self.lock:
+            self.counters["check.files_rejected"] = (
+                self.counters.get("check.files_rejected", 0) + 1
+            )
+            self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+    def fail(self, file_path, reason, detail=None):
+        # A doc that couldn't be processed at all, as opposed to one the check rejected
+        with self.lock:
+            self.counters["run.files_quarantined"] = (
+                self.counters.get("run.files_quarantined", 0) + 1
+            )
+            self.failures.append(
+                {"file": str(file_path), "reason": reason, "detail": detail}
+            )
+
+    def add_time(self, name, seconds, file_path=None, size=None):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"seconds": 0.0, "count": 0})
+            timer["seconds"] += seconds
+            timer["count"] += 1
+            if file_path is not None and self.track_files:
+                self.files.append(
+                    {
+                        "timer": name,
+                        "file": str(file_path),
+                        "seconds": seconds,
+                        "bytes": size,
+                    }
+                )
+
+    def drain(self):
+        # Hands over everything recorded so far and starts from zero,
+        # used to ship a task's metrics back with its result
+        with self.lock:
+            snapshot = {
+                "counters": self.counters,
+                "rejections": self.rejections,
+                "timers": self.timers,
+                "files": self.files,
+                "failures": self.failures,
+            }
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, amount in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for reason, amount in snapshot["rejections"].items():
+                self.rejections[reason] = self.rejections.get(reason, 0) + amount
+            for name, timer in snapshot["timers"].items():
+                total = self.timers.setdefault(name, {"seconds": 0.0, "count": 0})
+                total["seconds"] += timer["seconds"]
+                total["count"] += timer["count"]
+            self.files.extend(snapshot["files"])
+            self.failures.extend(snapshot["failures"])
+
+    def report(self):
+        with self.lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "rejections": dict(sorted(self.rejections.items())),
+                "timers": dict(sorted(self.timers.items())),
+                "files": list(self.files),
+                "failures": list(self.failures),
+            }
+
+
+# One registry per process, everything recorded outside of a task goes here
+RUN = Metrics()
+
+# The registry of the task a thread is running, see recording
+TASK = threading.local()
+
+
+def current():
+    task = getattr(TASK, "metrics", None)
+    return RUN if task is None else task
+
+
+@contextmanager
+def recording():
+    """
+    Gives the calling thread a registry of its own while the block runs, yielding
+    it. Tasks running side by side on a thread pool would otherwise drain each
+    other's counters and failures out of RUN, this way every result carries what
+    its own doc recorded. Nothing reaches RUN until it's merged.
+    """
+    previous = getattr(TASK, "metrics", None)
+    task = Metrics()
+    task.track_files = RUN.track_files
+    TASK.metrics = task
+    try:
+        yield task
+    finally:
+        TASK.metrics = previous
+
+
+def track_files(enabled=True):
+    # Per-file timings grow with the corpus, so they're only kept on request
+    RUN.track_files = enabled
+
+
+def start_worker(track=False):
+    # Pool initializer, forked workers start out without the parent's numbers,
+    # tasks take track_files from here
+    RUN.reset()
+    RUN.track_files = track
+
+
+def count(name, amount=1):
+    current().count(name, amount)
+
+
+def reject(reason):
+    current().reject(reason)
+
+
+def slowest_files(count):
+    # The count slowest files of every per-file timer, needs track_files
+    by_timer = {}
+    for entry in RUN.report()["files"]:
+        by_timer.setdefault(entry["timer"], []).append(entry)
+    return {
+        timer: sorted(entries, key=lambda entry: entry["seconds"], reverse=True)[:count]
+        for timer, entries in sorted(by_timer.items())
+    }
+
+
+def fail(file_path, reason, detail=None):
+    current().fail(file_path, reason, detail)
+
+
+def describe_error(error):
+    message = str(error)
+    return f"{type(error).__name__}: {message}" if message else type(error).__name__
+
+
+def fail_with(file_path, error):
+    # A doc that raised, a MemoryError means a worker ran out of its memory budget
+    reason = "memory" if isinstance(error, MemoryError) else "error"
+    fail(file_path, reason, describe_error(error))
+
+
+class FileTiming:
+    # What timer yields, size can be set for a file that isn't on disk, e.g. a doc
+    # read from git, otherwise it's looked up from file_path
+    __slots__ = ("size",)
+
+    def __init__(self):
+        self.size = None
+
+
+@contextmanager
+def timer(name, file_path=None):
+    # file_path also records the file on its own when per-file tracking is on
+    started = time.perf_counter()
+    timing = FileTiming()
+    try:
+        yield timing
+    finally:
+        registry = current()
+        size = timing.size
+        if size is None and file_path is not None and registry.track_files:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                pass
+        registry.add_time(name, time.perf_counter() - started, file_path, size)
+
+
+def timed(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_read(file):
+    # Counts the bytes of an open file that's about to be read to the end
+    count("io.files_read")
+    count("io.bytes_read", os.fstat(file.fileno()).st_size)
+
+
+def count_written(file):
+    # Counts the bytes of an open file that's done being written
+    file.flush()
+    count("io.files_written")
+    count("io.bytes_written", os.fstat(file.fileno()).st_size)
+
+
+def write_report(report_path, extra=None):
+    report = RUN.report()
+    report["created"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    if extra:
+        report.update(extra)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
@@ -1,7 +1,37 @@
 import config
+import manifest
+import metrics
+import profiling
 import os
+import re
 import shutil
 import sys
+import write_to_template
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = metrics.get_logger(__name__)
+
+# From <linux/fs.h>, clones a file's extents on btrfs, xfs and friends
+FICLONE = 0x40049409
+
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+
+SYNC_TMP_SUFFIX = ".sync-tmp"
+
+# The template sets the generator writes, sharded or not, e.g. shadcn-ui-usage-snippets-2-of-4.xml
+GENERATED_TEMPLATE_PATTERN = re.compile(
+    "|".join(
+        re.escape(os.path.splitext(file_name)[0]) + r"(?:-\d+-of-\d+)?\.xml"
+        for file_name in (
+            write_to_template.IMPORT_SNIPPETS_FILE,
+            write_to_template.USAGE_SNIPPETS_FILE,
+        )
+    )
+)
 
 
 def copy_files(file_list, target_directory, overwrite=False):
@@ -16,32 +46,167 @@ def copy_files(file_list, target_directory, overwrite=False):
                 os.path.join(target_directory, os.path.basename(file_path))
             ):
                 shutil.copy(file_path, target_directory)
-                print(f"Copied: {file_path} -> {target_directory}")
+                metrics.count("io.files_copied")
+                logger.debug("Copied: %s -> %s", file_path, target_directory)
             else:
-                print(f"File already exists: {file_path}")
+                logger.debug("File already exists: %s", file_path)
         except FileNotFoundError:
-            print(f"File not found: {file_path}")
+            logger.error("File not found: %s", file_path)
         except Exception as e:
-            print(f"Error copying {file_path}: {e}")
+            logger.error("Error copying %s: %s", file_path, e)
+
+
+def files_identical(source_path, target_path):
+    # Cheap checks first, only same sized files get hashed
+    try:
+        if os.path.samefile(source_path, target_path):
+            return True
+        if os.path.getsize(source_path) != os.path.getsize(target_path):
+            return False
+    except FileNotFoundError:
+        return False
+    return manifest.hash_file(source_path) == manifest.hash_file(target_path)
+
+
+def reflink(source_path, target_path):
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform.")
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def place_file(source_path, tmp_path, link_mode="auto"):
+    # Puts the content of source_path at tmp_path as cheaply as the filesystem
+    # allows, returns how it got there
+    if link_mode in ("auto", "reflink"):
+        try:
+            reflink(source_path, tmp_path)
+            return "reflinked"
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if link_mode == "reflink":
+                raise
+
+    if link_mode in ("auto", "hardlink"):
+        try:
+            os.link(source_path, tmp_path)
+            return "hardlinked"
+        except OSError:
+            if link_mode == "hardlink":
+                raise
+
+    shutil.copyfile(source_path, tmp_path)
+    return "copied"
+
+
+def sync_file(source_path, target_directory, link_mode="auto"):
+    """
+    Brings one file into the target directory, leaving it untouched when the content
+    already matches so its mtime stays put.
+    The new content is placed next to the target and renamed over it, so the target
+    is always either the old or the new file.
 
+    :return: "unchanged", "reflinked", "hardlinked" or "copied".
+    """
+    target_path = os.path.join(target_directory, os.path.basename(source_path))
+    if files_identical(source_path, target_path):
+        return "unchanged"
 
-def move_templates_to_plugin():
+    tmp_path = os.path.join(
+        target_directory, f".{os.path.basename(source_path)}{SYNC_TMP_SUFFIX}"
+    )
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        how = place_file(source_path, tmp_path, link_mode)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return how
+
+
+def is_stale_template(filename, keep):
+    if filename in keep:
+        return False
+    if filename.startswith(".") and filename.endswith(SYNC_TMP_SUFFIX):
+        # Left behind by an interrupted sync
+        return True
+    return GENERATED_TEMPLATE_PATTERN.fullmatch(filename) is not None
+
+
+def sync_files(file_list, target_directory, link_mode="auto", remove_stale=False):
+    """
+    Syncs files into a folder, skipping the ones that are already identical.
+
+    :param file_list: The files to sync.
+    :param target_directory: The folder to sync into.
+    :param link_mode: "auto" tries a reflink, then a hardlink, then falls back to a copy.
+    :param remove_stale: Also remove generated template sets that aren't in file_list,
+        e.g. shards of an older layout. Other files in the folder are left alone.
+    :return: Dict from "unchanged", "reflinked", "hardlinked", "copied", "removed"
+        and "failed" to the file names.
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{link_mode}'.")
+
+    os.makedirs(target_directory, exist_ok=True)
+
+    synced = {}
+    for file_path in file_list:
+        try:
+            how = sync_file(file_path, target_directory, link_mode)
+        except FileNotFoundError:
+            logger.error("File not found: %s", file_path)
+            how = "failed"
+        except Exception as e:
+            logger.error("Error syncing %s: %s", file_path, e)
+            how = "failed"
+        metrics.count(f"sync.{how}")
+        logger.debug("Synced (%s): %s -> %s", how, file_path, target_directory)
+        synced.setdefault(how, []).append(os.path.basename(file_path))
+
+    if remove_stale:
+        keep = {os.path.basename(file_path) for file_path in file_list}
+        for filename in sorted(os.listdir(target_directory)):
+            file_path = os.path.join(target_directory, filename)
+            if is_stale_template(filename, keep) and os.path.isfile(file_path):
+                os.remove(file_path)
+                metrics.count("sync.removed")
+                logger.debug("Removed stale template: %s", file_path)
+                synced.setdefault("removed", []).append(filename)
+
+    return synced
+
+
+@metrics.timed("stage.move_templates_to_plugin")
+@profiling.profiled("move_templates_to_plugin")
+def move_templates_to_plugin(link_mode="auto"):
     if not os.path.isdir(config.DIR_GENERATED_LIVE_TEMPLATES):
-        print("Directory with generated live templates does not exist.")
+        logger.error("Directory with generated live templates does not exist.")
         sys.exit(1)
 
     if not os.path.isdir(config.DIR_PLUGIN_RESOURCE_FOLDER):
-        print("Plugin resource folder does not exist.")
+        logger.error("Plugin resource folder does not exist.")
         sys.exit(1)
 
-    files_and_dirs = os.listdir(config.DIR_GENERATED_LIVE_TEMPLATES)
-
-    # Create a list of full file paths
+    # Create a list of full file paths, skipping sets that are still being written
     full_paths = [
-        os.path.join(config.DIR_GENERATED_LIVE_TEMPLATES, file_or_dir)
-        for file_or_dir in files_and_dirs
+        os.path.join(config.DIR_GENERATED_LIVE_TEMPLATES, filename)
+        for filename in sorted(os.listdir(config.DIR_GENERATED_LIVE_TEMPLATES))
+        if not filename.endswith(".tmp")
+        and os.path.isfile(os.path.join(config.DIR_GENERATED_LIVE_TEMPLATES, filename))
     ]
 
-    copy_files(full_paths, config.DIR_PLUGIN_RESOURCE_FOLDER, overwrite=True)
+    synced = sync_files(
+        full_paths, config.DIR_PLUGIN_RESOURCE_FOLDER, link_mode, remove_stale=True
+    )
 
-    print("Successfully copied templates to plugin resource folder.")
+    logger.info(
+        "Synced templates to plugin resource folder: %s.",
+        ", ".join(f"{len(names)} {how}" for how, names in sorted(synced.items()))
+        or "nothing to sync",
+    )
+    return synced
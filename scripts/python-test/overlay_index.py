@@ -0,0 +1,279 @@
+import config
+import argparse
+import json
+import metrics
+import os
+
+logger = metrics.get_logger(__name__)
+
+# The one list of doc extensions, check_component_docs.ALLOWED_EXTENSIONS and
+# extract_defaults.DOC_EXTENSIONS are this set
+DOC_EXTENSIONS = {".md", ".mdx", ".txt"}
+
+# Bump this when the saved index layout changes
+INDEX_VERSION = 1
+
+# Highest precedence first. A team's override beats everything, a generated auto doc
+# beats the hand written manual one, which only exists for docs upstream got wrong
+DOC_LAYERS = (
+    ("override", config.DIR_OVERRIDE_DOCS),
+    ("auto", config.DIR_AUTO_DOCS),
+    ("manual", config.DIR_MANUAL_DOCS),
+)
+
+# Upstream docs can't be extracted from directly, they're only here to report on
+ALL_LAYERS = DOC_LAYERS + (("upstream", config.DIR_DOCS_FROM_REPO),)
+
+
+def get_component_name(filename):
+    # The one naming rule, everything from the first dot goes: button.mdx and
+    # button.v2.md are both button. extract_defaults.get_component_name does the
+    # same for a path
+    return filename.split(".")[0]
+
+
+def doc_precedence(filename, checked):
+    # Sort key for the docs of one component when there are several, e.g. button.md
+    # next to button.mdx, the first one supplies the component like in the index.
+    # checked is whether the upstream doc passed the check, its record then comes
+    # from the auto doc, which beats the manual ones, within a layer the first
+    # filename wins. An override stands in for all of them, so any pick is the same
+    return not checked, filename
+
+
+def directory_signature(directory):
+    # A folder's mtime changes whenever a file is added, removed or renamed in it,
+    # which is all the index cares about
+    try:
+        stat = os.stat(directory)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns
+
+
+def list_doc_files(directory):
+    if not os.path.isdir(directory):
+        return []
+    with os.scandir(directory) as entries:
+        return [
+            entry.name
+            for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1] in DOC_EXTENSIONS
+        ]
+
+
+class OverlayIndex:
+    """
+    Resolves component names over ordered doc layers (folders), the first layer
+    that has a doc for a component supplies it.
+    Every layer keeps a component -> filename map and the winner per component is kept
+    up to date as layers change, so a lookup is a single dict access.
+    """
+
+    def __init__(self, layers=DOC_LAYERS):
+        self.layers = list(layers)
+        self.directories = dict(self.layers)
+        self.precedence = {name: position for position, (name, _) in enumerate(layers)}
+        self.components = {name: {} for name, _ in self.layers}
+        self.signatures = {name: None for name, _ in self.layers}
+        self.resolved = {}
+        # (layer, filename) pairs that lost to another file for the same
+        # component within their own layer, e.g. button.md next to button.mdx
+        self.conflicts = {name: [] for name, _ in self.layers}
+        # Whether there's anything save_index would write differently
+        self.changed = False
+
+    def refresh(self):
+        # Rescans only the layers whose folder changed, returns their names
+        changed = []
+        for name, directory in self.layers:
+            signature = directory_signature(directory)
+            if signature == self.signatures[name] and (
+                signature is not None or not self.components[name]
+            ):
+                # Unchanged, or a folder that's still missing
+                continue
+            self.set_layer_files(name, list_doc_files(directory))
+            self.signatures[name] = signature
+            changed.append(name)
+        if changed:
+            self.changed = True
+            metrics.count("overlay.layers_scanned", len(changed))
+            logger.debug("Rescanned layers: %s", ", ".join(changed))
+        return changed
+
+    def set_layer_files(self, layer, filenames):
+        previous = self.components[layer]
+        components = {}
+        conflicts = []
+        # Sorted so the same files always give the same winner
+        for filename in sorted(filenames):
+            component = get_component_name(filename)
+            if component in components:
+                conflicts.append(filename)
+                continue
+            components[component] = filename
+        self.components[layer] = components
+        self.conflicts[layer] = conflicts
+        self.changed = True
+
+        for component in set(previous) | set(components):
+            if previous.get(component) != components.get(component):
+                self.resolve_component(component)
+
+    def add_file(self, layer, filename):
+        # For callers that know exactly what changed, e.g. a file watcher
+        component = get_component_name(filename)
+        current = self.components[layer].get(component)
+        if current is not None and current <= filename:
+            if current != filename:
+                self.conflicts[layer].append(filename)
+            return
+        if current is not None:
+            self.conflicts[layer].append(current)
+        self.components[layer][component] = filename
+        self.changed = True
+        self.resolve_component(component)
+
+    def remove_file(self, layer, filename):
+        component = get_component_name(filename)
+        if filename in self.conflicts[layer]:
+            self.conflicts[layer].remove(filename)
+            self.changed = True
+            return
+        if self.components[layer].get(component) != filename:
+            return
+        del self.components[layer][component]
+        self.changed = True
+        # A file that lost the conflict takes over
+        for other in sorted(self.conflicts[layer]):
+            if get_component_name(other) == component:
+                self.conflicts[layer].remove(other)
+                self.components[layer][component] = other
+                break
+        self.resolve_component(component)
+
+    def resolve_component(self, component):
+        for name, _ in self.layers:
+            if component in self.components[name]:
+                self.resolved[component] = name
+                return
+        self.resolved.pop(component, None)
+
+    def resolve(self, component):
+        """
+        :return: (layer name, file path) of the doc that supplies the component,
+            or None if no layer has it.
+        """
+        layer = self.resolved.get(component)
+        if layer is None:
+            return None
+        return layer, os.path.join(
+            self.directories[layer], self.components[layer][component]
+        )
+
+    def lookup(self, component):
+        # Every (layer name, file path) that has the component, highest precedence first
+        return [
+            (name, os.path.join(directory, self.components[name][component]))
+            for name, directory in self.layers
+            if component in self.components[name]
+        ]
+
+    def component_names(self):
+        return sorted(self.resolved)
+
+    def resolved_paths(self):
+        return [self.resolve(component)[1] for component in self.component_names()]
+
+    def shadowed(self):
+        # (component, layer name, file path) of every doc a higher layer beats
+        return [
+            (component, name, path)
+            for component in self.component_names()
+            for name, path in self.lookup(component)[1:]
+        ]
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "layers": [
+                {
+                    "name": name,
+                    "directory": directory,
+                    "signature": self.signatures[name],
+                    "files": sorted(
+                        [*self.components[name].values(), *self.conflicts[name]]
+                    ),
+                }
+                for name, directory in self.layers
+            ],
+        }
+
+    def load_dict(self, data):
+        # Only reuses layers that are still set up the same way
+        if data.get("version") != INDEX_VERSION:
+            return
+        for layer in data["layers"]:
+            name = layer["name"]
+            if self.directories.get(name) != layer["directory"]:
+                continue
+            self.set_layer_files(name, layer["files"])
+            self.signatures[name] = layer["signature"]
+
+
+def load_index(index_path=config.OVERLAY_INDEX_FILE, layers=DOC_LAYERS):
+    # A saved index plus a refresh, so only folders that changed since get rescanned
+    index = OverlayIndex(layers)
+    if index_path is not None:
+        try:
+            with open(index_path, "r", encoding="utf-8") as file:
+                index.load_dict(json.load(file))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Ignoring unreadable overlay index %s: %s", index_path, e)
+        else:
+            # Only what the refresh finds makes the saved index out of date
+            index.changed = False
+    index.refresh()
+    return index
+
+
+def save_index(index, index_path=config.OVERLAY_INDEX_FILE):
+    # Nothing is written for an index that's the same as the one loaded.
+    # Write to a temp file first so a crash never leaves half an index behind
+    if not index.changed:
+        return
+    data = json.dumps(index.to_dict(), ensure_ascii=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(data)
+    os.replace(tmp_path, index_path)
+    index.changed = False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="OverlayIndex",
+        description="Show which doc layer supplies every component.",
+    )
+    parser.add_argument(
+        "--shadowed",
+        help="Also list the docs a higher layer hides.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    index = OverlayIndex(ALL_LAYERS)
+    index.refresh()
+    for component in index.component_names():
+        layer, path = index.resolve(component)
+        print(f"{component}\t{layer}\t{path}")
+    if args.shadowed:
+        for component, layer, path in index.shadowed():
+            print(f"{component}\t{layer} (shadowed)\t{path}")
+
+
+if __name__ == "__main__":
+    main()
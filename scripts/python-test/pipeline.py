@@ -0,0 +1,953 @@
+import config
+import argparse
+import archive_source
+import json
+import os
+import sys
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import check_component_docs
+import emitters
+import extract_defaults
+import git_source
+import isolation
+import manifest
+import mapped_docs
+import metrics
+import move_templates_to_plugin
+import overlay_index
+import profiling
+import reconcile
+import record_store
+import verify_templates
+import write_to_template
+
+logger = metrics.get_logger(__name__)
+
+EXECUTORS = {
+    "isolated": isolation.IsolatedPool,
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
+
+
+def list_filenames(directory):
+    if not os.path.isdir(directory):
+        return set()
+    with os.scandir(directory) as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+
+def resolve_doc_path(filename, index=None):
+    # Same precedence as overlay_index.DOC_LAYERS. The override layer comes from the
+    # index, auto and manual docs are looked at directly since this run writes them
+    if index is not None:
+        override = index.components["override"].get(
+            overlay_index.get_component_name(filename)
+        )
+        if override is not None:
+            return os.path.join(config.DIR_OVERRIDE_DOCS, override)
+    for directory in (config.DIR_AUTO_DOCS, config.DIR_MANUAL_DOCS):
+        doc_path = os.path.join(directory, filename)
+        if os.path.isfile(doc_path):
+            return doc_path
+    return None
+
+
+def get_upstream_key(filename, source=None):
+    # What a doc's upstream input is recorded under, a path or a git tree path
+    if source is None:
+        return os.path.join(config.DIR_DOCS_FROM_REPO, filename)
+    return source.key(filename)
+
+
+def get_doc_key(filename, source=None, index=None):
+    # What a doc's per-file timings are recorded under: its upstream path or key if
+    # upstream has it, otherwise the doc it's extracted from
+    if not metrics.RUN.track_files:
+        return filename
+    if source is not None:
+        if filename in source.blobs:
+            return source.key(filename)
+    else:
+        upstream_path = get_upstream_key(filename)
+        if os.path.isfile(upstream_path):
+            return upstream_path
+    return resolve_doc_path(filename, index) or filename
+
+
+def process_component(
+    filename,
+    source=None,
+    index=None,
+    formats=emitters.DEFAULT_EMITTERS,
+):
+    key = get_doc_key(filename, source, index)
+    with metrics.recording() as recorded:
+        with metrics.timer("file.pipeline", key) as timing:
+            result = run_component(filename, source, index, formats)
+            if source is not None:
+                timing.size = source.size(filename)
+    # Ship what this doc recorded back with the result, a failure among it is
+    # this doc's whichever executor ran it
+    result["metrics"] = recorded.drain()
+    return result
+
+
+def start_worker(track_files=False, profile_directory=None):
+    # Pool initializer, the worker starts out with nothing recorded
+    metrics.start_worker(track_files)
+    profiling.start_worker(profile_directory)
+
+
+def run_component(
+    filename,
+    source=None,
+    index=None,
+    formats=emitters.DEFAULT_EMITTERS,
+):
+    # Runs check -> extract -> build snippet for one component doc
+    # Upstream docs come from the DIR_DOCS_FROM_REPO folder, or from source (a
+    # git_source.GitSource or archive_source.ArchiveSource) when given
+    # index is an overlay_index.OverlayIndex, for the override docs
+    # snippets is the record serialised for every output format in formats
+    # verdict is None if the doc isn't in the upstream folder, otherwise (is_good, reason)
+    # written maps every file created for this doc to the hash of its content
+    result = {
+        "filename": filename,
+        "verdict": None,
+        "record": None,
+        "snippets": None,
+        "written": {},
+    }
+    usage_section = None
+
+    with profiling.stage("check_and_generate_docs"):
+        checked = None
+        if source is not None:
+            checked = check_component_docs.check_doc_source(filename, source)
+        else:
+            upstream_path = os.path.join(config.DIR_DOCS_FROM_REPO, filename)
+            if os.path.isfile(upstream_path):
+                checked = check_component_docs.check_doc_file(upstream_path)
+
+        if checked is not None:
+            is_good, entry = checked
+            auto_doc_path = os.path.join(config.DIR_AUTO_DOCS, filename)
+            if is_good:
+                result["verdict"] = (True, None)
+                # Auto docs follow upstream, same as check_component_docs.plan_docs
+                if reconcile.write_if_changed(auto_doc_path, entry[2]) != "unchanged":
+                    result["written"][auto_doc_path] = manifest.hash_bytes(
+                        entry[2].encode("utf-8")
+                    )
+                # No need to read back what is on disk now
+                usage_section = entry[2]
+            else:
+                result["verdict"] = (False, entry[2])
+                if os.path.isfile(auto_doc_path):
+                    # Stopped passing the check, the manual doc takes over
+                    os.remove(auto_doc_path)
+                    logger.debug("Deleted stale output: %s", auto_doc_path)
+                written = check_component_docs.create_doc_file(
+                    target_directory=config.DIR_MANUAL_DOCS,
+                    filename=filename,
+                    content=check_component_docs.TEMPLATE_DOC_USAGE_SECTION,
+                    overwrite=False,
+                )
+                if written:
+                    manual_doc_path = os.path.join(config.DIR_MANUAL_DOCS, filename)
+                    result["written"][manual_doc_path] = manifest.hash_file(
+                        manual_doc_path
+                    )
+
+    _, file_extension = os.path.splitext(filename)
+    if file_extension not in check_component_docs.ALLOWED_EXTENSIONS:
+        return result
+
+    with profiling.stage("extract_defaults"):
+        doc_path = resolve_doc_path(filename, index)
+        if usage_section is not None and not is_override(doc_path):
+            record = extract_defaults.extract_record_from_content(
+                overlay_index.get_component_name(filename), usage_section
+            )
+        else:
+            record = extract_defaults.extract_record(doc_path) if doc_path else None
+
+    if record is None:
+        return result
+
+    result["record"] = record
+    with profiling.stage("write_to_template"):
+        result["snippets"] = emitters.serialize_record(record, formats)
+    return result
+
+
+def is_override(doc_path):
+    return (
+        doc_path is not None and os.path.dirname(doc_path) == config.DIR_OVERRIDE_DOCS
+    )
+
+
+def map_components(
+    filenames,
+    workers,
+    executor,
+    source=None,
+    index=None,
+    formats=emitters.DEFAULT_EMITTERS,
+    timeout=isolation.DEFAULT_TIMEOUT,
+    memory_limit=isolation.DEFAULT_MEMORY_LIMIT_MB,
+):
+    # The isolated executor hands back no result for docs it gave up on, they're
+    # recorded as metrics failures instead
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor '{executor}'.")
+
+    process = partial(
+        process_component,
+        source=source,
+        index=index,
+        formats=formats,
+    )
+    workers = workers or os.cpu_count() or 1
+    if executor != "isolated" and (workers == 1 or len(filenames) <= 1):
+        return [process(filename) for filename in filenames]
+
+    # Bigger chunks keep the process pool from paying a round trip per doc
+    chunksize = max(1, len(filenames) // (workers * 4))
+    pool_options = {}
+    if executor != "thread":
+        pool_options["initializer"] = partial(
+            start_worker, metrics.RUN.track_files, profiling.PROFILER.directory
+        )
+    if executor == "isolated":
+        pool_options["timeout"] = timeout
+        pool_options["memory_limit"] = memory_limit
+    with EXECUTORS[executor](max_workers=workers, **pool_options) as pool:
+        results = list(pool.map(process, filenames, chunksize=chunksize))
+    for filename, reason, detail in getattr(pool, "failures", ()):
+        metrics.fail(filename, reason, detail)
+    return results
+
+
+def get_json_path(name):
+    return os.path.join(config.DIR_GENERATED_JSONS, f"{name}.json")
+
+
+def remove_stale_templates(template_paths):
+    # Drop template files left over from a different shard layout
+    keep = {os.path.normpath(file_path) for file_path in template_paths}
+    for filename in os.listdir(config.DIR_GENERATED_LIVE_TEMPLATES):
+        file_path = os.path.join(config.DIR_GENERATED_LIVE_TEMPLATES, filename)
+        if filename.endswith(".xml") and os.path.normpath(file_path) not in keep:
+            os.remove(file_path)
+            logger.debug("Deleted stale template: %s", file_path)
+
+
+def write_failure_report(failures, report_path=config.FAILURE_REPORT_FILE):
+    # Only kept around while there is something in it
+    if not failures:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        return
+    tmp_path = f"{report_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"failures": failures}, file, indent=2)
+        metrics.count_written(file)
+    os.replace(tmp_path, report_path)
+    logger.warning(
+        "Quarantined %d docs, see %s", len({f["file"] for f in failures}), report_path
+    )
+
+
+def plan_rebuild(docs, sources, incremental, source=None, refreshed=None):
+    # Splits every known doc into the ones that need processing and the ones
+    # that disappeared, cleaning up outputs of removed upstream docs on the way
+    # Inputs that were touched without changing go into refreshed, see
+    # manifest.inputs_unchanged
+    dirty = []
+    removed = []
+    for filename in sorted(set(sources) | set(docs)):
+        entry = docs.get(filename)
+        signatures = sources.get(filename, {})
+
+        if entry is not None:
+            upstream_key = get_upstream_key(filename, source)
+            if upstream_key in entry["inputs"] and upstream_key not in signatures:
+                # Upstream dropped the doc, so drop what was generated from it
+                for file_path in manifest.remove_unmodified_outputs(
+                    entry, list(entry["outputs"])
+                ):
+                    signatures.pop(file_path, None)
+
+            if not signatures:
+                manifest.remove_unmodified_outputs(entry, list(entry["outputs"]))
+                removed.append(filename)
+                continue
+
+            if (
+                incremental
+                and manifest.inputs_unchanged(entry, signatures, refreshed)
+                and manifest.outputs_present(entry)
+            ):
+                continue
+
+        dirty.append(filename)
+
+    return dirty, removed
+
+
+def describe_result(result, previous_entry, source=None, index=None):
+    filename = result["filename"]
+
+    outputs = {}
+    if previous_entry is not None:
+        # Files generated on an earlier run are still ours as long as they exist
+        outputs = {
+            file_path: digest
+            for file_path, digest in previous_entry["outputs"].items()
+            if os.path.isfile(file_path)
+        }
+        if result["record"] is None:
+            for file_path in list(outputs):
+                if os.path.dirname(file_path) == config.DIR_GENERATED_JSONS:
+                    os.remove(file_path)
+                    logger.debug("Deleted stale output: %s", file_path)
+                    del outputs[file_path]
+    outputs.update(result["written"])
+
+    inputs = {}
+    source_dirs = manifest.SOURCE_DIRS
+    if source is not None:
+        source_dirs = get_local_source_dirs()
+        if filename in source.blobs:
+            inputs[source.key(filename)] = {"blob": source.blobs[filename]}
+    for directory in source_dirs:
+        file_path = os.path.join(directory, filename)
+        if os.path.isfile(file_path):
+            inputs[file_path] = manifest.describe_file(file_path)
+    override_path = resolve_doc_path(filename, index)
+    if is_override(override_path):
+        inputs[override_path] = manifest.describe_file(override_path)
+
+    return {
+        "inputs": inputs,
+        "outputs": outputs,
+        "verdict": result["verdict"],
+        "record": result["record"],
+    }
+
+
+def get_record_filenames(docs):
+    """
+    The manifest docs whose records go into the outputs, in the canonical template
+    order: by name. A component with several docs, e.g. button.md next to
+    button.mdx, gets the one overlay_index.doc_precedence puts first. The others
+    keep their records in the manifest, one of them takes over if it goes away.
+    Only the filenames get sorted, the records are looked up as they're written.
+    """
+    winners = {}
+    for filename, entry in docs.items():
+        if entry["record"] is None:
+            continue
+        name = entry["record"]["name"]
+        current = winners.get(name)
+        if current is None or get_doc_precedence(filename, entry) < get_doc_precedence(
+            current, docs[current]
+        ):
+            winners[name] = filename
+    return [winners[name] for name in sorted(winners)]
+
+
+def get_doc_precedence(filename, entry):
+    verdict = entry["verdict"]
+    return overlay_index.doc_precedence(filename, verdict is not None and verdict[0])
+
+
+def write_record_jsons(docs, record_filenames, processed):
+    # The JSON of a component is written from the doc that supplies it, by this
+    # process alone so docs of the same component never race for the file. That
+    # doc owns it in the manifest, processed are the docs extracted just now.
+    # Returns whether the manifest changed
+    changed = False
+    winners = set(record_filenames)
+    for filename in record_filenames:
+        entry = docs[filename]
+        json_path = get_json_path(entry["record"]["name"])
+        if filename in processed or json_path not in entry["outputs"]:
+            extract_defaults.write_record_json(entry["record"])
+            entry["outputs"][json_path] = manifest.hash_file(json_path)
+            changed = True
+    for filename, entry in docs.items():
+        if filename not in winners and entry["record"] is not None:
+            json_path = get_json_path(entry["record"]["name"])
+            changed |= entry["outputs"].pop(json_path, None) is not None
+    return changed
+
+
+@metrics.timed("stage.pipeline.reduce")
+def write_templates(
+    docs,
+    snippets,
+    shards=1,
+    group_per_shard=False,
+    formats=emitters.DEFAULT_EMITTERS,
+):
+    # Single ordered reduce into every output format, each record is written out
+    # as soon as it's reached, returns the written files
+    with emitters.EmitterSet(formats, shards, group_per_shard) as emitter_set:
+        for filename in get_record_filenames(docs):
+            emitter_set.write(docs[filename]["record"], snippets.get(filename))
+    return emitter_set.file_paths
+
+
+def get_upstream_filenames(source=None):
+    if source is None:
+        return list_filenames(config.DIR_DOCS_FROM_REPO)
+    return set(source.blobs)
+
+
+def get_local_source_dirs():
+    # The doc folders that stay on disk when upstream is read from git
+    return tuple(
+        directory
+        for directory in manifest.SOURCE_DIRS
+        if directory != config.DIR_DOCS_FROM_REPO
+    )
+
+
+def scan_all_sources(source=None, index=None):
+    if source is None:
+        sources = manifest.scan_sources()
+    else:
+        sources = manifest.scan_sources(get_local_source_dirs())
+        for filename, signatures in source.scan().items():
+            sources.setdefault(filename, {}).update(signatures)
+    if index is not None:
+        attach_override_sources(sources, index)
+    return sources
+
+
+def attach_override_sources(sources, index):
+    # Override docs are matched by component name, so button.md overrides the
+    # upstream button.mdx. They count as an input of every doc they override,
+    # and are a doc of their own when nothing else has the component
+    filenames_by_component = {}
+    for filename in sources:
+        filenames_by_component.setdefault(
+            overlay_index.get_component_name(filename), []
+        ).append(filename)
+
+    for component, filename in index.components["override"].items():
+        file_path = os.path.join(config.DIR_OVERRIDE_DOCS, filename)
+        try:
+            signature = manifest.stat_signature(file_path)
+        except FileNotFoundError:
+            continue
+        for target in filenames_by_component.get(component, [filename]):
+            sources.setdefault(target, {})[file_path] = signature
+
+
+def get_upstream_changes(previous_upstream, source):
+    """
+    The docs that changed upstream since the commit the last build was made from.
+
+    :return: List of git_source.DocChange, or None if there's nothing to diff against
+        and every doc has to be looked at.
+    """
+    if previous_upstream is None or previous_upstream["docs_path"] != source.docs_path:
+        return None
+    if previous_upstream["commit"] == source.commit:
+        return []
+    try:
+        changes = source.changes_since(previous_upstream["commit"])
+    except git_source.GitError as e:
+        # e.g. a shallow clone that no longer has the old commit
+        logger.info("%s Looking at every doc instead.", e)
+        return None
+    if changes is None:
+        # An archive, it has no history
+        return None
+
+    logger.info(
+        "%d docs changed upstream since %s",
+        len(changes),
+        previous_upstream["commit"][:12],
+    )
+    for change in changes:
+        logger.debug("%s", change)
+    return changes
+
+
+def plan_outputs(write_jsons=False, source=None, filenames=None):
+    # What the docs and JSON folders would need to match the upstream docs,
+    # the JSONs are planned against the docs as they'd be after their plans
+    # filenames limits the plans to those docs
+    _, _, plans = check_component_docs.plan_docs(source=source, filenames=filenames)
+    if write_jsons:
+        plans.append(extract_defaults.plan_jsons(plans, filenames))
+    return plans
+
+
+def run_pipeline(
+    workers=None,
+    executor="isolated",
+    copy_to_plugin=True,
+    incremental=False,
+    manifest_path=config.MANIFEST_FILE,
+    write_jsons=False,
+    jsonl_path=None,
+    shards=1,
+    group_per_shard=False,
+    link_mode="auto",
+    source=None,
+    formats=emitters.DEFAULT_EMITTERS,
+    timeout=isolation.DEFAULT_TIMEOUT,
+    memory_limit=isolation.DEFAULT_MEMORY_LIMIT_MB,
+    verify=False,
+):
+    # Runs all four stages in one go, returns a summary of the run
+    # With incremental set, only docs whose content changed since the last run are processed
+    # Records go straight from extraction to the templates, write_jsons keeps the old
+    # per-component JSON files and jsonl_path dumps all records into one file for debugging
+    # shards splits each template set over that many files by component name prefix
+    # link_mode picks how templates land in the plugin, see move_templates_to_plugin.sync_files
+    # source reads the upstream docs from a git_source.GitSource or an
+    # archive_source.ArchiveSource instead of DIR_DOCS_FROM_REPO
+    # formats are the output formats written from the records, see emitters.EMITTERS
+    # timeout (seconds) and memory_limit (MB) are the budgets of the isolated executor,
+    # docs that fail are quarantined: they keep what their last good build made and
+    # are retried on the next run, see config.FAILURE_REPORT_FILE
+    # verify checks the live templates against the records before they're copied to
+    # the plugin, templates with problems aren't copied, see verify_templates
+    emitters.check_emitter_names(formats)
+    options = {
+        "write_jsons": write_jsons,
+        "shards": shards,
+        "group_per_shard": group_per_shard,
+        "formats": list(formats),
+    }
+    build_manifest = manifest.empty_manifest(options)
+    if incremental:
+        build_manifest = manifest.load_manifest(manifest_path, options)
+    docs = build_manifest["docs"]
+
+    upstream_changes = None
+    previous_upstream = build_manifest.get("upstream")
+    if source is not None:
+        # Blob ids already keep unchanged docs from being read, the diff against
+        # the last built commit is what gets reported
+        upstream_changes = get_upstream_changes(previous_upstream, source)
+        build_manifest["upstream"] = {
+            "commit": source.commit,
+            "docs_path": source.docs_path,
+        }
+    # Whatever else the manifest gets out of this run, see unchanged below
+    manifest_changed = build_manifest.get("upstream") != previous_upstream
+    refreshed = []
+
+    with metrics.timer("stage.pipeline.plan"), profiling.stage("plan"):
+        # Only the override layer is taken from the index, see resolve_doc_path
+        # Auto docs follow upstream, same as check_component_docs.plan_docs
+        check_component_docs.plan_stale_auto_docs(
+            get_upstream_filenames(source)
+        ).apply()
+        index = overlay_index.load_index()
+        dirty, removed = plan_rebuild(
+            docs, scan_all_sources(source, index), incremental, source, refreshed
+        )
+    for filename in removed:
+        del docs[filename]
+    metrics.count("pipeline.docs_processed", len(dirty))
+    metrics.count("pipeline.docs_removed", len(removed))
+
+    failures_before = len(metrics.RUN.failures)
+    snippets = {}
+    quarantined = set()
+    finished = set()
+    for result in map_components(
+        dirty,
+        workers,
+        executor,
+        source,
+        index,
+        formats,
+        timeout,
+        memory_limit,
+    ):
+        snapshot = result.pop("metrics")
+        metrics.RUN.merge(snapshot)
+        filename = result["filename"]
+        finished.add(filename)
+        if snapshot["failures"]:
+            # The doc got swallowed by an error half way, it keeps its entry from
+            # the last build (if any) so it's retried on the next run
+            quarantined.add(filename)
+            continue
+        docs[filename] = describe_result(result, docs.get(filename), source, index)
+        if result["snippets"] is not None:
+            snippets[filename] = result["snippets"]
+    # The isolated executor hands back nothing for a doc it gave up on
+    quarantined.update(set(dirty).difference(finished))
+    failures = metrics.RUN.failures[failures_before:]
+
+    # Files the formats always write, plus whatever else the last run wrote,
+    # e.g. a Sublime snippet per record
+    template_paths = emitters.get_file_paths(formats, shards)
+    unchanged = (
+        incremental
+        and not dirty
+        and not removed
+        and manifest.templates_unchanged(
+            build_manifest, [*template_paths, *build_manifest["templates"]]
+        )
+    )
+
+    record_filenames = get_record_filenames(docs)
+    ignored = sorted(
+        filename
+        for filename in set(docs).difference(record_filenames)
+        if docs[filename]["record"] is not None
+    )
+    if ignored:
+        logger.warning(
+            "More than one doc for the same component, ignoring %s", ", ".join(ignored)
+        )
+    records = [docs[filename]["record"] for filename in record_filenames]
+    if not unchanged or not os.path.isfile(config.RECORD_STORE_FILE):
+        # Same records as last time otherwise, no need to diff them
+        with record_store.RecordStore() as store:
+            store.plan(records).apply()
+    if jsonl_path is not None:
+        extract_defaults.write_records_jsonl(records, jsonl_path)
+    if write_jsons:
+        manifest_changed |= write_record_jsons(docs, record_filenames, dirty)
+        # Only JSONs that changed got rewritten, this drops the ones without
+        # a record any more, nothing is read
+        reconcile.plan_directory(
+            config.DIR_GENERATED_JSONS,
+            {f"{record['name']}.json": None for record in records},
+            update=False,
+        ).apply()
+
+    if unchanged:
+        logger.info("Nothing changed since the last run.")
+    else:
+        with profiling.stage("write_to_template"):
+            written = write_templates(docs, snippets, shards, group_per_shard, formats)
+        if "intellij" in formats:
+            remove_stale_templates(written)
+        build_manifest["templates"] = {
+            file_path: manifest.describe_file(file_path) for file_path in written
+        }
+
+    verified = None
+    if verify and "intellij" in formats:
+        verified = verify_templates.verify_templates(shards=shards)
+        verify_templates.log_result(verified)
+        if not verified.ok and copy_to_plugin:
+            logger.error("Not copying templates that failed verification.")
+
+    # Identical templates are skipped, so this only costs a few hashes when nothing
+    # changed, and catches up on a plugin folder an earlier --no-copy run left behind
+    if copy_to_plugin and "intellij" in formats and (verified is None or verified.ok):
+        with profiling.stage("move_templates_to_plugin"):
+            move_templates_to_plugin.move_templates_to_plugin(link_mode)
+
+    # A no-op run leaves the manifest and the index as they were, rewriting them
+    # is most of what such a run would cost. The index is saved with the docs
+    # this run wrote, so the next run doesn't rescan their folders
+    if not unchanged or manifest_changed or refreshed:
+        manifest.save_manifest(build_manifest, manifest_path)
+    index.refresh()
+    overlay_index.save_index(index)
+    write_failure_report(failures)
+
+    summary = {
+        "good": [],
+        "bad": [],
+        "snippets": [],
+        "processed": dirty,
+        "removed": removed,
+        "quarantined": sorted(quarantined),
+    }
+    if verified is not None:
+        summary["verify_problems"] = verified.problem_count
+    if upstream_changes is not None:
+        summary["upstream_changes"] = [repr(change) for change in upstream_changes]
+    for filename in sorted(docs):
+        entry = docs[filename]
+        if entry["verdict"] is not None:
+            is_good, reason = entry["verdict"]
+            if is_good:
+                summary["good"].append(filename)
+            else:
+                summary["bad"].append((filename, reason))
+    summary["snippets"] = [record["name"] for record in records]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Pipeline",
+        description="Check, extract, template and copy all shadcn/ui component docs in one run.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of workers. Defaults to the number of cores.",
+    )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        choices=sorted(EXECUTORS),
+        default="isolated",
+        help="Run the per-component work on a process pool or a thread pool. "
+        "isolated is a process pool where every doc gets a time and memory budget.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=isolation.DEFAULT_TIMEOUT,
+        help="Seconds a doc gets with the isolated executor before it's quarantined.",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        metavar="MB",
+        type=int,
+        default=isolation.DEFAULT_MEMORY_LIMIT_MB,
+        help="Memory each isolated worker gets on top of its own, 0 for no limit.",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        help="Only process docs that changed since the last run, using the build manifest.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--write-jsons",
+        help=f"Also write a JSON file per component into {config.DIR_GENERATED_JSONS}.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jsonl",
+        metavar="PATH",
+        help="Write every extracted record into a single JSONL file, for debugging.",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split each template set over this many files by component name prefix.",
+    )
+    parser.add_argument(
+        "--group-per-shard",
+        help="Give every shard its own template group instead of sharing one.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--format",
+        action="append",
+        choices=sorted(emitters.EMITTERS),
+        help="Output format to write, repeat it for several. All of them are written "
+        f"from the same pass over the docs. Defaults to {', '.join(emitters.DEFAULT_EMITTERS)}.",
+    )
+    parser.add_argument(
+        "--verify",
+        help="Check the live templates against the records after writing them, and "
+        "fail without copying them into the plugin if anything is off.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-copy",
+        help="Don't copy the generated templates into the plugin resource folder.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--link-mode",
+        choices=move_templates_to_plugin.LINK_MODES,
+        default="auto",
+        help="How changed templates get into the plugin: reflink, hardlink or copy. "
+        "auto picks the first one the filesystem supports.",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="Write counters, rejection reasons and stage timings of the run as JSON.",
+    )
+    parser.add_argument(
+        "--track-files",
+        help="Also put the time spent on every single file into the report.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile every stage, writing <stage>.prof for pstats and snakeviz and "
+        "<stage>.collapsed for flamegraph tools into DIR.",
+    )
+    parser.add_argument(
+        "--slowest",
+        metavar="N",
+        type=int,
+        help="Log the N slowest docs of every stage with their sizes, they also go "
+        "into the report and the profile folder.",
+    )
+    parser.add_argument(
+        "--git-repo",
+        metavar="PATH",
+        help="Read the upstream docs straight from this shadcn/ui git repository "
+        f"instead of {config.DIR_DOCS_FROM_REPO}, nothing gets checked out.",
+    )
+    parser.add_argument(
+        "--ref",
+        default="HEAD",
+        help="Branch, tag or commit to read the docs at, with --git-repo.",
+    )
+    parser.add_argument(
+        "--git-docs-path",
+        default=config.GIT_DOCS_PATH,
+        help="Folder of the component docs inside the git repository.",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Read the upstream docs straight out of this .tar, .tar.gz or .zip "
+        f"snapshot instead of {config.DIR_DOCS_FROM_REPO}, nothing gets extracted.",
+    )
+    parser.add_argument(
+        "--archive-pattern",
+        default=archive_source.DEFAULT_PATTERN,
+        help="Glob the docs' paths inside the archive have to match, matched from "
+        "the right so a leading release folder doesn't matter.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="Print the files the docs and JSON folders would get created, updated "
+        "and deleted, and exit without touching anything.",
+        action="store_true",
+    )
+    metrics.add_verbosity_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_logging(metrics.get_verbosity(args))
+    metrics.track_files(args.track_files or bool(args.slowest))
+    if args.profile:
+        profiling.enable(args.profile)
+
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers needs to be at least 1.")
+
+    if args.slowest is not None and args.slowest < 1:
+        parser.error("--slowest needs to be at least 1.")
+
+    if args.timeout <= 0 or args.memory_limit < 0:
+        parser.error(
+            "--timeout needs to be positive and --memory-limit can't be negative."
+        )
+
+    if args.shards < 1 or args.shards > len(write_to_template.SHARD_ALPHABET):
+        parser.error(
+            f"--shards needs to be between 1 and {len(write_to_template.SHARD_ALPHABET)}."
+        )
+
+    if args.git_repo and args.archive:
+        parser.error("--git-repo and --archive can't be used together.")
+
+    try:
+        source = open_source(args)
+    except (git_source.GitError, archive_source.ArchiveError) as e:
+        parser.error(str(e))
+
+    try:
+        run(args, source)
+    finally:
+        if source is not None:
+            source.close()
+
+
+def open_source(args):
+    # The upstream source the --git-repo or --archive arguments ask for, None for
+    # DIR_DOCS_FROM_REPO
+    if args.git_repo:
+        source = git_source.GitSource(args.git_repo, args.ref, args.git_docs_path)
+        logger.info("Reading docs from %s at %s", args.git_repo, source.commit)
+        return source
+    if args.archive:
+        source = archive_source.ArchiveSource(args.archive, args.archive_pattern)
+        logger.info("Reading %d docs from %s", len(source.blobs), args.archive)
+        return source
+    return None
+
+
+def run(args, source=None):
+    if args.dry_run:
+        filenames = None
+        if source is not None and args.incremental:
+            # Only what the upstream changes since the last build would do
+            changes = get_upstream_changes(manifest.read_manifest_upstream(), source)
+            if changes is not None:
+                filenames = git_source.changed_filenames(changes)
+        with mapped_docs.FILES.build():
+            for plan in plan_outputs(args.write_jsons, source, filenames):
+                for line in plan.describe():
+                    print(line)
+                print(plan.summary())
+        return
+
+    summary = run_pipeline(
+        workers=args.workers,
+        executor=args.executor,
+        copy_to_plugin=not args.no_copy,
+        incremental=args.incremental,
+        write_jsons=args.write_jsons,
+        jsonl_path=args.jsonl,
+        shards=args.shards,
+        group_per_shard=args.group_per_shard,
+        link_mode=args.link_mode,
+        source=source,
+        formats=args.format or emitters.DEFAULT_EMITTERS,
+        timeout=args.timeout,
+        memory_limit=args.memory_limit,
+        verify=args.verify,
+    )
+
+    logger.info("GOOD FILES %d", len(summary["good"]))
+    logger.info("BAD FILES %d", len(summary["bad"]))
+    for filename, reason in summary["bad"]:
+        logger.debug("%s: %s", filename, reason)
+    logger.info("SNIPPETS %d", len(summary["snippets"]))
+    logger.info(
+        "PROCESSED %d, REMOVED %d", len(summary["processed"]), len(summary["removed"])
+    )
+
+    extra = {"summary": summary}
+    if args.slowest:
+        extra["slowest"] = metrics.slowest_files(args.slowest)
+        for timer, entries in extra["slowest"].items():
+            for entry in entries:
+                logger.info(
+                    "SLOW %s %s: %.1f ms, %s bytes",
+                    timer,
+                    entry["file"],
+                    entry["seconds"] * 1000,
+                    entry["bytes"],
+                )
+
+    if args.profile:
+        profiling.write_profiles()
+        if args.slowest:
+            profiling.write_slowest(args.profile, extra["slowest"])
+
+    if args.report:
+        metrics.write_report(args.report, extra)
+
+    if summary.get("verify_problems"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import cProfile
+import json
+import marshal
+import multiprocessing.util
+import os
+import pstats
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+import metrics
+
+logger = metrics.get_logger(__name__)
+
+# Paths in the collapsed stacks stop at this many frames, recursion past it is
+# folded into its deepest frame
+MAX_STACK_DEPTH = 64
+
+# Call paths with less time than this (seconds) are left out of the collapsed stacks
+MIN_STACK_SECONDS = 1e-6
+
+# Where pool workers leave their profiles for write_profiles, inside the profile folder
+DIR_WORKER_PROFILES = "workers"
+
+# From 3.12 cProfile sits on sys.monitoring, which has room for one profiler per
+# process: enabling a second one raises ValueError, and the one that's on sees
+# every thread, not only the one that enabled it
+ONE_PROFILER_PER_PROCESS = sys.version_info >= (3, 12)
+
+
+def merge_stats(target, stats):
+    # Adds one pstats stats dict into another, same as pstats.Stats.add
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if func in target:
+            old_cc, old_nc, old_tt, old_ct, old_callers = target[func]
+            target[func] = (
+                old_cc + cc,
+                old_nc + nc,
+                old_tt + tt,
+                old_ct + ct,
+                pstats.add_callers(old_callers, callers),
+            )
+        else:
+            target[func] = (cc, nc, tt, ct, dict(callers))
+    return target
+
+
+class StageProfiler:
+    """
+    A cProfile profile per pipeline stage, kept per thread since a profile only
+    sees the thread that enabled it. Stages don't nest, a stage entered while
+    another one is running on the same thread counts towards the outer one.
+    Where only one profiler can be on (see ONE_PROFILER_PER_PROCESS), a stage
+    entered while another thread's stage is profiled runs unprofiled, its time
+    shows up in that other stage. The same goes when some other tool, e.g. a
+    coverage run, already holds the profiler.
+    Profiling is on while directory is set.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.directory = None
+        self.reset()
+
+    def reset(self):
+        self.profiles = {}
+        self.active = set()
+        self.stats = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.directory is None or getattr(self.local, "active", False):
+            yield
+            return
+        key = (name, threading.get_ident())
+        with self.lock:
+            if ONE_PROFILER_PER_PROCESS and self.active:
+                key = None
+            else:
+                profile = self.profiles.get(key)
+                if profile is None:
+                    profile = self.profiles[key] = cProfile.Profile()
+                self.active.add(key)
+        if key is not None:
+            try:
+                profile.enable()
+            except ValueError as e:
+                logger.debug("Not profiling %s: %s", name, e)
+                with self.lock:
+                    self.active.discard(key)
+                key = None
+        if key is None:
+            metrics.count("profile.stages_skipped")
+            yield
+            return
+        self.local.active = True
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.local.active = False
+            with self.lock:
+                self.active.discard(key)
+
+    def drain(self):
+        # Everything profiled so far as {stage: stats}, stages still running on
+        # other threads are left for the next drain
+        with self.lock:
+            snapshot = self.stats
+            self.stats = {}
+            for key, profile in list(self.profiles.items()):
+                if key in self.active:
+                    continue
+                profile.create_stats()
+                merge_stats(snapshot.setdefault(key[0], {}), profile.stats)
+                del self.profiles[key]
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, stats in snapshot.items():
+                merge_stats(self.stats.setdefault(name, {}), stats)
+
+
+# One per process, like metrics.RUN
+PROFILER = StageProfiler()
+
+
+def enable(directory):
+    # Profiles the stages of this run, write_profiles puts them into directory
+    shutil.rmtree(os.path.join(directory, DIR_WORKER_PROFILES), ignore_errors=True)
+    PROFILER.reset()
+    PROFILER.directory = directory
+
+
+def start_worker(directory=None):
+    # Pool initializer. Shipping the profiles back with every result costs more
+    # than profiling itself, so a worker leaves them behind once, when it exits.
+    # A worker killed over its time budget takes its profiles with it
+    PROFILER.reset()
+    PROFILER.directory = directory
+    if directory is not None:
+        multiprocessing.util.Finalize(None, write_worker_profiles, exitpriority=10)
+
+
+def write_worker_profiles():
+    directory = os.path.join(PROFILER.directory, DIR_WORKER_PROFILES)
+    os.makedirs(directory, exist_ok=True)
+    for name, stats in PROFILER.drain().items():
+        with open(os.path.join(directory, f"{name}.{os.getpid()}.prof"), "wb") as file:
+            marshal.dump(stats, file)
+
+
+def stage(name):
+    return PROFILER.stage(name)
+
+
+def profiled(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def describe_function(func):
+    # Same label pstats prints, without the ; that separates collapsed frames
+    return pstats.func_std_string(func).replace(";", ",")
+
+
+def collapse_stats(stats):
+    """
+    Turns a pstats stats dict into collapsed stacks, "frame;frame;frame microseconds"
+    lines as flamegraph.pl, speedscope and inferno read them.
+
+    cProfile only keeps caller -> callee edges, not whole stacks, so the time of a
+    function called from several places is split over its callers by how much of
+    its cumulative time each of them accounts for.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, {})[func] = caller_stats
+
+    lines = {}
+
+    def walk(func, stack, seconds):
+        total = stats[func][3]
+        share = seconds / total if total else 0.0
+        self_seconds = stats[func][2] * share
+        if self_seconds >= MIN_STACK_SECONDS:
+            path = ";".join(describe_function(frame) for frame in stack)
+            lines[path] = lines.get(path, 0.0) + self_seconds
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, (_, _, _, callee_seconds) in callees.get(func, {}).items():
+            callee_seconds *= share
+            if callee in stack or callee_seconds < MIN_STACK_SECONDS:
+                continue
+            walk(callee, stack + [callee], callee_seconds)
+
+    roots = [func for func, entry in stats.items() if not entry[4]]
+    for func in sorted(roots, key=describe_function):
+        walk(func, [func], stats[func][3])
+
+    return [
+        f"{path} {round(seconds * 1_000_000)}"
+        for path, seconds in sorted(lines.items())
+        if round(seconds * 1_000_000) > 0
+    ]
+
+
+def write_profiles():
+    """
+    Writes <stage>.prof (pstats / snakeviz) and <stage>.collapsed (flamegraph tools)
+    for every profiled stage into the profile folder, with what the pool workers
+    left behind merged in. Returns the written paths.
+    """
+    directory = PROFILER.directory
+    os.makedirs(directory, exist_ok=True)
+    PROFILER.merge(PROFILER.drain())
+    worker_directory = os.path.join(directory, DIR_WORKER_PROFILES)
+    if os.path.isdir(worker_directory):
+        for filename in sorted(os.listdir(worker_directory)):
+            with open(os.path.join(worker_directory, filename), "rb") as file:
+                PROFILER.merge({filename.split(".")[0]: marshal.load(file)})
+        shutil.rmtree(worker_directory)
+
+    written = []
+    for name, stats in sorted(PROFILER.stats.items()):
+        prof_path = os.path.join(directory, f"{name}.prof")
+        with open(prof_path, "wb") as file:
+            marshal.dump(stats, file)
+            metrics.count_written(file)
+        collapsed_path = os.path.join(directory, f"{name}.collapsed")
+        with open(collapsed_path, "w", encoding="utf-8") as file:
+            for line in collapse_stats(stats):
+                file.write(line + "\n")
+            metrics.count_written(file)
+        written.extend((prof_path, collapsed_path))
+        logger.info("Profile of %s: %s, %s", name, prof_path, collapsed_path)
+    return written
+
+
+def write_slowest(directory, slowest):
+    # metrics.slowest_files next to the profiles, as slowest.json
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "slowest.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(slowest, file, indent=2)
+        metrics.count_written(file)
+    return path
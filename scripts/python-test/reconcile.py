@@ -0,0 +1,265 @@
+import mapped_docs
+import metrics
+import os
+
+logger = metrics.get_logger(__name__)
+
+
+def read_bytes(file_path):
+    try:
+        with open(file_path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_file_atomically(file_path, content):
+    # The old file stays in place until the new one is complete
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+        metrics.count_written(file)
+    os.replace(tmp_path, file_path)
+
+
+def write_if_changed(file_path, content):
+    """
+    Writes content (str or mapped_docs.TextSpan) to file_path unless the file
+    already holds exactly that.
+
+    :return: "created", "updated" or "unchanged".
+    """
+    data = mapped_docs.as_text(content).encode("utf-8")
+    current = read_bytes(file_path)
+    if current == data:
+        return "unchanged"
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    write_file_atomically(file_path, data)
+    return "created" if current is None else "updated"
+
+
+class ChangedFileWriter:
+    """
+    Writes a file that usually comes out the same as last time. The bytes are
+    compared with what file_path holds as they come in, and a temp file is only
+    started at the first difference (with the matching part copied over), so an
+    unchanged file is never written at all and keeps its mtime.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.tmp_path = f"{file_path}.tmp"
+        self.matched = 0
+        self.status = None
+        self.file = None
+        try:
+            self.current = open(file_path, "rb")
+        except FileNotFoundError:
+            self.current = None
+            self.start()
+
+    @property
+    def closed(self):
+        return self.status is not None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.file_path) or ".", exist_ok=True)
+        self.file = open(self.tmp_path, "wb")
+        if self.current is not None:
+            self.current.seek(0)
+            remaining = self.matched
+            while remaining:
+                chunk = self.current.read(min(remaining, 1 << 16))
+                self.file.write(chunk)
+                remaining -= len(chunk)
+
+    def write(self, data):
+        if self.file is None:
+            if self.current.read(len(data)) == data:
+                self.matched += len(data)
+                return
+            self.start()
+        self.file.write(data)
+
+    def close(self):
+        # Returns "created", "updated" or "unchanged"
+        if self.closed:
+            return self.status
+        if self.file is None and self.current.read(1) != b"":
+            # The new content is a prefix of the old one
+            self.start()
+        if self.current is not None:
+            self.current.close()
+        if self.file is None:
+            self.status = "unchanged"
+            metrics.count("io.writes_skipped")
+            return self.status
+
+        metrics.count_written(self.file)
+        self.file.close()
+        os.replace(self.tmp_path, self.file_path)
+        self.status = "created" if self.current is None else "updated"
+        return self.status
+
+    def abort(self):
+        # Leaves whatever was at file_path alone
+        if self.closed:
+            return
+        self.status = "aborted"
+        if self.current is not None:
+            self.current.close()
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Plan:
+    """
+    The creates, updates and deletes that bring one output folder to its desired state.
+    Nothing is touched until apply is called, so a plan doubles as a dry run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.creates = {}
+        self.updates = {}
+        self.deletes = []
+        self.unchanged = []
+        # Files whose content was a span of a doc that changed before it was
+        # written, they keep what they held, see apply
+        self.quarantined = []
+
+    def is_empty(self):
+        return not (self.creates or self.updates or self.deletes)
+
+    def file_names(self):
+        # The files the folder holds once the plan is applied
+        return sorted([*self.creates, *self.updates, *self.unchanged])
+
+    def read(self, filename):
+        # A file's content once the plan is applied, without applying it
+        if filename in self.creates:
+            return mapped_docs.as_text(self.creates[filename])
+        if filename in self.updates:
+            return mapped_docs.as_text(self.updates[filename])
+        with open(
+            os.path.join(self.directory, filename), "r", encoding="utf-8"
+        ) as file:
+            return file.read()
+
+    def describe(self):
+        lines = []
+        for sign, filenames in (
+            ("+", self.creates),
+            ("~", self.updates),
+            ("-", self.deletes),
+        ):
+            for filename in sorted(filenames):
+                lines.append(f"{sign} {os.path.join(self.directory, filename)}")
+        return lines
+
+    def summary(self):
+        return (
+            f"{self.directory}: {len(self.creates)} to create, {len(self.updates)} "
+            f"to update, {len(self.deletes)} to delete, {len(self.unchanged)} unchanged"
+        )
+
+    def apply(self):
+        if self.is_empty():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for filenames in (self.creates, self.updates):
+            for filename, content in sorted(filenames.items()):
+                try:
+                    text = mapped_docs.as_text(content)
+                except mapped_docs.StaleSpanError as e:
+                    # Same as a doc that fails in the pipeline, the next run
+                    # checks it again
+                    logger.error("Not writing %s: %s", filename, e)
+                    metrics.fail(e.path or filename, "changed", str(e))
+                    self.quarantined.append(filename)
+                    continue
+                write_file_atomically(
+                    os.path.join(self.directory, filename), text.encode("utf-8")
+                )
+        for filename in self.deletes:
+            os.remove(os.path.join(self.directory, filename))
+
+        created = len(self.creates.keys() - set(self.quarantined))
+        updated = len(self.updates.keys() - set(self.quarantined))
+        metrics.count("reconcile.created", created)
+        metrics.count("reconcile.updated", updated)
+        metrics.count("reconcile.deleted", len(self.deletes))
+        logger.info(
+            "%s: %d created, %d updated, %d deleted",
+            self.directory,
+            created,
+            updated,
+            len(self.deletes),
+        )
+
+
+def content_matches(file_path, content):
+    try:
+        data = mapped_docs.as_text(content).encode("utf-8")
+    except mapped_docs.StaleSpanError:
+        # Can't tell, it's planned as an update and apply leaves it be
+        return False
+    return read_bytes(file_path) == data
+
+
+def plan_directory(directory, desired, update=True, delete=True, scope=None):
+    """
+    Diffs the files a folder should hold against what it holds right now.
+
+    :param directory: The output folder.
+    :param desired: Dict from filename to content (str, or a mapped_docs.TextSpan that's
+        only read while comparing and writing). None as content means the file
+        should be there but whatever it holds is fine, so it's never read.
+    :param update: Rewrite existing files whose content differs, off for folders
+        that get edited by hand after they're created.
+    :param delete: Remove files that aren't in desired.
+    :param scope: Filenames the plan is limited to, when only a few outputs are being
+        brought up to date. Files outside of it are never touched.
+    """
+    plan = Plan(directory)
+    existing = set()
+    if os.path.isdir(directory):
+        existing = {
+            entry.name
+            for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        }
+    if scope is not None:
+        existing &= set(scope)
+
+    for filename, content in desired.items():
+        if filename not in existing:
+            if content is not None:
+                plan.creates[filename] = content
+            continue
+        if (
+            update
+            and content is not None
+            and not content_matches(os.path.join(directory, filename), content)
+        ):
+            plan.updates[filename] = content
+        else:
+            plan.unchanged.append(filename)
+
+    if delete:
+        plan.deletes = sorted(existing - set(desired))
+    else:
+        plan.unchanged.extend(existing - set(desired))
+
+    plan.unchanged.sort()
+    return plan
@@ -0,0 +1,266 @@
+import config
+import argparse
+import json
+import metrics
+import os
+import reconcile
+import sqlite3
+
+logger = metrics.get_logger(__name__)
+
+# Bump this when the table layout changes, an older store is dropped and rebuilt
+STORE_VERSION = 1
+
+RECORD_FIELDS = ("name", "import", "usage")
+
+
+class RecordError(ValueError):
+    pass
+
+
+def validate_name(name):
+    """
+    Checks a component name, the name ends up as a file name when the records are
+    exported and the daemon looks docs up by it. Raises RecordError.
+    """
+    if not isinstance(name, str) or not name.strip():
+        raise RecordError("Component name needs to be a non-empty string.")
+    if "/" in name or "\\" in name or name in (".", ".."):
+        raise RecordError(f"Component name '{name}' can't be a file name.")
+    return name
+
+
+def validate_record(data):
+    """
+    Checks a {name, import, usage} record before it's stored or written out.
+    Raises RecordError saying what's wrong with it.
+    """
+    if not isinstance(data, dict):
+        raise RecordError(f"Record needs to be an object, got {type(data).__name__}.")
+    missing = [field for field in RECORD_FIELDS if field not in data]
+    if missing:
+        raise RecordError(f"Record is missing {', '.join(missing)}.")
+    extra = sorted(set(data) - set(RECORD_FIELDS))
+    if extra:
+        raise RecordError(f"Record has unexpected fields {', '.join(extra)}.")
+    for field in RECORD_FIELDS:
+        if not isinstance(data[field], str) or not data[field].strip():
+            raise RecordError(f"Record field '{field}' needs to be a non-empty string.")
+    validate_name(data["name"])
+    return data
+
+
+def serialize_record_json(data):
+    # The layout of the per-component JSON files
+    return json.dumps(data, indent=2, ensure_ascii=True)
+
+
+class StorePlan:
+    """
+    The record puts and deletes that bring the store to its desired state, same idea
+    as reconcile.Plan. Nothing is written until apply is called.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.creates = {}
+        self.updates = {}
+        self.deletes = []
+        self.unchanged = []
+
+    def is_empty(self):
+        return not (self.creates or self.updates or self.deletes)
+
+    def describe(self):
+        lines = []
+        for sign, names in (
+            ("+", self.creates),
+            ("~", self.updates),
+            ("-", self.deletes),
+        ):
+            for name in sorted(names):
+                lines.append(f"{sign} {self.store.path}:{name}")
+        return lines
+
+    def summary(self):
+        return (
+            f"{self.store.path}: {len(self.creates)} to create, {len(self.updates)} "
+            f"to update, {len(self.deletes)} to delete, {len(self.unchanged)} unchanged"
+        )
+
+    def apply(self):
+        if self.is_empty():
+            return
+        with self.store.connection:
+            for records in (self.creates, self.updates):
+                for record in records.values():
+                    self.store.put(record, commit=False)
+            for name in self.deletes:
+                self.store.delete(name, commit=False)
+
+        metrics.count("records.created", len(self.creates))
+        metrics.count("records.updated", len(self.updates))
+        metrics.count("records.deleted", len(self.deletes))
+        logger.info(
+            "%s: %d created, %d updated, %d deleted",
+            self.store.path,
+            len(self.creates),
+            len(self.updates),
+            len(self.deletes),
+        )
+
+
+class RecordStore:
+    """
+    Every extracted {name, import, usage} record in one SQLite file, keyed by
+    component name. Records are validated on the way in, scanned in name order
+    by the template writer and looked up one by one for partial rebuilds.
+    """
+
+    def __init__(self, path=config.RECORD_STORE_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != STORE_VERSION:
+            with self.connection:
+                self.connection.execute("DROP TABLE IF EXISTS records")
+                self.connection.execute(
+                    "CREATE TABLE records ("
+                    "name TEXT PRIMARY KEY, import TEXT NOT NULL, usage TEXT NOT NULL"
+                    ") WITHOUT ROWID"
+                )
+                self.connection.execute(f"PRAGMA user_version = {STORE_VERSION}")
+
+    def get(self, name):
+        # The record of a component, or None
+        row = self.connection.execute(
+            "SELECT name, import, usage FROM records WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(RECORD_FIELDS, row))
+
+    def scan(self):
+        # Every record in name order, read as the caller goes
+        for row in self.connection.execute(
+            "SELECT name, import, usage FROM records ORDER BY name"
+        ):
+            yield dict(zip(RECORD_FIELDS, row))
+
+    def names(self):
+        return [
+            row[0]
+            for row in self.connection.execute("SELECT name FROM records ORDER BY name")
+        ]
+
+    def put(self, data, commit=True):
+        validate_record(data)
+        self.connection.execute(
+            "INSERT INTO records (name, import, usage) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET import = excluded.import, "
+            "usage = excluded.usage",
+            tuple(data[field] for field in RECORD_FIELDS),
+        )
+        if commit:
+            self.connection.commit()
+
+    def delete(self, name, commit=True):
+        self.connection.execute("DELETE FROM records WHERE name = ?", (name,))
+        if commit:
+            self.connection.commit()
+
+    def plan(self, records, scope=None):
+        """
+        Diffs records against the store, without writing anything.
+
+        :param records: Iterable of the {name, import, usage} records the store should hold.
+        :param scope: Component names the plan is limited to, the rest of the store
+            is kept as it is. By default records missing from records get deleted.
+        """
+        plan = StorePlan(self)
+        seen = set()
+        for data in records:
+            validate_record(data)
+            seen.add(data["name"])
+            current = self.get(data["name"])
+            if current is None:
+                plan.creates[data["name"]] = data
+            elif current != data:
+                plan.updates[data["name"]] = data
+            else:
+                plan.unchanged.append(data["name"])
+
+        existing = (
+            self.names()
+            if scope is None
+            else [name for name in sorted(scope) if self.get(name) is not None]
+        )
+        plan.deletes = [name for name in existing if name not in seen]
+        return plan
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def plan_json_export(store, directory=config.DIR_GENERATED_JSONS):
+    # The old one JSON file per component layout, as a plan of the folder
+    return reconcile.plan_directory(
+        directory,
+        {f"{data['name']}.json": serialize_record_json(data) for data in store.scan()},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="RecordStore",
+        description="Look into the record store or export it as one JSON file per component.",
+    )
+    parser.add_argument("--store", default=config.RECORD_STORE_FILE)
+    parser.add_argument(
+        "--get",
+        metavar="NAME",
+        help="Print the record of one component.",
+    )
+    parser.add_argument(
+        "--list",
+        help="Print the names of all stored components.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--export-jsons",
+        metavar="DIR",
+        nargs="?",
+        const=config.DIR_GENERATED_JSONS,
+        help=f"Write a JSON file per component, into {config.DIR_GENERATED_JSONS} by default.",
+    )
+    metrics.add_verbosity_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_logging(metrics.get_verbosity(args))
+
+    if not os.path.isfile(args.store):
+        parser.error(f"{args.store} does not exist, run extract_defaults first.")
+
+    with RecordStore(args.store) as store:
+        if args.get:
+            data = store.get(args.get)
+            if data is None:
+                parser.exit(1, f"No record for '{args.get}'.\n")
+            print(serialize_record_json(data))
+        if args.list:
+            for name in store.names():
+                print(name)
+        if args.export_jsons:
+            plan_json_export(store, args.export_jsons).apply()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+import config
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import archive_source
+import emitters
+import git_source
+import isolation
+import manifest
+import metrics
+import overlay_index
+import pipeline
+import record_store
+
+logger = metrics.get_logger(__name__)
+
+# Bump this when the layout of the partial results changes
+PARTIAL_VERSION = 1
+
+# Output folders compared by local --verify
+OUTPUT_DIRS = (
+    config.DIR_GENERATED_LIVE_TEMPLATES,
+    config.DIR_GENERATED_EDITOR_SNIPPETS,
+)
+
+
+class ShardError(Exception):
+    pass
+
+
+def get_shard(filename, count):
+    # By component name so button.md and button.mdx always land in the same shard,
+    # sha256 since Python's own str hash changes from one process to the next
+    name = overlay_index.get_component_name(filename)
+    digest = hashlib.sha256(name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def get_partial_path(directory, shard, count):
+    return os.path.join(directory, f"shard-{shard}-of-{count}.json")
+
+
+def run_shard(
+    shard,
+    count,
+    output_path,
+    workers=None,
+    executor="isolated",
+    source=None,
+    timeout=isolation.DEFAULT_TIMEOUT,
+    memory_limit=isolation.DEFAULT_MEMORY_LIMIT_MB,
+):
+    """
+    Checks and extracts the docs of one shard, the same way a full pipeline run does,
+    and writes what came out of every doc into output_path. Nothing is templated,
+    that's left to merge_partials.
+    """
+    if not 0 <= shard < count:
+        raise ShardError(f"Shard {shard} doesn't exist with {count} shards.")
+
+    index = overlay_index.load_index()
+    filenames = sorted(
+        filename
+        for filename in pipeline.scan_all_sources(source, index)
+        if get_shard(filename, count) == shard
+    )
+    logger.info("Shard %d of %d: %d docs", shard, count, len(filenames))
+
+    failures_before = len(metrics.RUN.failures)
+    docs = {filename: None for filename in filenames}
+    for result in pipeline.map_components(
+        filenames,
+        workers,
+        executor,
+        source=source,
+        index=index,
+        formats=[],
+        timeout=timeout,
+        memory_limit=memory_limit,
+    ):
+        snapshot = result.pop("metrics")
+        metrics.RUN.merge(snapshot)
+        if snapshot["failures"]:
+            continue
+        docs[result["filename"]] = {
+            "verdict": result["verdict"],
+            "record": result["record"],
+        }
+
+    partial = {
+        "version": PARTIAL_VERSION,
+        "shard": shard,
+        "shards": count,
+        "upstream": None if source is None else source.commit,
+        "docs": docs,
+        "failures": metrics.RUN.failures[failures_before:],
+    }
+    write_json(output_path, partial)
+    return partial
+
+
+def write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=1, sort_keys=True)
+        metrics.count_written(file)
+    os.replace(tmp_path, path)
+
+
+def load_partials(paths):
+    # Checks the partials belong to the same run and cover every shard exactly once
+    partials = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            metrics.count_read(file)
+            partial = json.load(file)
+        if partial.get("version") != PARTIAL_VERSION:
+            raise ShardError(f"{path} is not a version {PARTIAL_VERSION} partial.")
+        partials.append(partial)
+
+    if not partials:
+        raise ShardError("No partials to merge.")
+    count = partials[0]["shards"]
+    upstream = partials[0]["upstream"]
+    seen = {}
+    for path, partial in zip(paths, partials):
+        if partial["shards"] != count or partial["upstream"] != upstream:
+            raise ShardError(f"{path} comes from a different sharded run.")
+        if partial["shard"] in seen:
+            raise ShardError(
+                f"{path} and {seen[partial['shard']]} are both shard {partial['shard']}."
+            )
+        seen[partial["shard"]] = path
+        for filename in partial["docs"]:
+            if get_shard(filename, count) != partial["shard"]:
+                raise ShardError(f"{path} has {filename} of another shard.")
+    missing = sorted(set(range(count)) - set(seen))
+    if missing:
+        raise ShardError(f"Missing shards {', '.join(map(str, missing))} of {count}.")
+    return partials
+
+
+def merge_partials(
+    paths,
+    template_shards=1,
+    group_per_shard=False,
+    formats=emitters.DEFAULT_EMITTERS,
+):
+    """
+    Writes the templates of every format and the record store from the partials of
+    all shards. The docs come out in the same order as in a single pipeline run,
+    so the templates are byte-identical to what that run writes.
+    """
+    emitters.check_emitter_names(formats)
+    partials = load_partials(paths)
+
+    docs = {}
+    failures = []
+    for partial in partials:
+        failures.extend(partial["failures"])
+        for filename, entry in partial["docs"].items():
+            if entry is not None:
+                docs[filename] = entry
+
+    records = [
+        docs[filename]["record"] for filename in pipeline.get_record_filenames(docs)
+    ]
+    with record_store.RecordStore() as store:
+        store.plan(records).apply()
+
+    written = pipeline.write_templates(
+        docs, {}, template_shards, group_per_shard, formats
+    )
+    if "intellij" in formats:
+        pipeline.remove_stale_templates(written)
+    pipeline.write_failure_report(failures)
+
+    return {
+        "docs": len(docs),
+        "snippets": len(records),
+        "written": written,
+        "failures": failures,
+    }
+
+
+def list_outputs():
+    # Every generated template and editor snippet file
+    for directory in OUTPUT_DIRS:
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                yield os.path.join(root, filename)
+
+
+def hash_outputs():
+    return {file_path: manifest.hash_file(file_path) for file_path in list_outputs()}
+
+
+def run_local(
+    count,
+    partials_dir,
+    shard_arguments=(),
+    template_shards=1,
+    group_per_shard=False,
+    formats=emitters.DEFAULT_EMITTERS,
+):
+    # Every shard in a process of its own, as if each had a machine, then the merge
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "run",
+                "--shard",
+                str(shard),
+                "--of",
+                str(count),
+                "--output",
+                get_partial_path(partials_dir, shard, count),
+                *shard_arguments,
+            ]
+        )
+        for shard in range(count)
+    ]
+    failed = [shard for shard, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise ShardError(f"Shards {', '.join(map(str, failed))} failed.")
+
+    return merge_partials(
+        [get_partial_path(partials_dir, shard, count) for shard in range(count)],
+        template_shards,
+        group_per_shard,
+        formats,
+    )
+
+
+def verify_local(count, partials_dir, shard_arguments=(), source=None, **merge_options):
+    # Runs the pipeline on one node first, then the shards, and compares the outputs.
+    # The outputs are removed before each, so neither files left over from other
+    # formats nor a file only one of them writes can hide a difference
+    for file_path in list(list_outputs()):
+        os.remove(file_path)
+    with tempfile.TemporaryDirectory(prefix="shard-verify-") as directory:
+        pipeline.run_pipeline(
+            copy_to_plugin=False,
+            manifest_path=os.path.join(directory, config.MANIFEST_FILE),
+            shards=merge_options.get("template_shards", 1),
+            group_per_shard=merge_options.get("group_per_shard", False),
+            source=source,
+            formats=merge_options.get("formats", emitters.DEFAULT_EMITTERS),
+        )
+    expected = hash_outputs()
+    for file_path in expected:
+        os.remove(file_path)
+    summary = run_local(count, partials_dir, shard_arguments, **merge_options)
+    actual = hash_outputs()
+    summary["mismatches"] = sorted(
+        file_path
+        for file_path in set(expected) | set(actual)
+        if expected.get(file_path) != actual.get(file_path)
+    )
+    return summary
+
+
+def add_source_arguments(parser):
+    upstream = parser.add_mutually_exclusive_group()
+    upstream.add_argument(
+        "--git-repo",
+        metavar="PATH",
+        help="Read the upstream docs straight from this shadcn/ui git repository.",
+    )
+    parser.add_argument("--ref", default="HEAD", help="Ref to read the docs at.")
+    parser.add_argument("--git-docs-path", default=config.GIT_DOCS_PATH)
+    upstream.add_argument(
+        "--archive",
+        metavar="PATH",
+        help="Read the upstream docs straight out of this .tar, .tar.gz or .zip.",
+    )
+    parser.add_argument("--archive-pattern", default=archive_source.DEFAULT_PATTERN)
+
+
+def add_worker_arguments(parser, workers=None):
+    parser.add_argument(
+        "-w", "--workers", type=int, default=workers, help="Workers per shard."
+    )
+    parser.add_argument(
+        "-e", "--executor", choices=sorted(pipeline.EXECUTORS), default="isolated"
+    )
+    parser.add_argument("--timeout", type=float, default=isolation.DEFAULT_TIMEOUT)
+    parser.add_argument(
+        "--memory-limit",
+        metavar="MB",
+        type=int,
+        default=isolation.DEFAULT_MEMORY_LIMIT_MB,
+    )
+
+
+def add_template_arguments(parser):
+    parser.add_argument(
+        "--template-shards",
+        type=int,
+        default=1,
+        help="Split each template set over this many files, see pipeline.py --shards.",
+    )
+    parser.add_argument("--group-per-shard", action="store_true")
+    parser.add_argument(
+        "--format",
+        action="append",
+        choices=sorted(emitters.EMITTERS),
+        help="Output format to write, repeat it for several.",
+    )
+
+
+def get_shard_arguments(args):
+    # What run_local hands on to every shard process
+    arguments = [
+        "--executor",
+        args.executor,
+        "--timeout",
+        str(args.timeout),
+        "--memory-limit",
+        str(args.memory_limit),
+    ]
+    if args.workers is not None:
+        arguments += ["--workers", str(args.workers)]
+    if args.git_repo:
+        arguments += ["--git-repo", args.git_repo, "--ref", args.ref]
+        arguments += ["--git-docs-path", args.git_docs_path]
+    if args.archive:
+        arguments += ["--archive", args.archive]
+        arguments += ["--archive-pattern", args.archive_pattern]
+    if args.quiet:
+        arguments.append("--quiet")
+    arguments += ["--verbose"] * args.verbose
+    return arguments
+
+
+def log_merge(summary):
+    logger.info(
+        "Merged %d docs into %d snippets, %d files written",
+        summary["docs"],
+        summary["snippets"],
+        len(summary["written"]),
+    )
+    if summary["failures"]:
+        logger.warning(
+            "%d docs were quarantined, see %s",
+            len(summary["failures"]),
+            config.FAILURE_REPORT_FILE,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="ShardRun",
+        description="Split the doc set into hash partitioned shards that can run on "
+        "different machines, and merge their partial results into the templates.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Check and extract the docs of one shard."
+    )
+    run_parser.add_argument("--shard", type=int, required=True, metavar="I")
+    run_parser.add_argument("--of", type=int, required=True, metavar="K")
+    run_parser.add_argument(
+        "-o",
+        "--output",
+        metavar="PATH",
+        help="Where the partial result goes, shard-I-of-K.json by default.",
+    )
+    add_source_arguments(run_parser)
+    add_worker_arguments(run_parser)
+    metrics.add_verbosity_arguments(run_parser)
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Write the templates from the partials of every shard."
+    )
+    merge_parser.add_argument("partials", nargs="+", metavar="PARTIAL")
+    add_template_arguments(merge_parser)
+    metrics.add_verbosity_arguments(merge_parser)
+
+    local_parser = subparsers.add_parser(
+        "local", help="Run K shards as local processes and merge them."
+    )
+    local_parser.add_argument("count", type=int, metavar="K")
+    local_parser.add_argument(
+        "--partials",
+        metavar="DIR",
+        help="Keep the partials in DIR instead of a temporary folder.",
+    )
+    local_parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Also run the pipeline on one node first and fail if the merged "
+        "outputs aren't byte-identical to it. Clears the generated outputs first.",
+    )
+    add_source_arguments(local_parser)
+    add_worker_arguments(local_parser, workers=1)
+    add_template_arguments(local_parser)
+    metrics.add_verbosity_arguments(local_parser)
+
+    args = parser.parse_args()
+    metrics.configure_logging(metrics.get_verbosity(args))
+
+    try:
+        if args.command == "run":
+            run(args)
+        elif args.command == "merge":
+            log_merge(
+                merge_partials(
+                    args.partials,
+                    args.template_shards,
+                    args.group_per_shard,
+                    args.format or emitters.DEFAULT_EMITTERS,
+                )
+            )
+        else:
+            local(args)
+    except (ShardError, git_source.GitError, archive_source.ArchiveError) as e:
+        parser.exit(1, f"{e}\n")
+
+
+def run(args):
+    if args.of < 1:
+        raise ShardError("--of needs to be at least 1.")
+    source = pipeline.open_source(args)
+    try:
+        run_shard(
+            args.shard,
+            args.of,
+            args.output or get_partial_path(".", args.shard, args.of),
+            args.workers,
+            args.executor,
+            source,
+            args.timeout,
+            args.memory_limit,
+        )
+    finally:
+        if source is not None:
+            source.close()
+
+
+def local(args):
+    if args.count < 1:
+        raise ShardError("K needs to be at least 1.")
+    merge_options = {
+        "template_shards": args.template_shards,
+        "group_per_shard": args.group_per_shard,
+        "formats": args.format or emitters.DEFAULT_EMITTERS,
+    }
+    with tempfile.TemporaryDirectory(prefix="shard-partials-") as directory:
+        partials_dir = args.partials or directory
+        if args.verify:
+            source = pipeline.open_source(args)
+            try:
+                summary = verify_local(
+                    args.count,
+                    partials_dir,
+                    get_shard_arguments(args),
+                    source,
+                    **merge_options,
+                )
+            finally:
+                if source is not None:
+                    source.close()
+        else:
+            summary = run_local(
+                args.count, partials_dir, get_shard_arguments(args), **merge_options
+            )
+    log_merge(summary)
+    if args.verify:
+        if summary["mismatches"]:
+            for file_path in summary["mismatches"]:
+                logger.error("Differs from the single node run: %s", file_path)
+            raise ShardError(
+                f"{len(summary['mismatches'])} outputs differ from the single node run."
+            )
+        logger.info("Byte-identical to the single node run.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+# The scripts import each other by module name, same as running them from their folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+import metrics  # noqa: E402
+
+
+def make_doc(import_code, usage_code, title="Doc"):
+    # A doc with just the parts the check looks at
+    return (
+        f"# {title}\n\n"
+        "## Usage\n\n"
+        f"```tsx\n{import_code}\n```\n\n"
+        f"```tsx\n{usage_code}\n```\n\n"
+        "## Examples\n\n"
+        "Nothing here.\n"
+    )
+
+
+def write_doc(directory, filename, content):
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, filename)
+    data = content if isinstance(content, bytes) else content.encode("utf-8")
+    with open(file_path, "wb") as file:
+        file.write(data)
+    return file_path
+
+
+def read_templates(directory=config.DIR_GENERATED_LIVE_TEMPLATES):
+    # {filename: content} of every generated live template file
+    templates = {}
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename), "rb") as file:
+            templates[filename] = file.read()
+    return templates
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # The scripts work on folders relative to where they run, two levels below the
+    # plugin sources like scripts/python-test is
+    directory = tmp_path / "scripts" / "python-test"
+    directory.mkdir(parents=True)
+    os.makedirs(os.path.normpath(directory / config.DIR_PLUGIN_RESOURCE_FOLDER))
+    monkeypatch.chdir(directory)
+    metrics.RUN.reset()
+    yield directory
+    metrics.RUN.reset()
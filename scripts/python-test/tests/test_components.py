@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import subprocess
+
+import check_component_docs
+import config
+import extract_defaults
+import manifest
+import overlay_index
+import pipeline
+import record_store
+import versions
+import watch
+import write_to_template
+from conftest import make_doc, read_templates, write_doc
+
+BUTTON_IMPORT = 'import { Button } from "@/ui/button"'
+
+
+def write_button_pair(directory, md_usage, mdx_usage):
+    write_doc(directory, "button.md", make_doc(BUTTON_IMPORT, md_usage))
+    write_doc(directory, "button.mdx", make_doc(BUTTON_IMPORT, mdx_usage))
+
+
+def usage_templates():
+    return read_templates()["shadcn-ui-usage-snippets.xml"].decode("utf-8")
+
+
+def test_md_and_mdx_of_a_component_give_one_template(workspace):
+    write_button_pair(config.DIR_DOCS_FROM_REPO, "<Button>md</Button>", "<Button />")
+    summary = pipeline.run_pipeline(
+        executor="thread", write_jsons=True, verify=True, copy_to_plugin=False
+    )
+
+    assert summary["snippets"] == ["button"]
+    assert summary.get("verify_problems") == 0
+    usage = usage_templates()
+    assert usage.count('name="cnu-button"') == 1
+    # Same doc the overlay index picks, the first auto doc by filename
+    assert "&lt;Button&gt;md&lt;/Button&gt;" in usage
+    with record_store.RecordStore() as store:
+        assert store.get("button")["usage"] == "<Button>md</Button>"
+    with open(os.path.join(config.DIR_GENERATED_JSONS, "button.json")) as file:
+        assert json.load(file)["usage"] == "<Button>md</Button>"
+
+
+def test_pipeline_picks_the_same_doc_as_the_stages(workspace):
+    write_button_pair(config.DIR_DOCS_FROM_REPO, "<Button>md</Button>", "<Button />")
+    check_component_docs.check_and_generate_docs()
+    extract_defaults.extract_defaults()
+    write_to_template.write_to_template()
+    expected = read_templates()
+
+    for directory in (config.DIR_AUTO_DOCS, config.DIR_GENERATED_LIVE_TEMPLATES):
+        shutil.rmtree(directory)
+    pipeline.run_pipeline(executor="thread", copy_to_plugin=False)
+    assert read_templates() == expected
+
+
+def test_doc_that_passes_the_check_beats_a_manual_doc(workspace):
+    # button.md fails the check, so its manual doc loses to the auto doc of button.mdx
+    write_doc(config.DIR_DOCS_FROM_REPO, "button.md", "# Button\n\nNo usage.\n")
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "button.mdx",
+        make_doc(BUTTON_IMPORT, "<Button>mdx</Button>"),
+    )
+    write_doc(
+        config.DIR_MANUAL_DOCS,
+        "button.md",
+        make_doc(BUTTON_IMPORT, "<Button>manual</Button>"),
+    )
+    pipeline.run_pipeline(executor="thread", copy_to_plugin=False)
+
+    usage = usage_templates()
+    assert usage.count('name="cnu-button"') == 1
+    assert "&lt;Button&gt;mdx&lt;/Button&gt;" in usage
+
+
+def test_other_doc_takes_over_when_the_picked_one_goes(workspace):
+    write_button_pair(config.DIR_DOCS_FROM_REPO, "<Button>md</Button>", "<Button />")
+    pipeline.run_pipeline(executor="thread", incremental=True, copy_to_plugin=False)
+
+    os.remove(os.path.join(config.DIR_DOCS_FROM_REPO, "button.md"))
+    summary = pipeline.run_pipeline(
+        executor="thread", incremental=True, copy_to_plugin=False
+    )
+
+    assert summary["removed"] == ["button.md"]
+    assert summary["processed"] == []
+    usage = usage_templates()
+    assert usage.count('name="cnu-button"') == 1
+    assert "&lt;Button /&gt;" in usage
+
+
+def test_versions_give_one_record_per_component(workspace):
+    repo = workspace / "repo"
+    docs = repo / config.GIT_DOCS_PATH
+    write_button_pair(str(docs), "<Button>md</Button>", "<Button />")
+    for command in (
+        ["init", "-q"],
+        ["add", "-A"],
+        ["-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "docs"],
+    ):
+        subprocess.run(["git", "-C", str(repo), *command], check=True)
+
+    (summary,) = versions.build_versions(str(repo), ["HEAD"], store_path=None)
+
+    assert summary["snippets"] == 1
+    output = os.path.join(summary["output"], write_to_template.USAGE_SNIPPETS_FILE)
+    with open(output, encoding="utf-8") as file:
+        usage = file.read()
+    assert usage.count('name="cnu-button"') == 1
+    assert "&lt;Button&gt;md&lt;/Button&gt;" in usage
+
+
+def test_watch_keeps_the_picked_doc_when_the_other_one_changes(workspace):
+    write_button_pair(config.DIR_DOCS_FROM_REPO, "<Button>md</Button>", "<Button />")
+    pipeline.run_pipeline(
+        executor="thread", incremental=True, write_jsons=True, copy_to_plugin=False
+    )
+    build_manifest = manifest.load_manifest(
+        config.MANIFEST_FILE, manifest.read_manifest_options(config.MANIFEST_FILE)
+    )
+    index = overlay_index.load_index()
+
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "button.mdx",
+        make_doc(BUTTON_IMPORT, "<Button>edited</Button>"),
+    )
+    watch.update_components(["button.mdx"], build_manifest, index, False)
+    assert "&lt;Button&gt;md&lt;/Button&gt;" in usage_templates()
+
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "button.md",
+        make_doc(BUTTON_IMPORT, "<Button>md edited</Button>"),
+    )
+    watch.update_components(["button.md"], build_manifest, index, False)
+    usage = usage_templates()
+    assert usage.count('name="cnu-button"') == 1
+    assert "&lt;Button&gt;md edited&lt;/Button&gt;" in usage
+    with open(os.path.join(config.DIR_GENERATED_JSONS, "button.json")) as file:
+        assert json.load(file)["usage"] == "<Button>md edited</Button>"
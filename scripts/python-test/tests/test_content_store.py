@@ -0,0 +1,35 @@
+import os
+
+import content_store
+
+
+def test_hits_leave_the_store_file_alone(tmp_path):
+    path = str(tmp_path / "store.json")
+    with content_store.ContentStore(path) as store:
+        store.put("a", {"name": "a"})
+        store.put("b", {"name": "b"})
+    before = os.stat(path).st_mtime_ns
+
+    with content_store.ContentStore(path) as store:
+        assert store.get("a") == {"name": "a"}
+        assert store.get("missing") is None
+        assert not store.changed
+    assert os.stat(path).st_mtime_ns == before
+
+
+def test_order_of_hits_is_saved_with_the_next_change(tmp_path):
+    path = str(tmp_path / "store.json")
+    with content_store.ContentStore(path) as store:
+        for key in ["a", "b", "c"]:
+            store.put(key, {"name": key})
+
+    with content_store.ContentStore(path) as store:
+        store.get("a")
+        store.put("d", {"name": "d"})
+
+    store = content_store.ContentStore(path)
+    assert list(store.entries) == ["b", "c", "a", "d"]
+    # Room for three, the least recently used one goes
+    size = content_store.entry_size({"name": "a"})
+    store = content_store.ContentStore(path, max_bytes=3 * size)
+    assert list(store.entries) == ["c", "a", "d"]
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+import config
+import daemon
+from conftest import make_doc, read_templates, write_doc
+
+
+@pytest.fixture
+def served(workspace):
+    # A daemon after its first build, answering on a free port in a thread
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "badge.mdx",
+        make_doc('import { Badge } from "@/ui/badge"', "<Badge />"),
+    )
+    snippet_daemon = daemon.SnippetDaemon(copy_to_plugin=False)
+    snippet_daemon.rebuild()
+    server = snippet_daemon.create_server(port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    host, port = server.server_address[:2]
+    yield snippet_daemon, daemon.DaemonClient(host, port, timeout=10), thread
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_client_drives_the_daemon(served):
+    snippet_daemon, client, thread = served
+
+    status = client.status()
+    assert status["ok"]
+    assert (status["docs"], status["snippets"]) == (1, 1)
+    assert status["requests"] == 1
+
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "card.mdx",
+        make_doc('import { Card } from "@/ui/card"', "<Card />"),
+    )
+    result = client.regenerate(["card", "missing"])
+    assert result["processed"] == ["card.mdx"]
+    assert result["unknown"] == ["missing"]
+    usage = read_templates()["shadcn-ui-usage-snippets.xml"].decode("utf-8")
+    assert 'name="cnu-card"' in usage
+
+    with pytest.raises(daemon.DaemonError, match="can't be a file name"):
+        client.regenerate(["../badge"])
+
+    status = client.status()
+    assert (status["docs"], status["snippets"]) == (2, 2)
+    assert status["requests"] == 4
+
+    assert client.stop() == {"ok": True}
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_status_does_not_wait_for_a_build(served):
+    snippet_daemon, client, _ = served
+    with snippet_daemon.lock:
+        status = client.status()
+    assert status["busy"]
+    assert status["docs"] == 1
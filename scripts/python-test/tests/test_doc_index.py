@@ -0,0 +1,131 @@
+import random
+import re
+import sys
+
+import pytest
+
+import doc_index
+import mapped_docs
+
+# The regexes the checker used before docs were indexed in place
+USAGE_PATTERN = r"## Usage\s+([\s\S]*?)(\n##|\Z)"
+CODE_BLOCK_PATTERN = r"```(?:[^\n]*\n)(.*?)```"
+
+
+def old_usage(content):
+    match = re.search(USAGE_PATTERN, content)
+    if match is None:
+        return None
+    usage = match.group(1).strip()
+    return usage, old_code_blocks(usage)
+
+
+def old_code_blocks(text):
+    return [match.strip() for match in re.findall(CODE_BLOCK_PATTERN, text, re.DOTALL)]
+
+
+def new_usage(content):
+    usage = doc_index.index_doc(content).find_section("Usage")
+    if usage is None:
+        return None
+    return usage.text, [block.text for block in usage.code_blocks]
+
+
+def new_code_blocks(content):
+    return [block.text for block in doc_index.index_doc(content).code_blocks]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # Only a deeper heading, "### Usage" still has "## Usage" in it
+        "# Doc\n\n### Usage\n\n```tsx\nimport x\n```\n",
+        # A "# Heading" doesn't end the section, only "\n##" does
+        "## Usage\n\n```tsx\na\n```\n\n# Other\n\n```tsx\nb\n```\n## Next\n",
+        # The closing fence doesn't have to start a line
+        '## Usage\n\n```tsx\nimport x from "y"```\n\n```tsx\n<X />\n```\n',
+        # A heading inside a code block ends the section all the same
+        "## Usage\n\n```md\n## Not a heading\n```\n\n```tsx\n<X />\n```\n",
+        # Fences indented or with text before them
+        "## Usage\n  ```tsx\n  a\n  ```\ntext ```js\nb\n```",
+        # A fence left open at the end of the section
+        "## Usage\n\n```tsx\na\n## Examples\n\n```tsx\nb\n```\n",
+        "## Usage",
+        "## Usage\n",
+        "## Usage 　```tsx\n a \n```\u0085",
+    ],
+)
+def test_matches_the_old_patterns(content):
+    assert new_usage(content) == old_usage(content)
+    assert new_code_blocks(content) == old_code_blocks(content)
+    data = content.encode("utf-8")
+    prepared = mapped_docs.prepare(data)
+    if isinstance(prepared, bytes):
+        expected = old_usage(content)
+        if expected is not None:
+            usage, blocks = expected
+            expected = usage.encode("utf-8"), [
+                block.encode("utf-8") for block in blocks
+            ]
+        assert new_usage(prepared) == expected
+    else:
+        assert new_usage(prepared) == old_usage(content)
+
+
+def test_the_old_patterns_on_random_docs():
+    # Docs made of the pieces the patterns care about, compared as text and as the
+    # bytes the pipeline indexes
+    pieces = [
+        "## Usage",
+        "## Usage\n",
+        "### Usage\n",
+        "# Usage\n",
+        "## Examples\n",
+        "\n##",
+        "#",
+        "```",
+        "```tsx\n",
+        "\n```\n",
+        "\n",
+        "\r\n",
+        "\r",
+        " ",
+        "\t",
+        " ",
+        " ",
+        "\x1c",
+        "<Button />",
+        'import { Button } from "@/ui/button"',
+        "café",
+    ]
+    generator = random.Random(3)
+    for _ in range(3000):
+        content = "".join(generator.choices(pieces, k=generator.randint(0, 24)))
+        assert new_usage(content) == old_usage(content), content
+        assert new_code_blocks(content) == old_code_blocks(content), content
+
+        prepared = mapped_docs.prepare(content.encode("utf-8"))
+        text = mapped_docs.decode(content.encode("utf-8"))
+        usage = new_usage(prepared)
+        blocks = new_code_blocks(prepared)
+        if isinstance(prepared, bytes):
+            # Texts read out of bytes are decoded like text mode, see as_text
+            usage = usage and (
+                mapped_docs.as_text(usage[0]),
+                [mapped_docs.as_text(block) for block in usage[1]],
+            )
+            blocks = [mapped_docs.as_text(block) for block in blocks]
+        assert usage == old_usage(text), content
+        assert blocks == old_code_blocks(text), content
+
+
+def test_whitespace_is_what_strip_trims():
+    whitespace = {
+        character
+        for character in map(chr, range(sys.maxunicode + 1))
+        if character.isspace()
+    }
+    assert set(doc_index.WHITESPACE) == whitespace
+    assert set(doc_index.BYTES_WHITESPACE) == {
+        byte for byte in range(256) if bytes([byte]).isspace()
+    }
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import check_component_docs
+import config
+import mapped_docs
+import metrics
+from conftest import make_doc, write_doc
+
+
+def write_docs():
+    for name in ["badge", "card"]:
+        component = name.capitalize()
+        write_doc(
+            config.DIR_DOCS_FROM_REPO,
+            f"{name}.mdx",
+            make_doc(
+                f'import {{ {component} }} from "@/ui/{name}"', f"<{component} />"
+            ),
+        )
+
+
+def test_files_are_released_when_the_build_ends(workspace):
+    write_docs()
+    with mapped_docs.FILES.build():
+        good_files, _, _ = check_component_docs.plan_docs()
+        assert len(mapped_docs.FILES.files) == 2
+    assert mapped_docs.FILES.files == {}
+    assert mapped_docs.FILES.ids == {}
+
+    # A span kept past its build can't be read any more
+    span = good_files[0][2]
+    with pytest.raises(mapped_docs.StaleSpanError):
+        span.text()
+
+    check_component_docs.check_and_generate_docs()
+    assert mapped_docs.FILES.files == {}
+
+
+def test_doc_changed_before_apply_is_quarantined(workspace):
+    write_docs()
+    with mapped_docs.FILES.build():
+        _, _, (auto_plan, _) = check_component_docs.plan_docs()
+        write_doc(
+            config.DIR_DOCS_FROM_REPO,
+            "card.mdx",
+            make_doc('import { Card } from "@/ui/card"', "<Card>Edited</Card>"),
+        )
+        auto_plan.apply()
+
+    assert auto_plan.quarantined == ["card.mdx"]
+    assert os.listdir(config.DIR_AUTO_DOCS) == ["badge.mdx"]
+    (failure,) = metrics.RUN.failures
+    assert failure["reason"] == "changed"
+    assert failure["file"].endswith("card.mdx")
+
+    # The next run picks the doc up as it is now
+    check_component_docs.check_and_generate_docs()
+    with open(os.path.join(config.DIR_AUTO_DOCS, "card.mdx"), encoding="utf-8") as file:
+        assert "<Card>Edited</Card>" in file.read()
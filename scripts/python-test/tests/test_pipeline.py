@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+import check_component_docs
+import config
+import extract_defaults
+import generate_corpus
+import pipeline
+import shard_run
+import write_to_template
+from conftest import make_doc, read_templates, write_doc
+
+
+@pytest.fixture
+def corpus(workspace):
+    return generate_corpus.generate_corpus(docs=30, seed=1)
+
+
+def remove_outputs():
+    for directory in (
+        config.DIR_AUTO_DOCS,
+        config.DIR_MANUAL_DOCS,
+        config.DIR_GENERATED_JSONS,
+        config.DIR_GENERATED_LIVE_TEMPLATES,
+    ):
+        shutil.rmtree(directory, ignore_errors=True)
+    for file_path in (config.RECORD_STORE_FILE, config.MANIFEST_FILE):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def test_pipeline_matches_the_stages(corpus):
+    check_component_docs.check_and_generate_docs()
+    extract_defaults.extract_defaults()
+    write_to_template.write_to_template()
+    expected = read_templates()
+
+    remove_outputs()
+    pipeline.run_pipeline(workers=2, executor="thread", copy_to_plugin=False)
+    assert read_templates() == expected
+
+
+@pytest.mark.parametrize("executor", ["thread", "process", "isolated"])
+def test_executors_write_the_same_templates(corpus, executor):
+    pipeline.run_pipeline(workers=1, executor="thread", copy_to_plugin=False)
+    expected = read_templates()
+
+    remove_outputs()
+    pipeline.run_pipeline(workers=3, executor=executor, copy_to_plugin=False)
+    assert read_templates() == expected
+
+
+def test_templates_are_in_name_order(workspace):
+    for name in ["card", "alert", "button"]:
+        component = name.capitalize()
+        write_doc(
+            config.DIR_DOCS_FROM_REPO,
+            f"{name}.mdx",
+            make_doc(
+                f'import {{ {component} }} from "@/ui/{name}"', f"<{component} />"
+            ),
+        )
+    pipeline.run_pipeline(executor="thread", copy_to_plugin=False)
+
+    usage = read_templates()["shadcn-ui-usage-snippets.xml"].decode("utf-8")
+    positions = [
+        usage.index(f'name="cnu-{name}"') for name in ["alert", "button", "card"]
+    ]
+    assert positions == sorted(positions)
+
+
+def test_incremental_run_only_processes_the_edited_doc(workspace):
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "badge.mdx",
+        make_doc('import { Badge } from "@/ui/badge"', "<Badge />"),
+    )
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "card.mdx",
+        make_doc('import { Card } from "@/ui/card"', "<Card />"),
+    )
+    pipeline.run_pipeline(executor="thread", incremental=True, copy_to_plugin=False)
+
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "card.mdx",
+        make_doc('import { Card } from "@/ui/card"', "<Card>Edited</Card>"),
+    )
+    summary = pipeline.run_pipeline(
+        executor="thread", incremental=True, copy_to_plugin=False
+    )
+
+    assert summary["processed"] == ["card.mdx"]
+    usage = read_templates()["shadcn-ui-usage-snippets.xml"].decode("utf-8")
+    assert "&lt;Card&gt;Edited&lt;/Card&gt;" in usage
+    assert 'name="cnu-badge"' in usage
+
+
+def test_doc_that_is_not_utf8_is_quarantined(workspace):
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "badge.mdx",
+        make_doc('import { Badge } from "@/ui/badge"', "<Badge />"),
+    )
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "latin.mdx",
+        make_doc('import { Latin } from "@/ui/latin"', "<Latin>café</Latin>").encode(
+            "latin-1"
+        ),
+    )
+    summary = pipeline.run_pipeline(executor="isolated", copy_to_plugin=False)
+
+    assert summary["quarantined"] == ["latin.mdx"]
+    assert summary["good"] == ["badge.mdx"]
+    with open(config.FAILURE_REPORT_FILE, encoding="utf-8") as file:
+        failures = json.load(file)["failures"]
+    assert [failure["reason"] for failure in failures] == ["error"]
+    usage = read_templates()["shadcn-ui-usage-snippets.xml"].decode("utf-8")
+    assert 'name="cnu-badge"' in usage
+    assert "cnu-latin" not in usage
+
+
+def test_shards_match_a_single_node_run(corpus, tmp_path):
+    summary = shard_run.verify_local(3, str(tmp_path / "partials"))
+    assert summary["snippets"] > 0
+    assert summary["mismatches"] == []
+
+
+def test_thread_workers_quarantine_only_the_failing_doc(workspace, monkeypatch):
+    for position in range(24):
+        write_doc(
+            config.DIR_DOCS_FROM_REPO,
+            f"label-{position}.md",
+            make_doc('import { Label } from "@/ui/label"', "<Label />"),
+        )
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "m-bad.mdx",
+        make_doc('import { Bad } from "@/ui/bad"', "<Bad>café</Bad>").encode("latin-1"),
+    )
+    run_component = pipeline.run_component
+
+    def slow_run_component(*args, **kwargs):
+        # Keeps the docs on the pool overlapping
+        result = run_component(*args, **kwargs)
+        time.sleep(0.01)
+        return result
+
+    monkeypatch.setattr(pipeline, "run_component", slow_run_component)
+    summary = pipeline.run_pipeline(workers=8, executor="thread", copy_to_plugin=False)
+
+    assert summary["quarantined"] == ["m-bad.mdx"]
+    assert "m-bad.mdx" not in summary["good"]
+    assert len(summary["good"]) == 24
+
+
+def test_pipeline_applies_the_deletes_the_dry_run_lists(workspace):
+    write_doc(
+        config.DIR_DOCS_FROM_REPO,
+        "badge.mdx",
+        make_doc('import { Badge } from "@/ui/badge"', "<Badge />"),
+    )
+    # Left behind by a doc upstream dropped
+    write_doc(
+        config.DIR_AUTO_DOCS,
+        "extra.mdx",
+        make_doc('import { Extra } from "@/ui/extra"', "<Extra />"),
+    )
+
+    auto_plan, _ = pipeline.plan_outputs()
+    assert auto_plan.deletes == ["extra.mdx"]
+    assert os.path.isfile(os.path.join(config.DIR_AUTO_DOCS, "extra.mdx"))
+
+    summary = pipeline.run_pipeline(executor="thread", copy_to_plugin=False)
+    assert summary["snippets"] == ["badge"]
+    assert os.listdir(config.DIR_AUTO_DOCS) == ["badge.mdx"]
+    assert "cni-extra" not in read_templates()["shadcn-ui-import-snippets.xml"].decode(
+        "utf-8"
+    )
+
+
+def test_noop_run_writes_nothing(corpus):
+    pipeline.run_pipeline(executor="thread", incremental=True, copy_to_plugin=False)
+    saved = [
+        config.MANIFEST_FILE,
+        config.OVERLAY_INDEX_FILE,
+        config.RECORD_STORE_FILE,
+        *(
+            os.path.join(config.DIR_GENERATED_LIVE_TEMPLATES, filename)
+            for filename in read_templates()
+        ),
+    ]
+    before = {file_path: os.stat(file_path).st_mtime_ns for file_path in saved}
+
+    summary = pipeline.run_pipeline(
+        executor="thread", incremental=True, copy_to_plugin=False
+    )
+
+    assert summary["processed"] == []
+    assert {file_path: os.stat(file_path).st_mtime_ns for file_path in saved} == before
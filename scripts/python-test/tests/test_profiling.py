@@ -0,0 +1,61 @@
+import cProfile
+import os
+import threading
+
+import pytest
+
+import generate_corpus
+import metrics
+import pipeline
+import profiling
+
+
+class SingleProfile(cProfile.Profile):
+    # Acts like cProfile on 3.12+, where only one profiler can be on per process
+    lock = threading.Lock()
+    owner = None
+
+    def enable(self, *args, **kwargs):
+        with SingleProfile.lock:
+            if SingleProfile.owner is not None:
+                raise ValueError("Another profiling tool is already active")
+            SingleProfile.owner = self
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        with SingleProfile.lock:
+            if SingleProfile.owner is self:
+                SingleProfile.owner = None
+
+
+@pytest.fixture
+def profiled(workspace, monkeypatch):
+    generate_corpus.generate_corpus(docs=30, seed=1)
+    monkeypatch.setattr(cProfile, "Profile", SingleProfile)
+    monkeypatch.setattr(profiling.PROFILER, "directory", None)
+    directory = str(workspace / "profile")
+    profiling.enable(directory)
+    yield directory
+    profiling.PROFILER.reset()
+
+
+def test_thread_workers_share_the_one_profiler(profiled, monkeypatch):
+    monkeypatch.setattr(profiling, "ONE_PROFILER_PER_PROCESS", True)
+    summary = pipeline.run_pipeline(workers=4, executor="thread", copy_to_plugin=False)
+
+    assert summary["snippets"]
+    assert profiling.write_profiles()
+    assert os.path.isfile(os.path.join(profiled, "plan.prof"))
+
+
+def test_stage_runs_unprofiled_when_the_profiler_is_taken(profiled):
+    other = SingleProfile()
+    other.enable()
+    try:
+        with profiling.stage("plan"):
+            pass
+    finally:
+        other.disable()
+    assert metrics.RUN.counters["profile.stages_skipped"] == 1
+    assert profiling.PROFILER.active == set()
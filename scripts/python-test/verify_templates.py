@@ -0,0 +1,274 @@
+import config
+import argparse
+import os
+import xml.etree.ElementTree as ET
+
+import manifest
+import metrics
+import record_store
+import write_to_template
+
+logger = metrics.get_logger(__name__)
+
+# What every template's context has to be, see write_to_template.serialize_snippet
+CONTEXT_OPTIONS = {"JavaScript": "true", "TypeScript": "true"}
+
+TEMPLATE_ATTRIBUTES = {
+    "name",
+    "value",
+    "description",
+    "toReformat",
+    "toShortenFQNames",
+}
+
+# (file name, template name prefix, record field) of both template sets
+TEMPLATE_SETS = (
+    (write_to_template.IMPORT_SNIPPETS_FILE, "cni-", "import"),
+    (write_to_template.USAGE_SNIPPETS_FILE, "cnu-", "usage"),
+)
+
+# Problems past this many are only counted, a broken run doesn't fill the memory
+MAX_PROBLEMS = 1000
+
+
+class VerifyResult:
+    """
+    What verifying template sets found. problems holds (file_path, template name or
+    None, message) tuples, up to MAX_PROBLEMS of them, problem_count counts them all.
+    """
+
+    def __init__(self):
+        self.templates = 0
+        self.problems = []
+        self.problem_count = 0
+
+    def add(self, file_path, name, message):
+        self.problem_count += 1
+        metrics.count("verify.problems")
+        if len(self.problems) < MAX_PROBLEMS:
+            self.problems.append((file_path, name, message))
+
+    @property
+    def ok(self):
+        return self.problem_count == 0
+
+
+def iter_templates(file_path, result):
+    """
+    Parses a templateSet file with iterparse, yielding each template element once
+    it's complete. Elements are cleared as soon as the caller is done with them, so
+    memory stays flat however many templates there are.
+    """
+    root = None
+    try:
+        for event, element in ET.iterparse(file_path, events=("start", "end")):
+            if root is None:
+                root = element
+                if element.tag != "templateSet":
+                    result.add(file_path, None, f"Root is <{element.tag}>.")
+                    return
+                if not element.get("group"):
+                    result.add(file_path, None, "templateSet has no group.")
+                continue
+            if event == "end" and element.tag == "template":
+                yield element
+                root.clear()
+    except ET.ParseError as e:
+        result.add(file_path, None, f"Not well-formed XML: {e}")
+
+
+def check_template(file_path, template, prefix, result):
+    # Everything that can be checked on one template on its own, returns its name
+    attrib = template.attrib
+    name = attrib.get("name")
+    if not name:
+        result.add(file_path, None, "Template without a name.")
+        return None
+    if not name.startswith(prefix) or len(name) == len(prefix):
+        result.add(file_path, name, f"Name doesn't start with {prefix}.")
+
+    if len(attrib) != len(TEMPLATE_ATTRIBUTES) or not TEMPLATE_ATTRIBUTES.issuperset(
+        attrib
+    ):
+        missing = sorted(TEMPLATE_ATTRIBUTES.difference(attrib))
+        extra = sorted(set(attrib).difference(TEMPLATE_ATTRIBUTES))
+        result.add(file_path, name, f"Missing {missing}, unexpected {extra}.")
+    for attribute in ("value", "description"):
+        value = attrib.get(attribute)
+        if value is not None and (not value or value.isspace()):
+            result.add(file_path, name, f"Empty {attribute}.")
+
+    if len(template) != 1 or template[0].tag != "context":
+        result.add(file_path, name, "Needs exactly one context and nothing else.")
+        return name
+    context = template[0]
+    options = {
+        option.get("name"): option.get("value")
+        for option in context
+        if option.tag == "option"
+    }
+    if len(options) != len(context):
+        result.add(file_path, name, "Context has a stray or repeated option.")
+    if options != CONTEXT_OPTIONS:
+        result.add(file_path, name, f"Context options are {options}.")
+    return name
+
+
+def iter_shard_records(store, shard, shards):
+    # The records of one template shard in name order
+    if shards == 1:
+        yield from store.scan()
+        return
+    for data in store.scan():
+        if write_to_template.shard_for_name(data["name"], shards) == shard:
+            yield data
+
+
+def verify_template_file(
+    file_path, prefix, field, result, shard=0, shards=1, store=None
+):
+    """
+    Streams one templateSet file through the checks. Templates have to come in
+    strictly increasing name order, which also makes every name unique without
+    remembering the names seen. With a record_store.RecordStore the templates are
+    matched up with the records of the shard as both go, so every record needs
+    exactly one template with the same value and the other way around.
+    """
+    records = None
+    record = None
+    if store is not None:
+        records = iter_shard_records(store, shard, shards)
+        record = next(records, None)
+
+    previous = None
+    for template in iter_templates(file_path, result):
+        result.templates += 1
+        name = check_template(file_path, template, prefix, result)
+        if name is None:
+            continue
+        component = name[len(prefix) :]
+
+        if previous is not None and name <= previous:
+            problem = "Duplicate name." if name == previous else "Out of name order."
+            result.add(file_path, name, problem)
+        else:
+            previous = name
+        if shards > 1 and write_to_template.shard_for_name(component, shards) != shard:
+            result.add(file_path, name, "Belongs in another shard.")
+
+        if records is None:
+            continue
+        while record is not None and record["name"] < component:
+            result.add(file_path, prefix + record["name"], "Record has no template.")
+            record = next(records, None)
+        if record is None or record["name"] != component:
+            result.add(file_path, name, "No record for this template.")
+            continue
+        if template.get("value") != record[field]:
+            result.add(file_path, name, f"Value differs from the record's {field}.")
+        record = next(records, None)
+
+    while record is not None:
+        result.add(file_path, prefix + record["name"], "Record has no template.")
+        record = next(records, None)
+
+
+def verify_templates(
+    directory=config.DIR_GENERATED_LIVE_TEMPLATES,
+    shards=1,
+    store_path=config.RECORD_STORE_FILE,
+):
+    """
+    Verifies the import and usage template sets in directory, against the record
+    store unless store_path is None. Returns a VerifyResult.
+    """
+    result = VerifyResult()
+    store = None
+    if store_path is not None:
+        if not os.path.isfile(store_path):
+            result.add(store_path, None, "Record store doesn't exist.")
+            return result
+        store = record_store.RecordStore(store_path)
+    try:
+        with metrics.timer("stage.verify_templates"):
+            for file_name, prefix, field in TEMPLATE_SETS:
+                for shard in range(shards):
+                    file_path = os.path.join(
+                        directory,
+                        write_to_template.get_shard_file_name(file_name, shard, shards),
+                    )
+                    if not os.path.isfile(file_path):
+                        result.add(file_path, None, "Template set doesn't exist.")
+                        continue
+                    verify_template_file(
+                        file_path, prefix, field, result, shard, shards, store
+                    )
+    finally:
+        if store is not None:
+            store.close()
+    metrics.count("verify.templates", result.templates)
+    return result
+
+
+def log_result(result):
+    for file_path, name, message in result.problems:
+        if name is None:
+            logger.error("%s: %s", file_path, message)
+        else:
+            logger.error("%s: %s: %s", file_path, name, message)
+    if result.problem_count > len(result.problems):
+        logger.error(
+            "... and %d more problems", result.problem_count - len(result.problems)
+        )
+    if result.ok:
+        logger.info("%d templates verified", result.templates)
+    else:
+        logger.error(
+            "%d problems in %d templates", result.problem_count, result.templates
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="VerifyTemplates",
+        description="Check the generated live templates before the IDE gets to see them.",
+    )
+    parser.add_argument(
+        "--directory",
+        default=config.DIR_GENERATED_LIVE_TEMPLATES,
+        help="Folder with the template sets.",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="How many files each set is split over, defaults to what the last "
+        "pipeline run used.",
+    )
+    parser.add_argument("--store", default=config.RECORD_STORE_FILE)
+    parser.add_argument(
+        "--no-records",
+        help="Only check the templates themselves, not against the record store.",
+        action="store_true",
+    )
+    metrics.add_verbosity_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_logging(metrics.get_verbosity(args))
+
+    shards = args.shards
+    if shards is None:
+        shards = (manifest.read_manifest_options() or {}).get("shards", 1)
+    if shards < 1 or shards > len(write_to_template.SHARD_ALPHABET):
+        parser.error(
+            f"--shards needs to be between 1 and {len(write_to_template.SHARD_ALPHABET)}."
+        )
+
+    result = verify_templates(
+        args.directory, shards, None if args.no_records else args.store
+    )
+    log_result(result)
+    if not result.ok:
+        parser.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import config
+import argparse
+import os
+import re
+
+import check_component_docs
+import content_store
+import extract_defaults
+import git_source
+import mapped_docs
+import metrics
+import overlay_index
+import write_to_template
+
+logger = metrics.get_logger(__name__)
+
+
+def analyse_upstream_doc(filename, content):
+    # Everything about an upstream doc that only depends on its content
+    is_good, entry = check_component_docs.check_doc_text(filename, filename, content)
+    if not is_good:
+        return {"verdict": [False, entry[2]], "record": None}
+
+    record = extract_defaults.extract_record_from_content(
+        overlay_index.get_component_name(filename), entry[2]
+    )
+    if record is not None:
+        record = {"import": record["import"], "usage": record["usage"]}
+    return {"verdict": [True, None], "record": record}
+
+
+def analyse_manual_doc(filename, content):
+    record = extract_defaults.extract_record_from_content(
+        overlay_index.get_component_name(filename), content
+    )
+    if record is not None:
+        record = {"import": record["import"], "usage": record["usage"]}
+    return {"record": record}
+
+
+class ManualDocs:
+    """
+    The hand written docs for components upstream gets wrong, the same folder
+    serves every version, so each one is only read once per run.
+    """
+
+    def __init__(self, store, directory=config.DIR_MANUAL_DOCS):
+        self.store = store
+        self.directory = directory
+        self.records = {}
+
+    def filenames(self):
+        # Every manual doc, a component can have one without being upstream at all
+        return set(overlay_index.list_doc_files(self.directory))
+
+    def get_record(self, filename):
+        if filename not in self.records:
+            self.records[filename] = self.load_record(filename)
+        return self.records[filename]
+
+    def load_record(self, filename):
+        file_path = os.path.join(self.directory, filename)
+        try:
+            with open(file_path, "rb") as file:
+                metrics.count_read(file)
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            content = mapped_docs.decode(data)
+        except UnicodeDecodeError as e:
+            logger.error("Error checking content in %s: %s", file_path, e)
+            metrics.count("check.files_failed")
+            metrics.fail_with(file_path, e)
+            return None
+        entry = self.store.get_or_create(
+            "manual:" + content_store.content_key(data),
+            lambda: analyse_manual_doc(filename, content),
+        )
+        return entry["record"]
+
+
+class OverrideDocs(ManualDocs):
+    """
+    The override layer of overlay_index. A team's own doc for a component beats
+    the upstream and the manual doc in every version, same as in
+    pipeline.resolve_doc_path.
+    """
+
+    def __init__(self, store, index=None):
+        super().__init__(store, config.DIR_OVERRIDE_DOCS)
+        if index is None:
+            # Only the override layer, the other layers don't depend on the version
+            index = overlay_index.OverlayIndex(overlay_index.DOC_LAYERS[:1])
+            index.refresh()
+        self.components = index.components["override"]
+
+    def filenames(self):
+        return set(self.components.values())
+
+    def get_filename(self, filename):
+        # The override doc of the filename's component, or None
+        return self.components.get(overlay_index.get_component_name(filename))
+
+
+def get_version_directory(output_root, ref):
+    # Refs like release/1.2 turn into one folder
+    return os.path.join(output_root, re.sub(r"[^\w.-]+", "_", ref))
+
+
+def build_version(
+    source,
+    store,
+    manual_docs,
+    output_directory,
+    shards=1,
+    group_per_shard=False,
+    override_docs=None,
+):
+    """
+    Writes the template sets of one upstream version. Docs the store already
+    knows are never read, the sets are assembled from the stored records.
+    Manual docs serve every version, the ones without an upstream doc are in
+    every set, same as pipeline.py --git-repo includes them. So do the override
+    docs of override_docs (an OverrideDocs), which also replace the upstream and
+    manual doc of their component. Auto docs aren't looked at, they follow
+    whatever upstream the pipeline last ran on. A component with several docs
+    gets its record from one of them, same as pipeline.get_record_filenames.
+
+    :return: Summary dict of the version.
+    """
+    records = {}
+    summary = {
+        "ref": source.ref,
+        "commit": source.commit,
+        "docs": 0,
+        "parsed": 0,
+        "bad": [],
+    }
+
+    def analyse(filename):
+        summary["parsed"] += 1
+        return analyse_upstream_doc(filename, source.read_text(filename))
+
+    filenames = set(source.blobs) | manual_docs.filenames()
+    if override_docs is not None:
+        # An override is a doc of its own when nothing else has the component,
+        # same as pipeline.attach_override_sources
+        components = {overlay_index.get_component_name(name) for name in filenames}
+        filenames.update(
+            filename
+            for filename in override_docs.filenames()
+            if overlay_index.get_component_name(filename) not in components
+        )
+
+    for filename in sorted(filenames):
+        if check_component_docs.check_extension(filename, filename) is not None:
+            continue
+        summary["docs"] += 1
+
+        checked = False
+
+        override = None
+        if override_docs is not None:
+            override = override_docs.get_filename(filename)
+        if override is not None:
+            record = override_docs.get_record(override)
+        elif filename in source.blobs:
+            try:
+                entry = store.get_or_create(
+                    "upstream:" + source.blobs[filename],
+                    lambda: analyse(filename),
+                )
+            except UnicodeDecodeError as e:
+                # Same as a local doc that can't be read, it's left out of this version
+                key = source.key(filename)
+                logger.error("Error checking content in %s: %s", key, e)
+                metrics.count("check.files_failed")
+                metrics.fail_with(key, e)
+                continue
+            is_good, reason = entry["verdict"]
+            record = entry["record"]
+            checked = is_good
+            if not is_good:
+                summary["bad"].append((filename, reason))
+                record = manual_docs.get_record(filename)
+        else:
+            record = manual_docs.get_record(filename)
+        if record is None:
+            continue
+        name = overlay_index.get_component_name(filename)
+        precedence = overlay_index.doc_precedence(filename, checked)
+        if name not in records or precedence < records[name][0]:
+            records[name] = (precedence, {"name": name, **record})
+
+    os.makedirs(output_directory, exist_ok=True)
+    write_to_template.write_records(
+        (records[name][1] for name in sorted(records)),
+        output_directory,
+        shards,
+        group_per_shard,
+    )
+
+    summary["snippets"] = len(records)
+    summary["output"] = output_directory
+    return summary
+
+
+def build_versions(
+    repo_dir,
+    refs,
+    docs_path=config.GIT_DOCS_PATH,
+    output_root=config.DIR_GENERATED_VERSIONS,
+    store_path=config.CONTENT_STORE_FILE,
+    max_store_bytes=content_store.DEFAULT_MAX_BYTES,
+    shards=1,
+    group_per_shard=False,
+):
+    # Builds the template sets of several upstream refs side by side, every
+    # distinct doc is only parsed once across all of them and across runs
+    summaries = []
+    with content_store.ContentStore(store_path, max_store_bytes) as store:
+        manual_docs = ManualDocs(store)
+        override_docs = OverrideDocs(store)
+        for ref in refs:
+            with git_source.GitSource(repo_dir, ref, docs_path) as source:
+                with metrics.timer("stage.build_version"):
+                    summary = build_version(
+                        source,
+                        store,
+                        manual_docs,
+                        get_version_directory(output_root, ref),
+                        shards,
+                        group_per_shard,
+                        override_docs,
+                    )
+            logger.info(
+                "%s (%s): %d docs, %d parsed, %d snippets -> %s",
+                ref,
+                source.commit[:12],
+                summary["docs"],
+                summary["parsed"],
+                summary["snippets"],
+                summary["output"],
+            )
+            summaries.append(summary)
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Versions",
+        description="Generate the snippet sets of several shadcn/ui versions side by side.",
+    )
+    parser.add_argument(
+        "--git-repo",
+        metavar="PATH",
+        required=True,
+        help="The shadcn/ui git repository to read the docs from.",
+    )
+    parser.add_argument(
+        "--ref",
+        action="append",
+        required=True,
+        help="Branch, tag or commit to build, repeat it for every version.",
+    )
+    parser.add_argument(
+        "--git-docs-path",
+        default=config.GIT_DOCS_PATH,
+        help="Folder of the component docs inside the git repository.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=config.DIR_GENERATED_VERSIONS,
+        help="Folder that gets a template folder per version.",
+    )
+    parser.add_argument(
+        "--store",
+        default=config.CONTENT_STORE_FILE,
+        help="Content store file, parse results in it are reused across runs.",
+    )
+    parser.add_argument(
+        "--store-size",
+        type=float,
+        default=content_store.DEFAULT_MAX_BYTES / 1024 / 1024,
+        help="Size the store is kept under in MB, least recently used docs go first.",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split each template set over this many files by component name prefix.",
+    )
+    parser.add_argument(
+        "--group-per-shard",
+        help="Give every shard its own template group instead of sharing one.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="Write counters and timings of the run as JSON.",
+    )
+    metrics.add_verbosity_arguments(parser)
+    args = parser.parse_args()
+    # Same as watch, the per-version lines are what this is run for
+    metrics.configure_logging(-1 if args.quiet else max(1, args.verbose))
+
+    if args.shards < 1 or args.shards > len(write_to_template.SHARD_ALPHABET):
+        parser.error(
+            f"--shards needs to be between 1 and {len(write_to_template.SHARD_ALPHABET)}."
+        )
+
+    try:
+        summaries = build_versions(
+            args.git_repo,
+            args.ref,
+            docs_path=args.git_docs_path,
+            output_root=args.output,
+            store_path=args.store,
+            max_store_bytes=int(args.store_size * 1024 * 1024),
+            shards=args.shards,
+            group_per_shard=args.group_per_shard,
+        )
+    except git_source.GitError as e:
+        parser.error(str(e))
+
+    if args.report:
+        metrics.write_report(args.report, {"versions": summaries})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+import config
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+import emitters
+import manifest
+import metrics
+import move_templates_to_plugin
+import overlay_index
+import pipeline
+import record_store
+import write_to_template
+
+logger = metrics.get_logger(__name__)
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct("iIII")
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def is_ignored(filename):
+    # Editor swap and backup files
+    return filename.startswith(".") or filename.endswith("~")
+
+
+class InotifyWatcher:
+    def __init__(self, directories):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("Could not find libc.")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available.")
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed.")
+
+        self.directories = {}
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), WATCH_MASK
+            )
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"Could not watch {directory}.")
+            self.directories[wd] = directory
+
+    def read_changes(self, timeout):
+        # Returns the filenames touched within the timeout, empty if nothing happened
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset : offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if name:
+                    changed.add(os.fsdecode(name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self, directories, interval=0.25):
+        self.directories = directories
+        self.interval = interval
+        self.signatures = self.scan()
+
+    def scan(self):
+        signatures = {}
+        for filename, paths in manifest.scan_sources(self.directories).items():
+            signatures[filename] = sorted(
+                (file_path, tuple(signature)) for file_path, signature in paths.items()
+            )
+        return signatures
+
+    def read_changes(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            signatures = self.scan()
+            changed = {
+                filename
+                for filename in set(signatures) | set(self.signatures)
+                if signatures.get(filename) != self.signatures.get(filename)
+            }
+            self.signatures = signatures
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+def create_watcher(directories, poll=False, interval=0.25):
+    if not poll:
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            logger.warning("inotify not available (%s), falling back to polling.", e)
+    return PollingWatcher(directories, interval)
+
+
+def wait_for_changes(watcher, debounce):
+    # Blocks until something changed and then stayed quiet for the debounce time
+    changed = set()
+    while not changed:
+        changed = watcher.read_changes(1.0)
+    while True:
+        more = watcher.read_changes(debounce)
+        if not more:
+            break
+        changed |= more
+    return {filename for filename in changed if not is_ignored(filename)}
+
+
+def get_template_file_path(file_name, name, options):
+    shards = options.get("shards", 1)
+    shard = write_to_template.shard_for_name(name, shards)
+    return os.path.join(
+        config.DIR_GENERATED_LIVE_TEMPLATES,
+        write_to_template.get_shard_file_name(file_name, shard, shards),
+    )
+
+
+def patch_templates(previous_record, record, options):
+    # Swaps the templates of one component in place, returns the patched files
+    patched = set()
+    for prefix, file_name, key in (
+        ("cni-", write_to_template.IMPORT_SNIPPETS_FILE, "import"),
+        ("cnu-", write_to_template.USAGE_SNIPPETS_FILE, "usage"),
+    ):
+        if previous_record is not None and (
+            record is None or previous_record["name"] != record["name"]
+        ):
+            file_path = get_template_file_path(
+                file_name, previous_record["name"], options
+            )
+            write_to_template.patch_template_set(
+                file_path, prefix + previous_record["name"], None
+            )
+            patched.add(file_path)
+
+        if record is not None and record != previous_record:
+            desc = f"https://ui.shadcn.com/docs/components/{record['name']}"
+            file_path = get_template_file_path(file_name, record["name"], options)
+            write_to_template.patch_template_set(
+                file_path,
+                prefix + record["name"],
+                write_to_template.serialize_snippet(
+                    prefix + record["name"], record[key], desc
+                ),
+            )
+            patched.add(file_path)
+    return patched
+
+
+def get_component_docs(docs, components):
+    return {
+        filename: entry
+        for filename, entry in docs.items()
+        if overlay_index.get_component_name(filename) in components
+    }
+
+
+def get_component_records(docs, components):
+    # The record each of the components gets from its docs, see
+    # pipeline.get_record_filenames
+    component_docs = get_component_docs(docs, components)
+    return {
+        component_docs[filename]["record"]["name"]: component_docs[filename]["record"]
+        for filename in pipeline.get_record_filenames(component_docs)
+    }
+
+
+def update_components(filenames, build_manifest, index, copy_to_plugin=True):
+    # Runs check -> extract -> template -> copy for just the given docs
+    docs = build_manifest["docs"]
+    options = build_manifest["options"]
+
+    # An override doc can have another extension than the doc it overrides,
+    # so everything with the same component name gets another look
+    index.refresh()
+    components = {overlay_index.get_component_name(filename) for filename in filenames}
+    filenames = sorted(
+        set(filenames)
+        | {
+            filename
+            for filename in docs
+            if overlay_index.get_component_name(filename) in components
+        }
+    )
+
+    sources = {}
+    for filename in filenames:
+        for directory in manifest.SOURCE_DIRS:
+            file_path = os.path.join(directory, filename)
+            if os.path.isfile(file_path):
+                sources.setdefault(filename, {})[file_path] = manifest.stat_signature(
+                    file_path
+                )
+    pipeline.attach_override_sources(sources, index)
+    sources = {
+        filename: signatures
+        for filename, signatures in sources.items()
+        if overlay_index.get_component_name(filename) in components
+    }
+
+    subset = {filename: docs[filename] for filename in filenames if filename in docs}
+    dirty, removed = pipeline.plan_rebuild(subset, sources, incremental=True)
+
+    # The IntelliJ sets are patched in place, the other formats are cheap enough
+    # to write again from the records in the manifest
+    formats = options.get("formats", emitters.DEFAULT_EMITTERS)
+    patch = "intellij" in formats
+    other_formats = [name for name in formats if name != "intellij"]
+
+    previous_records = get_component_records(docs, components)
+    for filename in removed:
+        del docs[filename]
+    for filename in dirty:
+        result = pipeline.process_component(filename, index=index, formats=[])
+        docs[filename] = pipeline.describe_result(
+            result, docs.get(filename), index=index
+        )
+    records = get_component_records(docs, components)
+    if options.get("write_jsons", False):
+        component_docs = get_component_docs(docs, components)
+        pipeline.write_record_jsons(
+            component_docs, pipeline.get_record_filenames(component_docs), dirty
+        )
+
+    names = {
+        name for name in components if previous_records.get(name) != records.get(name)
+    }
+    records_changed = bool(names)
+    patched = set()
+    if patch:
+        for name in sorted(names):
+            patched |= patch_templates(
+                previous_records.get(name), records.get(name), options
+            )
+
+    if records_changed:
+        with record_store.RecordStore() as store:
+            store.plan(
+                (records[name] for name in sorted(names) if name in records),
+                scope=names,
+            ).apply()
+
+    rewritten = []
+    if records_changed and other_formats:
+        rewritten = emitters.write_records(
+            (
+                docs[filename]["record"]
+                for filename in pipeline.get_record_filenames(docs)
+            ),
+            other_formats,
+        )
+        # Forget what the other formats wrote before, Sublime drops files on the way
+        kept = set(emitters.get_file_paths(["intellij"], options.get("shards", 1)))
+        build_manifest["templates"] = {
+            file_path: description
+            for file_path, description in build_manifest["templates"].items()
+            if file_path in kept
+        }
+
+    for file_path in [*patched, *rewritten]:
+        build_manifest["templates"][file_path] = manifest.describe_file(file_path)
+
+    if patched and copy_to_plugin:
+        move_templates_to_plugin.sync_files(
+            sorted(patched), config.DIR_PLUGIN_RESOURCE_FOLDER
+        )
+
+    return dirty, removed
+
+
+def watch(
+    poll=False,
+    interval=0.25,
+    debounce=0.05,
+    copy_to_plugin=True,
+    manifest_path=config.MANIFEST_FILE,
+):
+    # Keeps the same options the last pipeline run used
+    options = manifest.read_manifest_options(manifest_path) or {}
+    pipeline.run_pipeline(
+        workers=1,
+        copy_to_plugin=copy_to_plugin,
+        incremental=True,
+        manifest_path=manifest_path,
+        **options,
+    )
+    # The run fills in defaults for options a first run didn't have
+    options = manifest.read_manifest_options(manifest_path)
+    build_manifest = manifest.load_manifest(manifest_path, options)
+
+    index = overlay_index.load_index()
+    directories = [
+        directory
+        for directory in (*manifest.SOURCE_DIRS, config.DIR_OVERRIDE_DOCS)
+        if os.path.isdir(directory)
+    ]
+    watcher = create_watcher(directories, poll, interval)
+    logger.info("Watching %s", ", ".join(directories))
+
+    try:
+        while True:
+            filenames = wait_for_changes(watcher, debounce)
+            if not filenames:
+                continue
+
+            started = time.perf_counter()
+            dirty, removed = update_components(
+                sorted(filenames), build_manifest, index, copy_to_plugin
+            )
+            manifest.save_manifest(build_manifest, manifest_path)
+            if dirty or removed:
+                logger.info(
+                    "Updated %s in %.0f ms",
+                    ", ".join(dirty + removed),
+                    (time.perf_counter() - started) * 1000,
+                )
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Watch",
+        description="Regenerate the snippets of a component as soon as its doc changes.",
+    )
+    parser.add_argument(
+        "--poll",
+        help="Poll the doc folders instead of using inotify.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.25,
+        help="Seconds between scans when polling.",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.05,
+        help="Seconds to wait for more changes before regenerating.",
+    )
+    parser.add_argument(
+        "--no-copy",
+        help="Don't copy the patched templates into the plugin resource folder.",
+        action="store_true",
+    )
+    metrics.add_verbosity_arguments(parser)
+    args = parser.parse_args()
+    # Progress is the whole point of watching, so it's on unless asked to be quiet
+    metrics.configure_logging(-1 if args.quiet else max(1, args.verbose))
+
+    # Stop cleanly when run as a background service too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    watch(
+        poll=args.poll,
+        interval=args.interval,
+        debounce=args.debounce,
+        copy_to_plugin=not args.no_copy,
+    )
+
+
+if __name__ == "__main__":
+    main()
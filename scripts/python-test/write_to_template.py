@@ -1,4 +1,9 @@
+import bulk_read
 import config
+import metrics
+import profiling
+import reconcile
+import record_store
 import xml.etree.ElementTree as ET
 import os
 import json
@@ -6,6 +11,13 @@ import argparse
 from pathlib import Path
 import sys
 
+logger = metrics.get_logger(__name__)
+
+IMPORT_GROUP = "shadcn/ui-imports"
+USAGE_GROUP = "shadcn/ui-usage"
+IMPORT_SNIPPETS_FILE = "shadcn-ui-import-snippets.xml"
+USAGE_SNIPPETS_FILE = "shadcn-ui-usage-snippets.xml"
+
 
 def create_template_xml(group, name, value, desc):
     # Create the root element
@@ -23,7 +35,7 @@ def create_template_xml(group, name, value, desc):
             "toShortenFQNames": "true",
         },
     )
-    print(template.get("value"))
+    logger.debug("%s", template.get("value"))
     # Add the 'context' element
     context = ET.SubElement(template, "context")
 
@@ -54,31 +66,51 @@ def escape_for_template(input_string):
 
 
 def get_json_files_from_dir(directory):
-    print("Checking directory...")
+    logger.debug("Checking directory...")
 
     path = Path(directory)
     if not path.is_dir():
-        print(f"Error: '{directory}' is not a valid directory.")
+        logger.error("Error: '%s' is not a valid directory.", directory)
         sys.exit(1)
 
     doc_files = []
-    for item in path.iterdir():
+    # By stem, so the records come out in name order (button before button-group)
+    for item in sorted(path.iterdir(), key=lambda item: item.stem):
         if item.is_file() and (item.suffix == ".json"):  # Check for .json file
             doc_files.append(item)
 
-    print(f"JSON files found in '{directory}':")
+    logger.info("%d JSON files found in '%s'", len(doc_files), directory)
     for doc_file in doc_files:
-        print(doc_file)
-
-    # TODO : should check if they are valid
+        logger.debug("%s", doc_file)
 
     return doc_files
 
 
-def create_snippet_xml(root, name, value, desc):
-    # Add the 'template' child with attributes
-    snippet = ET.SubElement(
-        root,
+def iter_json_records(directory):
+    # The JSONs are read ahead in bulk while earlier ones are being written
+    reads = bulk_read.read_files(get_json_files_from_dir(directory))
+    try:
+        for read in reads:
+            try:
+                yield record_store.validate_record(json.loads(read.text()))
+            except (ValueError, OSError) as e:
+                logger.error("Skipping invalid record %s: %s", read.path, e)
+                metrics.count("template.invalid_records")
+    finally:
+        reads.close()
+
+
+def iter_jsonl_records(jsonl_path):
+    # Reads back the records written by extract_defaults.tee_records_to_jsonl
+    with open(jsonl_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def create_snippet(name, value, desc):
+    # Create a detached 'template' element with attributes
+    snippet = ET.Element(
         "template",
         attrib={
             "name": name,
@@ -98,7 +130,274 @@ def create_snippet_xml(root, name, value, desc):
     return snippet
 
 
-def write_to_template():
+def create_snippet_xml(root, name, value, desc):
+    snippet = create_snippet(name, value, desc)
+    root.append(snippet)
+    return snippet
+
+
+def escape_attribute(value):
+    # Same escaping ElementTree applies to attribute values
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    value = value.replace('"', "&quot;").replace("\r", "&#13;")
+    return value.replace("\n", "&#10;").replace("\t", "&#09;")
+
+
+def serialize_snippet(name, value, desc):
+    # Serialises a template straight to bytes, byte for byte what create_snippet
+    # gives through ElementTree but without building any elements
+    return (
+        f'<template name="{escape_attribute(name)}" value="{escape_attribute(value)}" '
+        f'description="{escape_attribute(desc)}" toReformat="true" toShortenFQNames="true">'
+        '<context><option name="JavaScript" value="true" />'
+        '<option name="TypeScript" value="true" /></context></template>'
+    ).encode("utf-8")
+
+
+def serialize_snippets_for_record(data):
+    # Returns the serialised (import, usage) templates for a {name, import, usage} record
+    name = data["name"]
+    desc = f"https://ui.shadcn.com/docs/components/{name}"
+    return (
+        serialize_snippet(f"cni-{name}", data["import"], desc),
+        serialize_snippet(f"cnu-{name}", data["usage"], desc),
+    )
+
+
+class TemplateSetWriter:
+    """
+    Writes a templateSet file one template at a time, so nothing but the
+    current template is ever held in memory.
+    The set goes into a temp file that only replaces file_path once it's complete,
+    so readers (or a hardlinked copy in the plugin) never see half a file. A set
+    that comes out the same as the one on disk isn't written at all, see
+    reconcile.ChangedFileWriter.
+    """
+
+    def __init__(self, file_path, group):
+        self.file_path = file_path
+        self.open_tag = f'<templateSet group="{escape_attribute(group)}"'.encode(
+            "utf-8"
+        )
+        self.count = 0
+        self.file = reconcile.ChangedFileWriter(file_path)
+
+    def write(self, snippet):
+        if self.count == 0:
+            self.file.write(self.open_tag + b">")
+        self.file.write(snippet)
+        self.count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        # ElementTree writes an empty set as a self-closing element
+        if self.count == 0:
+            self.file.write(self.open_tag + b" />")
+        else:
+            self.file.write(b"</templateSet>")
+        if self.file.close() == "unchanged":
+            metrics.count("template.files_unchanged")
+
+    def abort(self):
+        # Drops the unfinished set and leaves whatever was at file_path alone
+        self.file.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# Names are sharded by their first character, so every shard covers a
+# contiguous range of the alphabet
+SHARD_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def shard_for_name(name, shards):
+    position = SHARD_ALPHABET.find(name[:1].lower())
+    return max(position, 0) * shards // len(SHARD_ALPHABET)
+
+
+def shard_label(shard, shards):
+    # The range of first characters that ends up in a shard, e.g. "a-f"
+    chars = [
+        char
+        for position, char in enumerate(SHARD_ALPHABET)
+        if position * shards // len(SHARD_ALPHABET) == shard
+    ]
+    return f"{chars[0]}-{chars[-1]}"
+
+
+def get_shard_file_name(file_name, shard, shards):
+    if shards == 1:
+        return file_name
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem}-{shard + 1}-of-{shards}{extension}"
+
+
+class ShardedTemplateSetWriter:
+    """
+    Splits one templateSet over several files by component name prefix.
+    With group_per_shard each file also gets its own group, e.g. "shadcn/ui-usage (a-f)",
+    otherwise they all share the group and the IDE merges them.
+    """
+
+    def __init__(self, directory, file_name, group, shards=1, group_per_shard=False):
+        if shards < 1 or shards > len(SHARD_ALPHABET):
+            raise ValueError(
+                f"Shards need to be between 1 and {len(SHARD_ALPHABET)}, got {shards}."
+            )
+        self.shards = shards
+        self.writers = []
+        for shard in range(shards):
+            shard_group = group
+            if group_per_shard and shards > 1:
+                shard_group = f"{group} ({shard_label(shard, shards)})"
+            self.writers.append(
+                TemplateSetWriter(
+                    os.path.join(
+                        directory, get_shard_file_name(file_name, shard, shards)
+                    ),
+                    shard_group,
+                )
+            )
+
+    @property
+    def file_paths(self):
+        return [writer.file_path for writer in self.writers]
+
+    def write(self, name, snippet):
+        self.writers[shard_for_name(name, self.shards)].write(snippet)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def get_template_file_paths(directory, shards=1):
+    return [
+        os.path.join(directory, get_shard_file_name(file_name, shard, shards))
+        for file_name in (IMPORT_SNIPPETS_FILE, USAGE_SNIPPETS_FILE)
+        for shard in range(shards)
+    ]
+
+
+def split_template_set(data):
+    # Splits a written templateSet into its open tag and a list of (name, template) pairs
+    # Attribute values are escaped, so the markers can't show up inside a template
+    head_end = data.index(b">") + 1
+    if data[:head_end].endswith(b"/>"):
+        return data[: head_end - 2].rstrip(), []
+
+    open_tag = data[: head_end - 1]
+    templates = []
+    position = data.find(b"<template ", head_end)
+    while position != -1:
+        end = data.index(b"</template>", position) + len(b"</template>")
+        name_start = data.index(b'name="', position) + len(b'name="')
+        name = data[name_start : data.index(b'"', name_start)]
+        templates.append((name, data[position:end]))
+        position = data.find(b"<template ", end)
+    return open_tag, templates
+
+
+def patch_template_set(file_path, name, snippet):
+    """
+    Replaces one template in a written templateSet, without rewriting the rest of the set
+    from records. New templates are inserted in name order.
+
+    :param file_path: The templateSet XML file.
+    :param name: The template name, e.g. cnu-button.
+    :param snippet: The serialised template, or None to remove it.
+    """
+    with open(file_path, "rb") as file:
+        open_tag, templates = split_template_set(file.read())
+
+    key = escape_attribute(name).encode("utf-8")
+    templates = [template for template in templates if template[0] != key]
+    if snippet is not None:
+        position = 0
+        while position < len(templates) and templates[position][0] < key:
+            position += 1
+        templates.insert(position, (key, snippet))
+
+    with reconcile.ChangedFileWriter(file_path) as file:
+        if templates:
+            file.write(open_tag + b">")
+            for _, template in templates:
+                file.write(template)
+            file.write(b"</templateSet>")
+        else:
+            file.write(open_tag + b" />")
+
+
+def write_snippet_set(file_path, group, snippets):
+    """
+    Writes already serialised template elements as one templateSet.
+
+    :param file_path: The XML file to write.
+    :param group: The templateSet group name.
+    :param snippets: Iterable of serialised template elements (bytes).
+    """
+    with TemplateSetWriter(file_path, group) as writer:
+        for snippet in snippets:
+            writer.write(snippet)
+
+
+def check_record_order(records):
+    # Passes records through as they come, the canonical template order is by
+    # component name. Nothing gets sorted here, the sources deliver that order (a
+    # record store scan, stream_defaults, iter_json_records), so a record out of
+    # order is a bug in its source
+    previous = None
+    for data in records:
+        if previous is not None and data["name"] < previous:
+            raise ValueError(
+                f"Record {data['name']} came after {previous}, "
+                "records need to be in name order."
+            )
+        previous = data["name"]
+        yield data
+
+
+def write_records(records, directory, shards=1, group_per_shard=False):
+    # Streams name ordered records into the import and usage template sets,
+    # returns the names of the written records
+    names = []
+    with ShardedTemplateSetWriter(
+        directory, IMPORT_SNIPPETS_FILE, IMPORT_GROUP, shards, group_per_shard
+    ) as import_writer, ShardedTemplateSetWriter(
+        directory, USAGE_SNIPPETS_FILE, USAGE_GROUP, shards, group_per_shard
+    ) as usage_writer:
+        for data in check_record_order(records):
+            import_snippet, usage_snippet = serialize_snippets_for_record(data)
+            import_writer.write(data["name"], import_snippet)
+            usage_writer.write(data["name"], usage_snippet)
+            names.append(data["name"])
+    return names
+
+
+@metrics.timed("stage.write_to_template")
+@profiling.profiled("write_to_template")
+def write_to_template(records=None, shards=1, group_per_shard=False):
     # parser = argparse.ArgumentParser(
     #     prog="ExtractDefaults",
     #     description="Extract the defaults (import and component) from a shadcn/ui component doc.",
@@ -115,38 +414,19 @@ def write_to_template():
     # args = parser.parse_args()
 
     # jsons = get_json_files_from_dir(args.target)
-    jsons = get_json_files_from_dir(config.DIR_GENERATED_JSONS)
-
-    import_root = ET.Element("templateSet", attrib={"group": "shadcn/ui-imports"})
-    usage_root = ET.Element("templateSet", attrib={"group": "shadcn/ui-usage"})
-
-    for path in jsons:
-        with open(path, "r", encoding="utf-8") as comp:
-            data = json.load(comp)
-            usage_code = data["usage"]
-            import_code = data["import"]
-            name = data["name"]
-            desc = f"https://ui.shadcn.com/docs/components/{name}"
-            create_snippet_xml(import_root, f"cni-{name}", import_code, desc)
-            create_snippet_xml(usage_root, f"cnu-{name}", usage_code, desc)
-
-    import_snippet_set = ET.ElementTree(import_root)
-    usage_snippet_set = ET.ElementTree(usage_root)
-
+    # records can be any iterable of {name, import, usage} records,
+    # e.g. extract_defaults.stream_defaults(), by default the record store is scanned
     os.makedirs(config.DIR_GENERATED_LIVE_TEMPLATES, exist_ok=True)
+    if records is not None:
+        write_records(
+            records, config.DIR_GENERATED_LIVE_TEMPLATES, shards, group_per_shard
+        )
+        return
 
-    with open(
-        os.path.join(
-            config.DIR_GENERATED_LIVE_TEMPLATES, "shadcn-ui-import-snippets.xml"
-        ),
-        "wb",
-    ) as file:
-        import_snippet_set.write(file, encoding="utf-8", xml_declaration=False)
-
-    with open(
-        os.path.join(
-            config.DIR_GENERATED_LIVE_TEMPLATES, "shadcn-ui-usage-snippets.xml"
-        ),
-        "wb",
-    ) as file:
-        usage_snippet_set.write(file, encoding="utf-8", xml_declaration=False)
+    with record_store.RecordStore() as store:
+        write_records(
+            store.scan(),
+            config.DIR_GENERATED_LIVE_TEMPLATES,
+            shards,
+            group_per_shard,
+        )